@@ -0,0 +1,68 @@
+# bench_startup.py - per-invocation startup cost of the CLI entry points
+#
+# Runs each entry point in a fresh interpreter several times and reports the
+# median wall time, plus the top cumulative imports from `python -X importtime`.
+# Use it before/after touching imports: short jobs and subprocess-launched
+# agents pay this cost on every run.
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TARGETS = {
+    "ocr_table_model --help": [os.path.join(BASE_DIR, "ocr_table_model.py"), "--help"],
+    "import ocr_table_model": ["-c", "import ocr_table_model"],
+    "import read_patient_list": ["-c", "import read_patient_list"],
+    "insert/main.py --help": [os.path.join(BASE_DIR, "insert", "main.py"), "--help"],
+    "import agent2 automator": ["-c", "import sys; sys.path.insert(0, 'insert/agent2'); import automator"],
+}
+
+
+def wall_time(args, runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def import_profile(args, top: int):
+    """[(cumulative_us, module)] from -X importtime, largest first."""
+    out = subprocess.run([sys.executable, "-X", "importtime"] + args, cwd=BASE_DIR,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        parts = [p.strip() for p in line[len("import time:"):].split("|")]
+        try:
+            rows.append((int(parts[1]), parts[2]))
+        except (IndexError, ValueError):
+            continue
+    # Only top-level imports (no leading indentation in the module column)
+    rows = [(us, name) for us, name in rows if not name.startswith(" ")]
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measure interpreter startup + import cost of the CLI entry points.")
+    ap.add_argument("--runs", type=int, default=5, help="Runs per target (median is reported).")
+    ap.add_argument("--top", type=int, default=5, help="Top cumulative imports to list per target.")
+    args = ap.parse_args()
+
+    baseline = wall_time(["-c", "pass"], args.runs)
+    print(f"bare interpreter: {baseline * 1000:7.1f} ms")
+    for label, target in TARGETS.items():
+        t = wall_time(target, args.runs)
+        print(f"\n{label:<28} {t * 1000:7.1f} ms  (+{(t - baseline) * 1000:.1f} ms over bare)")
+        for us, name in import_profile(target, args.top):
+            print(f"    {us / 1000:7.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# debug_writer.py - background, sampled writer for debug overlay images
+#
+# With --debug the OCR scripts used to convert every page to BGR, draw boxes
+# and cv2.imwrite() a full-resolution PNG inside the per-image loop.  Here the
+# caller only hands over a render function and its inputs; drawing, optional
+# downscaling and encoding happen on a worker thread fed by a bounded queue.
+# Only every Nth submitted image is kept, and JPEG output keeps files small,
+# so debug mode can stay on for production runs.
+#
+# When the queue is full new overlays are dropped (and counted) rather than
+# stalling OCR; pass block=True to wait instead.
+from __future__ import annotations
+
+import os
+import queue
+import threading
+from typing import Callable, Dict
+
+from lazy_deps import cv2, np
+
+
+class DebugWriter:
+    """Renders and saves debug overlays off the caller's thread.
+
+    submit(name, render, *args) calls render(*args) -> image on a worker and
+    writes it to outdir/name (extension swapped when fmt is "png"/"jpg").  workers=0
+    renders inline, which is what one-off callers without a writer get.
+    """
+
+    def __init__(self, outdir: str, every: int = 1, scale: float = 1.0, fmt: str = "",
+                 jpeg_quality: int = 80, queue_size: int = 8, workers: int = 1, block: bool = False):
+        self.outdir = outdir
+        self.every = max(1, int(every))
+        self.scale = float(scale)
+        self.fmt = fmt.lower().lstrip(".")
+        self.jpeg_quality = int(jpeg_quality)
+        self.block = block
+        self.counts: Dict[str, int] = {"submitted": 0, "sampled_out": 0, "dropped": 0, "written": 0, "failed": 0}
+        self._seen = 0
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, queue_size))
+        self._threads = [threading.Thread(target=self._run, name=f"debug-writer-{i}", daemon=True)
+                         for i in range(max(0, workers))]
+        os.makedirs(outdir, exist_ok=True)
+        for t in self._threads:
+            t.start()
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.counts[key] += 1
+
+    def submit(self, name: str, render: Callable[..., np.ndarray], *args, always: bool = False) -> bool:
+        """Queues one overlay; returns False when it was sampled out or dropped.
+
+        always=True bypasses sampling (one-off images such as the x-cut plot).
+        The arguments must not be modified by the caller afterwards.
+        """
+        with self._lock:
+            self.counts["submitted"] += 1
+            if not always:
+                self._seen += 1
+                if (self._seen - 1) % self.every:
+                    self.counts["sampled_out"] += 1
+                    return False
+        if not self._threads:
+            self._write(name, render, args)
+            return True
+        try:
+            self._queue.put((name, render, args), block=self.block)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        return True
+
+    def path_for(self, name: str) -> str:
+        stem, ext = os.path.splitext(name)
+        if self.fmt in ("jpg", "jpeg"):
+            ext = ".jpg"
+        elif self.fmt == "png":
+            ext = ".png"
+        return os.path.join(self.outdir, stem + ext)
+
+    def _write(self, name: str, render: Callable[..., np.ndarray], args: tuple) -> None:
+        try:
+            img = render(*args)
+            if self.scale != 1.0:
+                h, w = img.shape[:2]
+                img = cv2.resize(img, (max(1, int(w * self.scale)), max(1, int(h * self.scale))),
+                                 interpolation=cv2.INTER_AREA)
+            path = self.path_for(name)
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality] if path.endswith(".jpg") else []
+            if not cv2.imwrite(path, img, params):
+                raise RuntimeError(f"cv2.imwrite failed: {path}")
+        except Exception as e:
+            print(f"[warn] Debug overlay {name} not written: {e}")
+            self._count("failed")
+        else:
+            self._count("written")
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._write(*job)
+            finally:
+                self._queue.task_done()
+
+    def close(self) -> Dict[str, int]:
+        """Waits for queued overlays to be written and stops the workers."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+        return dict(self.counts)
+
+    def summary(self) -> str:
+        c = self.counts
+        return (f"{c['written']} written, {c['sampled_out']} sampled out, "
+                f"{c['dropped']} dropped (queue full), {c['failed']} failed → {self.outdir}")
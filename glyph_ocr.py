@@ -0,0 +1,403 @@
+# glyph_ocr.py - glyph-template OCR for the VB6 list's fixed bitmap font
+#
+# The legacy app draws its patient list in one system bitmap font at one size,
+# so every "A" on screen is the same pixels.  Instead of upscaling and running
+# Tesseract, this learns each glyph's bitmap once from a labeled capture and
+# then reads captures by looking glyphs up along each text line:
+#
+#   1. rows with dark ink split the capture into text lines (bands)
+#   2. the baseline of a band is the most common glyph bottom
+#   3. columns with ink split a band into glyphs; wide gaps become spaces
+#   4. each glyph (tight bitmap + offset from the baseline) is an exact dict
+#      lookup; unknown ones fall back to the nearest glyph of the same size,
+#      and over-wide ones (touching glyphs) are split by known glyph widths
+#
+# Whole lines are cached by their ink hash, so a live watcher only decodes
+# rows that changed.  Screen pixels only: scans and resized captures need
+# Tesseract.
+#
+#   python glyph_ocr.py learn list_capture.png list_capture.txt --font glyph_font.json
+#   python glyph_ocr.py read list_capture.png --font glyph_font.json
+#   python glyph_ocr.py bench captures/ --font glyph_font.json --runs 20
+import os
+import json
+import glob
+import time
+import hashlib
+import argparse
+import statistics
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from lazy_deps import cv2, np
+
+GLYPH_FONT = os.environ.get("LIST_GLYPH_FONT", "glyph_font.json")
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+UNKNOWN = "?"
+
+
+# ---- Segmentation ----
+def _runs(mask) -> List[Tuple[int, int]]:
+    """[start, end) of each run of True in a 1-D mask."""
+    m = np.concatenate(([0], mask.astype(np.int8), [0]))
+    d = np.diff(m)
+    return list(zip(np.flatnonzero(d == 1).tolist(), np.flatnonzero(d == -1).tolist()))
+
+
+def ink_mask(gray, dark: int = 128):
+    """Text pixels of a raw capture; bands drawn light-on-dark (selection) are inverted."""
+    ink = gray < dark
+    for top, bottom in _runs(ink.any(axis=1)):
+        band = ink[top:bottom]
+        if band.mean() > 0.5:
+            ink[top:bottom] = ~band
+    return ink
+
+
+def text_lines(ink, min_height: int = 4) -> List[Tuple[int, int]]:
+    return [(t, b) for t, b in _runs(ink.any(axis=1)) if b - t >= min_height]
+
+
+def line_glyphs(band) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]], int]:
+    """Glyph column spans of one band, each glyph's (top, bottom) ink rows, and the baseline row."""
+    H = band.shape[0]
+    has = band.any(axis=0)
+    spans = _runs(has)
+    if not spans:
+        return [], [], H - 1
+    # Per-column first/last ink row, reduced per glyph in one pass
+    col_top = np.where(has, band.argmax(axis=0), H)
+    col_bot = np.where(has, H - 1 - band[::-1].argmax(axis=0), -1)
+    starts = [a for a, _ in spans]
+    tops = np.minimum.reduceat(col_top, starts).tolist()
+    bottoms = np.maximum.reduceat(col_bot, starts).tolist()
+    rows = list(zip(tops, bottoms))
+    baseline = max(set(bottoms), key=bottoms.count)
+    return spans, rows, baseline
+
+
+def glyph_key(cols, baseline: int, rows: Optional[Tuple[int, int]] = None) -> Tuple[int, int, int, bytes]:
+    """(dy, height, width, packed bits) of a glyph's tight bitmap; dy = top relative to the baseline."""
+    if rows is None:
+        ink_rows = np.flatnonzero(cols.any(axis=1))
+        if ink_rows.size == 0:
+            return 0, 0, cols.shape[1], b""
+        rows = (int(ink_rows[0]), int(ink_rows[-1]))
+    top, bottom = rows
+    bitmap = cols[top:bottom + 1]
+    return top - baseline, bitmap.shape[0], bitmap.shape[1], np.packbits(bitmap).tobytes()
+
+
+# ---- Font ----
+class GlyphFont:
+    """Glyph bitmaps of one screen font, keyed by (dy, height, width, bits)."""
+
+    def __init__(self, glyphs: Optional[Dict[Tuple[int, int, int, bytes], str]] = None, space_gap: int = 4,
+                 max_mismatch: float = 0.06):
+        self.glyphs = glyphs or {}
+        self.space_gap = space_gap          # column gaps this wide or wider are spaces
+        self.max_mismatch = max_mismatch    # near-match: fraction of differing pixels allowed
+        self._by_size: Dict[Tuple[int, int], List[Tuple[int, np.ndarray, str]]] = {}
+        self._widths: List[int] = []
+        self._index()
+
+    def _index(self) -> None:
+        self._by_size = {}
+        for (dy, h, w, bits), ch in self.glyphs.items():
+            bitmap = np.unpackbits(np.frombuffer(bits, dtype=np.uint8))[:h * w].reshape(h, w).astype(bool)
+            self._by_size.setdefault((h, w), []).append((dy, bitmap, ch))
+        self._widths = sorted({w for _, _, w, _ in self.glyphs}, reverse=True)
+
+    # ---- Learning ----
+    @staticmethod
+    def learn(gray, labels: List[str], dark: int = 128) -> Tuple["GlyphFont", Dict]:
+        """Learns from a capture and its text, one label line per text line (top to bottom)."""
+        ink = ink_mask(gray, dark)
+        lines = text_lines(ink)
+        glyphs: Dict[Tuple[int, int, int, bytes], str] = {}
+        conflicts: Dict[str, str] = {}
+        word_gaps, letter_gaps = [], []
+        skipped = []
+        labels = [l for l in labels if l.strip()]
+        if len(labels) != len(lines):
+            raise ValueError(f"{len(labels)} label lines but {len(lines)} text lines in the capture")
+
+        for n, ((top, bottom), label) in enumerate(zip(lines, labels), 1):
+            band = ink[top:bottom]
+            spans, rows, baseline = line_glyphs(band)
+            chars = label.replace(" ", "")
+            if len(chars) != len(spans):
+                # Touching or split glyphs; other lines usually cover the same characters
+                skipped.append(n)
+                continue
+            gap_before = [i > 0 and label[i - 1] == " " for i, ch in enumerate(label) if ch != " "]
+            for i, ((a, b), r, ch) in enumerate(zip(spans, rows, chars)):
+                key = glyph_key(band[:, a:b], baseline, r)
+                if key in glyphs and glyphs[key] != ch:
+                    conflicts[ch] = glyphs[key]
+                    continue
+                glyphs[key] = ch
+                if i > 0:
+                    (word_gaps if gap_before[i] else letter_gaps).append(a - spans[i - 1][1])
+
+        if not glyphs:
+            raise ValueError("No line of the capture matched its label; check the label file")
+        if word_gaps and letter_gaps:
+            space_gap = (max(letter_gaps) + min(word_gaps) + 1) // 2
+        else:
+            space_gap = max(letter_gaps, default=2) + 2
+        report = {
+            "glyphs": len(glyphs),
+            "chars": "".join(sorted(set(glyphs.values()))),
+            "space_gap": int(space_gap),
+            "lines": len(lines),
+            "skipped_lines": skipped,
+            "ambiguous": conflicts,
+        }
+        return GlyphFont(glyphs, space_gap=int(space_gap)), report
+
+    def merge(self, other: "GlyphFont") -> None:
+        self.glyphs.update({k: v for k, v in other.glyphs.items() if k not in self.glyphs})
+        self._index()
+
+    # ---- Recognition ----
+    def _near(self, key: Tuple[int, int, int, bytes], bitmap) -> Optional[str]:
+        dy, h, w, _ = key
+        best, best_err = None, self.max_mismatch * h * w
+        for gdy, g, ch in self._by_size.get((h, w), ()):
+            if abs(gdy - dy) > 1:
+                continue
+            err = int(np.count_nonzero(g != bitmap))
+            if err <= best_err:
+                best, best_err = ch, err
+        return best
+
+    def _match(self, cols, baseline: int, rows: Tuple[int, int]) -> Optional[str]:
+        key = glyph_key(cols, baseline, rows)
+        ch = self.glyphs.get(key)
+        return ch if ch is not None else self._near(key, cols[rows[0]:rows[1] + 1])
+
+    def _split(self, cols, baseline: int) -> str:
+        """Touching glyphs: peel off the widest known glyph that matches exactly at the left."""
+        out = []
+        x = 0
+        W = cols.shape[1]
+        while x < W:
+            for w in self._widths:
+                if w <= W - x:
+                    ch = self.glyphs.get(glyph_key(cols[:, x:x + w], baseline))
+                    if ch is not None:
+                        out.append(ch)
+                        x += w
+                        break
+            else:
+                out.append(UNKNOWN)
+                nxt = np.flatnonzero(~cols[:, x:].any(axis=0))
+                x += int(nxt[0]) + 1 if nxt.size else W
+        return "".join(out)
+
+    def read_band(self, band) -> str:
+        spans, rows, baseline = line_glyphs(band)
+        out = []
+        prev_end = None
+        for (a, b), r in zip(spans, rows):
+            if prev_end is not None and a - prev_end >= self.space_gap:
+                out.append(" ")
+            cols = band[:, a:b]
+            ch = self._match(cols, baseline, r)
+            out.append(ch if ch is not None else self._split(cols, baseline))
+            prev_end = b
+        return "".join(out)
+
+    # ---- Persistence ----
+    def to_dict(self) -> Dict:
+        return {
+            "space_gap": self.space_gap,
+            "max_mismatch": self.max_mismatch,
+            "glyphs": [[ch, dy, h, w, bits.hex()] for (dy, h, w, bits), ch in sorted(self.glyphs.items(), key=lambda kv: kv[1])],
+        }
+
+    @staticmethod
+    def from_dict(d: Dict) -> "GlyphFont":
+        glyphs = {(int(dy), int(h), int(w), bytes.fromhex(bits)): ch for ch, dy, h, w, bits in d["glyphs"]}
+        return GlyphFont(glyphs, space_gap=int(d.get("space_gap", 4)), max_mismatch=float(d.get("max_mismatch", 0.06)))
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+
+    @staticmethod
+    def load(path: str) -> "GlyphFont":
+        with open(path, "r", encoding="utf-8") as f:
+            return GlyphFont.from_dict(json.load(f))
+
+
+class GlyphReader:
+    """Reads raw grayscale captures with a GlyphFont; decoded lines are cached by ink hash."""
+
+    def __init__(self, font: GlyphFont, dark: int = 128, cache_size: int = 4096):
+        self.font = font
+        self.dark = dark
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[bytes, str]" = OrderedDict()
+        self.stats = {"lines": 0, "cached": 0, "unknown": 0}
+
+    def read_lines(self, gray) -> List[str]:
+        ink = ink_mask(gray, self.dark)
+        out = []
+        for top, bottom in text_lines(ink):
+            band = ink[top:bottom]
+            self.stats["lines"] += 1
+            h = hashlib.blake2b(np.packbits(band, axis=1).tobytes() + str(band.shape).encode(), digest_size=16).digest()
+            text = self._cache.get(h)
+            if text is not None:
+                self._cache.move_to_end(h)
+                self.stats["cached"] += 1
+            else:
+                text = self.font.read_band(band)
+                self.stats["unknown"] += text.count(UNKNOWN)
+                self._cache[h] = text
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            out.append(text)
+        return out
+
+    def read_text(self, gray) -> str:
+        return "\n".join(self.read_lines(gray))
+
+
+_READERS: Dict[str, GlyphReader] = {}
+
+
+def get_reader(font_path: str = GLYPH_FONT) -> GlyphReader:
+    """Process-wide reader per font file, so the line cache survives between captures."""
+    reader = _READERS.get(font_path)
+    if reader is None:
+        if not os.path.isfile(font_path):
+            raise RuntimeError(f"Glyph font not found: {font_path} (learn one with: python glyph_ocr.py learn ...)")
+        reader = _READERS[font_path] = GlyphReader(GlyphFont.load(font_path))
+    return reader
+
+
+def _imread_gray(path: str):
+    img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise RuntimeError(f"Failed to read image: {path}")
+    return img
+
+
+def _char_errors(a: str, b: str) -> int:
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+def bench(paths: List[str], font: GlyphFont, runs: int = 20) -> Dict:
+    """Median latency per capture of the glyph reader (cold and line-cached) vs Tesseract."""
+    from read_patient_list import process_list_image, ocr_patient_list
+
+    grays = [_imread_gray(p) for p in paths]
+    result: Dict = {"captures": len(grays), "runs": runs}
+
+    cold = []
+    for _ in range(runs):
+        for g in grays:
+            reader = GlyphReader(font)
+            t0 = time.perf_counter()
+            reader.read_text(g)
+            cold.append(time.perf_counter() - t0)
+    reader = GlyphReader(font)
+    glyph_text = [reader.read_text(g) for g in grays]
+    warm = []
+    for _ in range(runs):
+        for g in grays:
+            t0 = time.perf_counter()
+            reader.read_text(g)
+            warm.append(time.perf_counter() - t0)
+    result["glyph_ms"] = round(statistics.median(cold) * 1000, 2)
+    result["glyph_cached_ms"] = round(statistics.median(warm) * 1000, 2)
+    result["glyph_unknown_chars"] = sum(t.count(UNKNOWN) for t in glyph_text)
+
+    try:
+        tess, tess_text = [], []
+        for _ in range(max(1, runs // 5)):
+            tess_text = []
+            for g in grays:
+                t0 = time.perf_counter()
+                text, _ = ocr_patient_list(process_list_image(g), skip_header=False)
+                tess.append(time.perf_counter() - t0)
+                tess_text.append(text)
+    except Exception as e:
+        print(f"[warn] Tesseract run failed ({e}); glyph numbers only")
+        return result
+    result["tesseract_ms"] = round(statistics.median(tess) * 1000, 2)
+    result["speedup"] = round(result["tesseract_ms"] / max(result["glyph_ms"], 1e-6), 1)
+    # Disagreement with Tesseract, whitespace-normalized (not ground truth for either)
+    errs = total = 0
+    for g, t in zip(glyph_text, tess_text):
+        a, b = " ".join(g.split()), " ".join(t.split())
+        errs += _char_errors(a, b)
+        total += max(1, len(b))
+    result["char_disagreement"] = round(errs / total, 4)
+    return result
+
+
+# ------------------------------------ CLI -------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Glyph-template OCR for fixed-font screen captures.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("learn", help="Learn glyphs from a capture and its text (one line per text line).")
+    p.add_argument("image", type=str)
+    p.add_argument("labels", type=str, help="UTF-8 text file with the capture's lines, top to bottom.")
+    p.add_argument("--font", type=str, default=GLYPH_FONT, help="Font file to write.")
+    p.add_argument("--add", action="store_true", help="Add to an existing font file instead of replacing it.")
+    p = sub.add_parser("read", help="Read a capture.")
+    p.add_argument("image", type=str)
+    p.add_argument("--font", type=str, default=GLYPH_FONT)
+    p = sub.add_parser("bench", help="Latency vs Tesseract on the same captures.")
+    p.add_argument("images", type=str, nargs="+", help="Capture files or folders.")
+    p.add_argument("--font", type=str, default=GLYPH_FONT)
+    p.add_argument("--runs", type=int, default=20, help="Timed passes over the captures.")
+    p.add_argument("--report", type=str, help="Write the JSON result here.")
+    args = ap.parse_args()
+
+    if args.cmd == "learn":
+        with open(args.labels, "r", encoding="utf-8") as f:
+            labels = f.read().splitlines()
+        font, report = GlyphFont.learn(_imread_gray(args.image), labels)
+        if args.add and os.path.isfile(args.font):
+            base = GlyphFont.load(args.font)
+            base.merge(font)
+            font = base
+        font.save(args.font)
+        if report["skipped_lines"]:
+            print(f"[warn] Lines {report['skipped_lines']} did not split into one blob per character; not learned")
+        if report["ambiguous"]:
+            print(f"[warn] Identical bitmaps for different characters: {report['ambiguous']}")
+        print(f"[ok] {len(font.glyphs)} glyphs ({report['chars']}), space gap {font.space_gap}px → {args.font}")
+    elif args.cmd == "read":
+        reader = get_reader(args.font)
+        print(reader.read_text(_imread_gray(args.image)))
+    else:
+        paths = []
+        for item in args.images:
+            if os.path.isdir(item):
+                paths += sorted(p for p in glob.glob(os.path.join(item, "*.*")) if p.lower().endswith(IMAGE_EXTS))
+            else:
+                paths.append(item)
+        if not paths:
+            raise SystemExit("No captures given.")
+        result = bench(paths, GlyphFont.load(args.font), runs=args.runs)
+        print(json.dumps(result, indent=2))
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=2)
+            print(f"[ok] Report → {args.report}")
+
+
+if __name__ == "__main__":
+    main()
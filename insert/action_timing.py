@@ -0,0 +1,216 @@
+# action_timing.py - per-action latency instrumentation for the insert agents
+#
+# fill_patient_form() takes seconds per record, and this module shows where
+# they go: window activation, focus clicks, field clicks, clearing, typing or
+# pasting, the sex dropdown fallback, and the Add click.  Each action is timed
+# with a monotonic clock into fixed-bucket histograms (per action and per
+# record).  The results can be exported as JSON and as a Prometheus
+# textfile-collector file.
+#
+# Set ACTION_TIMINGS_DIR to export after every record:
+#   <dir>/insert_actions_<agent>.json    aggregate histograms + last record
+#   <dir>/insert_actions_<agent>.prom    same, Prometheus text format
+#   <dir>/insert_records.jsonl           one line per record (latency over time)
+import os
+import glob
+import json
+import time
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Sequence
+
+TIMINGS_DIR = os.environ.get("ACTION_TIMINGS_DIR", "")
+
+# Seconds; clicks/keys land in the low buckets, whole records in the high ones
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (upper bounds in seconds, plus +Inf)."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        i = 0
+        while i < len(self.buckets) and seconds > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def cumulative(self):
+        total = 0
+        for le, n in zip([str(b) for b in self.buckets] + ["+Inf"], self.counts):
+            total += n
+            yield le, total
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum_s": round(self.sum, 6),
+            "mean_s": round(self.sum / self.count, 6) if self.count else 0.0,
+            "max_s": round(self.max, 6),
+            "buckets": dict(self.cumulative()),
+        }
+
+
+class ActionTimer:
+    """Times the actions of each record; aggregates histograms across records.
+
+    with timer.record(clock=...):       one fill_patient_form() call
+        with timer.action("paste"):     one step inside it
+    """
+
+    def __init__(self, agent: str = "", out_dir: str = TIMINGS_DIR, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.agent = agent
+        self.out_dir = out_dir
+        self.buckets = tuple(buckets)
+        self.actions: Dict[str, Histogram] = {}
+        self.records = Histogram(self.buckets)
+        self.results = {"ok": 0, "failed": 0}
+        self.last_record: Optional[Dict] = None
+        self._current: Optional[Dict[str, float]] = None
+        self._clock: Callable[[], float] = time.monotonic
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def record(self, clock: Optional[Callable[[], float]] = None):
+        # The backend may supply its own clock (RecordingBackend adds its virtual waits)
+        self._clock = clock or time.monotonic
+        self._current = {}
+        t0 = self._clock()
+        ok = False
+        try:
+            yield self
+            ok = True
+        finally:
+            total = self._clock() - t0
+            actions, self._current = self._current, None
+            with self._lock:
+                self.records.observe(total)
+                self.results["ok" if ok else "failed"] += 1
+                self.last_record = {
+                    "ts": round(time.time(), 3),
+                    "agent": self.agent,
+                    "ok": ok,
+                    "total_s": round(total, 6),
+                    "actions": {k: round(v, 6) for k, v in actions.items()},
+                }
+            if self.out_dir:
+                self.export(self.out_dir)
+
+    @contextmanager
+    def action(self, name: str):
+        t0 = self._clock()
+        try:
+            yield
+        finally:
+            dt = self._clock() - t0
+            with self._lock:
+                hist = self.actions.get(name)
+                if hist is None:
+                    hist = self.actions[name] = Histogram(self.buckets)
+                hist.observe(dt)
+            if self._current is not None:
+                self._current[name] = self._current.get(name, 0.0) + dt
+
+    # ---- Export ----
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "agent": self.agent,
+                "records": self.records.to_dict(),
+                "results": dict(self.results),
+                "actions": {k: h.to_dict() for k, h in sorted(self.actions.items())},
+                "last_record": self.last_record,
+            }
+
+    def prometheus_text(self) -> str:
+        agent = self.agent.replace('"', "")
+        with self._lock:
+            lines = [
+                "# HELP insert_action_seconds Duration of one automation action inside fill_patient_form.",
+                "# TYPE insert_action_seconds histogram",
+            ]
+            for name, hist in sorted(self.actions.items()):
+                labels = f'agent="{agent}",action="{name}"'
+                for le, n in hist.cumulative():
+                    lines.append(f'insert_action_seconds_bucket{{{labels},le="{le}"}} {n}')
+                lines.append(f"insert_action_seconds_sum{{{labels}}} {hist.sum:.6f}")
+                lines.append(f"insert_action_seconds_count{{{labels}}} {hist.count}")
+            lines += [
+                "# HELP insert_record_seconds Duration of one whole record insert.",
+                "# TYPE insert_record_seconds histogram",
+            ]
+            for le, n in self.records.cumulative():
+                lines.append(f'insert_record_seconds_bucket{{agent="{agent}",le="{le}"}} {n}')
+            lines.append(f'insert_record_seconds_sum{{agent="{agent}"}} {self.records.sum:.6f}')
+            lines.append(f'insert_record_seconds_count{{agent="{agent}"}} {self.records.count}')
+            lines += [
+                "# HELP insert_records_total Records attempted, by result.",
+                "# TYPE insert_records_total counter",
+            ]
+            for result, n in self.results.items():
+                lines.append(f'insert_records_total{{agent="{agent}",result="{result}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, out_dir: str) -> None:
+        os.makedirs(out_dir, exist_ok=True)
+        stem = os.path.join(out_dir, f"insert_actions_{self.agent or 'agent'}")
+        _write_atomic(stem + ".json", json.dumps(self.to_dict(), indent=2))
+        # Textfile collectors read *.prom; replace atomically so no partial file is scraped
+        _write_atomic(stem + ".prom", self.prometheus_text())
+        if self.last_record is not None:
+            with open(os.path.join(out_dir, "insert_records.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps(self.last_record) + "\n")
+
+
+def _write_atomic(path: str, text: str) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+_TIMERS: Dict[str, ActionTimer] = {}
+
+
+def get_timer(agent: str) -> ActionTimer:
+    """Process-wide timer for an agent, so histograms accumulate across records."""
+    timer = _TIMERS.get(agent)
+    if timer is None:
+        timer = _TIMERS[agent] = ActionTimer(agent)
+    return timer
+
+
+# ------------------------------------ CLI -------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Show the slowest insert actions from exported timings.")
+    ap.add_argument("dir", nargs="?", default=TIMINGS_DIR or ".", help="ACTION_TIMINGS_DIR to read.")
+    args = ap.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.dir, "insert_actions_*.json")))
+    if not paths:
+        raise SystemExit(f"No insert_actions_*.json in {args.dir}")
+    for p in paths:
+        with open(p, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        rec = data["records"]
+        print(f"{data['agent']}: {rec['count']} records, mean {rec['mean_s']:.3f}s, max {rec['max_s']:.3f}s "
+              f"({data['results']['failed']} failed)")
+        actions = sorted(data["actions"].items(), key=lambda kv: kv[1]["sum_s"], reverse=True)
+        for name, h in actions:
+            share = h["sum_s"] / rec["sum_s"] if rec["sum_s"] else 0.0
+            print(f"  {name:<14} n={h['count']:<6} mean={h['mean_s'] * 1000:8.1f}ms "
+                  f"max={h['max_s'] * 1000:8.1f}ms  {share:6.1%} of record time")
+
+
+if __name__ == "__main__":
+    main()
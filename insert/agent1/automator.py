@@ -1,83 +1,102 @@
 # automator.py - FINAL PROJECT VERSION (with clipboard fix)
-import pyautogui
-import pygetwindow as gw
+import os
+import sys
 import json
-import time
-import pyperclip 
-try:
-    import pydirectinput as pdi
-except Exception:
-    pdi = None
-
-def fill_patient_form(patient_data):
+
+# Shared input backends live one level up (insert/input_backend.py)
+INSERT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if INSERT_DIR not in sys.path:
+    sys.path.append(INSERT_DIR)
+from input_backend import LiveBackend
+from action_timing import get_timer
+from key_events import compile_record
+
+# "calls": one backend call per key/click with fixed sleeps (default)
+# "batch": compile the record into a minimal event list and play it with send()
+INPUT_MODE = os.environ.get("INPUT_MODE", "")
+
+def fill_patient_form(patient_data, backend=None, coords=None, timer=None, input_mode=None):
     """
     Automates filling the entire patient form with a robust clipboard method.
+    Every action is timed into `timer` (default: the process-wide agent1 timer).
     """
-    try:
-        with open("calibration.json", "r") as f:
-            coords = json.load(f)
-    except FileNotFoundError:
-        raise Exception("Calibration file 'calibration.json' not found. Please run 'calibrate.py' first.")
+    io = backend or LiveBackend()
+    timer = timer or get_timer("agent1")
+    with timer.record(clock=getattr(io, "clock", None)):
+        _fill_patient_form(patient_data, io, coords, timer.action, input_mode)
+
+
+def _fill_patient_form(patient_data, io, coords, action, input_mode=None):
+    if coords is None:
+        try:
+            with open("calibration.json", "r") as f:
+                coords = json.load(f)
+        except FileNotFoundError:
+            raise Exception("Calibration file 'calibration.json' not found. Please run 'calibrate.py' first.")
+
+    input_mode = input_mode or INPUT_MODE or coords.get("input_mode", "calls")
 
     target_window_title = "WinXP for VB6"
     try:
-        vm_window = gw.getWindowsWithTitle(target_window_title)[0]
-        vm_window.activate()
-        time.sleep(1) 
+        with action("activate"):
+            vm_window = io.find_window(target_window_title)
+            vm_window.activate()
+            io.sleep(1)
         
         print("Forcefully focusing the VM window by clicking its title bar...")
-        pyautogui.click(vm_window.left + 100, vm_window.top + 15)
-        time.sleep(0.5)
-        # Extra: click inside client area to ensure keyboard capture by the VM
-        try:
-            center_x = vm_window.left + vm_window.width // 2
-            center_y = vm_window.top + vm_window.height // 2
-            pyautogui.click(center_x, center_y)
-            time.sleep(0.3)
-        except Exception:
-            pass
+        with action("focus"):
+            io.click(vm_window.left + 100, vm_window.top + 15)
+            io.sleep(0.5)
+            # Extra: click inside client area to ensure keyboard capture by the VM
+            try:
+                center_x = vm_window.left + vm_window.width // 2
+                center_y = vm_window.top + vm_window.height // 2
+                io.click(center_x, center_y)
+                io.sleep(0.3)
+            except Exception:
+                pass
 
     except IndexError:
         raise Exception(f"The '{target_window_title}' window was not found. Is the application running in the VM?")
+
+    if input_mode == "batch":
+        # Whole record as one compiled event list (see key_events.py)
+        events = compile_record(patient_data, coords, vm_window, mode="click", entry="type")
+        print(f"Sending {len(events)} input events in one batch...")
+        with action("send"):
+            io.send(events)
+        print("Automation completed successfully!")
+        return
     
     # Helper: key press using pydirectinput if available, else pyautogui
     def press_key(key: str, delay: float = 0.05):
-        if pdi:
-            pdi.press(key)
-        else:
-            pyautogui.press(key)
-        time.sleep(delay)
+        io.press(key)
+        io.sleep(delay)
 
     def key_down(key: str):
-        if pdi:
-            pdi.keyDown(key)
-        else:
-            pyautogui.keyDown(key)
-        time.sleep(0.02)
+        io.key_down(key)
+        io.sleep(0.02)
 
     def key_up(key: str):
-        if pdi:
-            pdi.keyUp(key)
-        else:
-            pyautogui.keyUp(key)
-        time.sleep(0.02)
+        io.key_up(key)
+        io.sleep(0.02)
 
     def type_text(text: str, interval: float = 0.05):
         if not text:
             return
-        if pdi:
+        if io.direct_input:
             # pydirectinput.write ignores interval per char; emulate
             for ch in str(text):
                 if ch.isalpha() and ch.isupper():
                     # Hold Shift to produce uppercase reliably in VMs
-                    pdi.keyDown('shift')
-                    pdi.press(ch.lower())
-                    pdi.keyUp('shift')
+                    io.key_down('shift')
+                    io.press(ch.lower())
+                    io.key_up('shift')
                 else:
-                    pdi.press(ch)
-                time.sleep(interval)
+                    io.press(ch)
+                io.sleep(interval)
         else:
-            pyautogui.typewrite(str(text), interval=interval)
+            io.write(str(text), interval=interval)
 
     # --- UPDATED: Click each field explicitly before typing (more reliable than Tab in VMs) ---
     field_order = ["name_field", "address_field", "date_of_birth_field", "age_field", "sex_field"]
@@ -91,13 +110,15 @@ def fill_patient_form(patient_data):
         field_coords = coords[field_name]
         click_x = vm_window.left + field_coords['x']
         click_y = vm_window.top + field_coords['y']
-        pyautogui.click(click_x, click_y)
-        time.sleep(0.2)
+        with action("field_click"):
+            io.click(click_x, click_y)
+            io.sleep(0.2)
 
         # Clear any existing text and type the new value
-        key_down('ctrl'); press_key('a', delay=0.02); key_up('ctrl')
-        press_key('backspace', delay=0.05)
-        time.sleep(0.05)
+        with action("clear"):
+            key_down('ctrl'); press_key('a', delay=0.02); key_up('ctrl')
+            press_key('backspace', delay=0.05)
+            io.sleep(0.05)
         # Special handling for sex field: normalize to first letter and uppercase
         if data_key == "sex":
             normalized = str(value_to_type).strip().upper()[:1]
@@ -108,22 +129,27 @@ def fill_patient_form(patient_data):
                         normalized = ch.upper()
                         break
             if normalized in ("M", "F"):
-                type_text(normalized, interval=0.07)
-                time.sleep(0.1)
+                with action("type_sex"):
+                    type_text(normalized, interval=0.07)
+                    io.sleep(0.1)
             else:
                 # Fallback for dropdowns: open menu and select by first letter
-                press_key('alt', delay=0.05)  # noop if not used by control
-                press_key('down', delay=0.1)
-                if value_to_type:
-                    type_text(str(value_to_type)[0].upper(), interval=0.07)
-                press_key('enter', delay=0.1)
+                with action("sex_dropdown"):
+                    press_key('alt', delay=0.05)  # noop if not used by control
+                    press_key('down', delay=0.1)
+                    if value_to_type:
+                        type_text(str(value_to_type)[0].upper(), interval=0.07)
+                    press_key('enter', delay=0.1)
         else:
-            type_text(str(value_to_type), interval=0.07)
-        time.sleep(0.1)
+            with action("type"):
+                type_text(str(value_to_type), interval=0.07)
+        with action("settle"):
+            io.sleep(0.1)
 
         
     add_button_coords = coords["add_button"]
     print("Clicking the 'Add' button...")
-    pyautogui.click(vm_window.left + add_button_coords['x'], vm_window.top + add_button_coords['y'])
+    with action("add_click"):
+        io.click(vm_window.left + add_button_coords['x'], vm_window.top + add_button_coords['y'])
     
     print("Automation completed successfully!")
\ No newline at end of file
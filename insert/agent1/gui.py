@@ -1,12 +1,28 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from automator import fill_patient_form # Import our robot function
+import os
+import sys
+
+# Shared helpers: verify_inserts.py / read_patient_list.py at the repo root,
+# submit_queue.py / patient_index.py in insert/
+INSERT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.dirname(INSERT_DIR)
+for _p in (INSERT_DIR, REPO_ROOT):
+    if _p not in sys.path:
+        sys.path.append(_p)
+from verify_inserts import BatchVerifier, format_report
+from submit_queue import SubmissionWorker
+from patient_index import PatientIndex
+
+# Read back the legacy list once every N inserts (0 = verification off)
+VERIFY_BATCH_SIZE = int(os.environ.get("VERIFY_BATCH_SIZE", "0") or 0)
 
 class App:
     def __init__(self, root):
         self.root = root
         self.root.title("Modern Patient Entry Form")
-        self.root.geometry("400x280")
+        self.root.geometry("400x460")
         
         style = ttk.Style(root)
         style.theme_use("clam")
@@ -28,7 +44,20 @@ class App:
         add_button = ttk.Button(form_frame, text="Add Patient to Legacy System", command=self.submit_data)
         add_button.grid(row=len(labels), column=0, columnspan=2, pady=15)
 
+        # Queue depth + per-record status; records are typed by a background worker
+        self.status_var = tk.StringVar(value="Queue: 0")
+        status = ttk.Label(form_frame, textvariable=self.status_var)
+        status.grid(row=len(labels) + 1, column=0, columnspan=2, sticky="w", padx=5)
+        self.jobs_list = tk.Listbox(form_frame, height=6)
+        self.jobs_list.grid(row=len(labels) + 2, column=0, columnspan=2, sticky="nsew", padx=5, pady=5)
+        self.job_rows = {}
+
         form_frame.columnconfigure(1, weight=1)
+        form_frame.rowconfigure(len(labels) + 2, weight=1)
+        self.verifier = BatchVerifier(VERIFY_BATCH_SIZE) if VERIFY_BATCH_SIZE > 0 else None
+        # Patients already typed into the VB6 app (shared by all agents) are not typed again
+        self.worker = SubmissionWorker(fill_patient_form, verifier=self.verifier, index=PatientIndex())
+        self.root.after(100, self._poll_worker)
         self.root.mainloop()
 
     def submit_data(self):
@@ -39,13 +68,47 @@ class App:
             messagebox.showerror("Error", "Patient ID and Name are required.")
             return
 
-        try:
-            print("GUI is calling the automator...")
-            fill_patient_form(patient_data)
-            messagebox.showinfo("Success", "Patient data submitted to the legacy system successfully!")
-            # Optionally clear fields after submission
-            for entry in self.entries.values():
-                entry.delete(0, tk.END)
-                
-        except Exception as e:
-            messagebox.showerror("Automation Failed", f"An error occurred: {e}")
\ No newline at end of file
+        # Hand the record to the worker and free the form for the next patient
+        self._enqueue(patient_data)
+        for entry in self.entries.values():
+            entry.delete(0, tk.END)
+
+    def _enqueue(self, patient_data, force=False):
+        job_no = self.worker.submit(patient_data, force=force)
+        self.job_rows[job_no] = self.jobs_list.size()
+        self.jobs_list.insert(tk.END, f"#{job_no} {patient_data.get('name', '')} - queued")
+        self.status_var.set(f"Queue: {self.worker.depth()}")
+
+    def _set_job_status(self, job_no, record, text):
+        idx = self.job_rows.get(job_no)
+        if idx is None:
+            return
+        self.jobs_list.delete(idx)
+        self.jobs_list.insert(idx, f"#{job_no} {record.get('name', '')} - {text}")
+
+    def _poll_worker(self):
+        """Applies worker progress to the widgets (runs on the Tk thread)."""
+        for event in self.worker.poll():
+            kind = event[0]
+            if kind == "skipped":
+                self._set_job_status(event[1], event[2], "skipped (already inserted)")
+            elif kind == "running":
+                self._set_job_status(event[1], event[2], "typing...")
+            elif kind == "done":
+                self._set_job_status(event[1], event[2], f"done ({event[3]:.1f}s)")
+            elif kind == "failed":
+                self._set_job_status(event[1], event[2], f"FAILED: {event[3]}")
+            elif kind == "verify_failed":
+                messagebox.showwarning("Verification Failed", f"Could not read back the patient list: {event[1]}")
+            elif kind == "verified":
+                report, retry, jobs = event[1], event[2], event[3]
+                if retry and messagebox.askyesno(
+                        "Verification", format_report(report) + "\n\nRe-insert the flagged records now?"):
+                    # Re-inserted records are checked again with a later batch
+                    for rec in retry:
+                        self._enqueue(rec, force=True)
+                else:
+                    for job_no, rec in zip(jobs, retry):
+                        self._set_job_status(job_no, rec, "skipped (duplicate)")
+        self.status_var.set(f"Queue: {self.worker.depth()}   Avoided: {self.worker.avoided}")
+        self.root.after(100, self._poll_worker)
\ No newline at end of file
@@ -1,108 +1,118 @@
 # automator.py - FINAL PROJECT VERSION (with clipboard fix)
-import pyautogui
-import pygetwindow as gw
+import os
+import sys
 import json
-import time
-import pyperclip 
-try:
-    import pydirectinput as pdi
-except Exception:
-    pdi = None
-
-def fill_patient_form(patient_data):
+
+# Shared input backends live one level up (insert/input_backend.py)
+INSERT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if INSERT_DIR not in sys.path:
+    sys.path.append(INSERT_DIR)
+from input_backend import LiveBackend
+from action_timing import get_timer
+from key_events import compile_record
+
+FIELD_ORDER = ["name_field", "address_field", "date_of_birth_field", "age_field", "sex_field"]
+
+# "click": focus every field with a calibrated click (default, most robust)
+# "tab":   click the first field once, then follow the form's tab order
+FILL_MODE = os.environ.get("FILL_MODE", "")
+
+# "calls": one backend call per key/click with fixed sleeps (default)
+# "batch": compile the record into a minimal event list and play it with send()
+INPUT_MODE = os.environ.get("INPUT_MODE", "")
+
+
+def fill_patient_form(patient_data, backend=None, mode=None, coords=None, timer=None, input_mode=None):
     """
     Automates filling the entire patient form with a robust clipboard method.
+    Every action is timed into `timer` (default: the process-wide agent2 timer).
     """
-    try:
-        with open("calibration.json", "r") as f:
-            coords = json.load(f)
-    except FileNotFoundError:
-        raise Exception("Calibration file 'calibration.json' not found. Please run 'calibrate.py' first.")
+    io = backend or LiveBackend()
+    timer = timer or get_timer("agent2")
+    with timer.record(clock=getattr(io, "clock", None)):
+        _fill_patient_form(patient_data, io, mode, coords, timer.action, input_mode)
+
+
+def _fill_patient_form(patient_data, io, mode, coords, action, input_mode=None):
+    if coords is None:
+        try:
+            with open("calibration.json", "r") as f:
+                coords = json.load(f)
+        except FileNotFoundError:
+            raise Exception("Calibration file 'calibration.json' not found. Please run 'calibrate.py' first.")
+
+    mode = mode or FILL_MODE or coords.get("fill_mode", "click")
+    input_mode = input_mode or INPUT_MODE or coords.get("input_mode", "calls")
 
     target_window_title = "WinXP for VB6"
     try:
-        vm_window = gw.getWindowsWithTitle(target_window_title)[0]
-        vm_window.activate()
-        time.sleep(1) 
-        
+        with action("activate"):
+            vm_window = io.find_window(target_window_title)
+            vm_window.activate()
+            io.sleep(1)
+
         print("Forcefully focusing the VM window by clicking its title bar...")
-        pyautogui.click(vm_window.left + 100, vm_window.top + 15)
-        time.sleep(0.5)
-        # Extra: click inside client area to ensure keyboard capture by the VM
-        try:
-            center_x = vm_window.left + vm_window.width // 2
-            center_y = vm_window.top + vm_window.height // 2
-            pyautogui.click(center_x, center_y)
-            time.sleep(0.3)
-        except Exception:
-            pass
+        with action("focus"):
+            io.click(vm_window.left + 100, vm_window.top + 15)
+            io.sleep(0.5)
+            # Extra: click inside client area to ensure keyboard capture by the VM
+            try:
+                center_x = vm_window.left + vm_window.width // 2
+                center_y = vm_window.top + vm_window.height // 2
+                io.click(center_x, center_y)
+                io.sleep(0.3)
+            except Exception:
+                pass
 
     except IndexError:
         raise Exception(f"The '{target_window_title}' window was not found. Is the application running in the VM?")
-    
+
+    if input_mode == "batch":
+        # Whole record as one compiled event list (see key_events.py)
+        events = compile_record(patient_data, coords, vm_window, mode=mode, entry="paste")
+        print(f"Sending {len(events)} input events in one batch...")
+        with action("send"):
+            io.send(events)
+        print("Automation completed successfully!")
+        return
+
     # Helper: key press using pydirectinput if available, else pyautogui
     def press_key(key: str, delay: float = 0.05):
-        if pdi:
-            pdi.press(key)
-        else:
-            pyautogui.press(key)
-        time.sleep(delay)
+        io.press(key)
+        io.sleep(delay)
 
     def key_down(key: str):
-        if pdi:
-            pdi.keyDown(key)
-        else:
-            pyautogui.keyDown(key)
-        time.sleep(0.02)
+        io.key_down(key)
+        io.sleep(0.02)
 
     def key_up(key: str):
-        if pdi:
-            pdi.keyUp(key)
-        else:
-            pyautogui.keyUp(key)
-        time.sleep(0.02)
+        io.key_up(key)
+        io.sleep(0.02)
 
     def type_text(text: str, interval: float = 0.05):
         if not text:
             return
-        if pdi:
+        if io.direct_input:
             # pydirectinput.write ignores interval per char; emulate
             for ch in str(text):
                 if ch.isalpha() and ch.isupper():
                     # Hold Shift to produce uppercase reliably in VMs
-                    pdi.keyDown('shift')
-                    pdi.press(ch.lower())
-                    pdi.keyUp('shift')
+                    io.key_down('shift')
+                    io.press(ch.lower())
+                    io.key_up('shift')
                 else:
-                    pdi.press(ch)
-                time.sleep(interval)
+                    io.press(ch)
+                io.sleep(interval)
         else:
-            pyautogui.typewrite(str(text), interval=interval)
-
-    # --- UPDATED: Click each field explicitly before typing (more reliable than Tab in VMs) ---
-    field_order = ["name_field", "address_field", "date_of_birth_field", "age_field", "sex_field"]
+            io.write(str(text), interval=interval)
 
-    for i, field_name in enumerate(field_order):
-        data_key = field_name.replace("_field", "")
-        value_to_type = patient_data.get(data_key, "")
-        print(f"Typing '{value_to_type}' into {data_key} field...")
+    def clear_field():
+        with action("clear"):
+            key_down('ctrl'); press_key('a', delay=0.02); key_up('ctrl')
+            press_key('backspace', delay=0.05)
+            io.sleep(0.05)
 
-        # Focus the exact field via calibrated coordinates
-        field_coords = coords[field_name]
-        click_x = vm_window.left + field_coords['x']
-        click_y = vm_window.top + field_coords['y']
-        # Faster cursor movement (2x): use duration=0 and ensure failsafe off
-        try:
-            pyautogui.moveTo(click_x, click_y, duration=0)
-        except Exception:
-            pass
-        pyautogui.click(click_x, click_y)
-        time.sleep(0.2)
-
-        # Clear any existing text and type the new value
-        key_down('ctrl'); press_key('a', delay=0.02); key_up('ctrl')
-        press_key('backspace', delay=0.05)
-        time.sleep(0.05)
+    def enter_value(data_key: str, value_to_type):
         # Special handling for sex field: normalize to first letter and uppercase
         if data_key == "sex":
             normalized = str(value_to_type).strip().upper()[:1]
@@ -113,24 +123,78 @@ def fill_patient_form(patient_data):
                         normalized = ch.upper()
                         break
             if normalized in ("M", "F"):
-                type_text(normalized, interval=0.07)
-                time.sleep(0.1)
+                with action("type_sex"):
+                    type_text(normalized, interval=0.07)
+                    io.sleep(0.1)
             else:
                 # Fallback for dropdowns: open menu and select by first letter
-                press_key('alt', delay=0.05)  # noop if not used by control
-                press_key('down', delay=0.1)
-                if value_to_type:
-                    type_text(str(value_to_type)[0].upper(), interval=0.07)
-                press_key('enter', delay=0.1)
+                with action("sex_dropdown"):
+                    press_key('alt', delay=0.05)  # noop if not used by control
+                    press_key('down', delay=0.1)
+                    if value_to_type:
+                        type_text(str(value_to_type)[0].upper(), interval=0.07)
+                    press_key('enter', delay=0.1)
         else:
             # Use reliable clipboard paste instead of per-character typing
-            pyperclip.copy(str(value_to_type))
-            key_down('ctrl'); press_key('v', delay=0.02); key_up('ctrl')
-        time.sleep(0.1)
+            with action("paste"):
+                io.copy(str(value_to_type))
+                key_down('ctrl'); press_key('v', delay=0.02); key_up('ctrl')
+
+    if mode == "tab":
+        # --- Tab-chained mode: one focus click, then the form's fixed tab order ---
+        # Entries that are not data fields (e.g. a read-only ID box) are just tabbed over.
+        tab_order = coords.get("tab_order", FIELD_ORDER)
+        # A freshly reset form has empty fields, so the clear step is skipped unless asked for
+        clear_first = bool(coords.get("tab_clear", False))
+        first = coords[tab_order[0]]
+        with action("field_click"):
+            io.move_to(vm_window.left + first['x'], vm_window.top + first['y'])
+            io.click(vm_window.left + first['x'], vm_window.top + first['y'])
+            io.sleep(0.2)
+        for i, field_name in enumerate(tab_order):
+            if i:
+                with action("tab"):
+                    press_key('tab', delay=0.05)
+            if field_name not in FIELD_ORDER:
+                continue
+            data_key = field_name.replace("_field", "")
+            value_to_type = patient_data.get(data_key, "")
+            print(f"Typing '{value_to_type}' into {data_key} field...")
+            if clear_first:
+                clear_field()
+            enter_value(data_key, value_to_type)
+            with action("settle"):
+                io.sleep(0.05)
+    else:
+        # --- UPDATED: Click each field explicitly before typing (more reliable than Tab in VMs) ---
+        for i, field_name in enumerate(FIELD_ORDER):
+            data_key = field_name.replace("_field", "")
+            value_to_type = patient_data.get(data_key, "")
+            print(f"Typing '{value_to_type}' into {data_key} field...")
+
+            # Focus the exact field via calibrated coordinates
+            field_coords = coords[field_name]
+            click_x = vm_window.left + field_coords['x']
+            click_y = vm_window.top + field_coords['y']
+            with action("field_click"):
+                # Faster cursor movement (2x): use duration=0 and ensure failsafe off
+                try:
+                    io.move_to(click_x, click_y)
+                except Exception:
+                    pass
+                io.click(click_x, click_y)
+                io.sleep(0.2)
+
+            # Clear any existing text and type the new value
+            clear_field()
+            enter_value(data_key, value_to_type)
+            with action("settle"):
+                io.sleep(0.1)
+
 
-        
     add_button_coords = coords["add_button"]
     print("Clicking the 'Add' button...")
-    pyautogui.click(vm_window.left + add_button_coords['x'], vm_window.top + add_button_coords['y'])
-    
-    print("Automation completed successfully!")
\ No newline at end of file
+    with action("add_click"):
+        io.click(vm_window.left + add_button_coords['x'], vm_window.top + add_button_coords['y'])
+
+    print("Automation completed successfully!")
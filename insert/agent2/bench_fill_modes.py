@@ -0,0 +1,36 @@
+# bench_fill_modes.py - compare click vs tab fill modes on the recording backend
+#
+# Runs fill_patient_form() against RecordingBackend (no VM, no real input) and
+# prints how many input events, backend calls and how much waiting each mode
+# needs per record, with per-call input ("calls") and the compiled batch
+# ("batch", see key_events.py).
+from automator import fill_patient_form
+from input_backend import RecordingBackend, FAKE_CALIBRATION
+
+SAMPLE = {
+    "id": "25",
+    "name": "Jorge Smith",
+    "address": "10 Downing Street",
+    "date_of_birth": "01/01/1980",
+    "age": "45",
+    "sex": "M",
+}
+
+
+def main():
+    results = {}
+    for mode in ("click", "tab"):
+        for input_mode in ("calls", "batch"):
+            io = RecordingBackend()
+            fill_patient_form(SAMPLE, backend=io, mode=mode, coords=FAKE_CALIBRATION, input_mode=input_mode)
+            results[f"{mode}/{input_mode}"] = io.summary()
+
+    print("\n--- Per-record cost (recording backend) ---")
+    for name, s in results.items():
+        print(f"  {name:<11}  events={s['events']:<4} calls={s['calls']:<4} sleeps={s['sleeps']:<4} waited={s['waited_s']:.2f}s")
+    ratio = results["tab/calls"]["waited_s"] / results["click/calls"]["waited_s"]
+    print(f"  tab/click wait ratio: {ratio:.2f}")
+
+
+if __name__ == "__main__":
+    main()
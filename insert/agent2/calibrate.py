@@ -42,6 +42,11 @@ def calibrate_and_save():
         calibration_data[name] = {"x": rel_x, "y": rel_y}
         print(f"-> Captured '{name}' at relative coordinates: ({rel_x}, {rel_y})\n")
 
+    # Tab order of the VB6 form, used by FILL_MODE=tab (one focus click, then Tab).
+    # Edit this list in calibration.json if the form's TabIndex order differs;
+    # entries that are not data fields are tabbed over without typing.
+    calibration_data["tab_order"] = ["name_field", "address_field", "date_of_birth_field", "age_field", "sex_field"]
+
     with open("calibration.json", "w") as f:
         json.dump(calibration_data, f, indent=4)
         
@@ -3,6 +3,12 @@ import os
 import subprocess
 import sys
 
+# Shared action timing lives one level up (insert/action_timing.py)
+INSERT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if INSERT_DIR not in sys.path:
+    sys.path.append(INSERT_DIR)
+from action_timing import get_timer
+
 # --- CONFIG: update ONLY if your paths are different ---
 AHK_EXE_DEFAULT = r"C:\Program Files\AutoHotkey\AutoHotkey.exe"
 AGENT3_AHK_DEFAULT = os.path.join(os.path.dirname(__file__), "agent3.ahk")  # <-- the .ahk script in this folder
@@ -14,8 +20,19 @@ def _path(p: str) -> str:
     return os.path.normpath(os.path.expandvars(p))
 
 def run_agent3(patient_data: dict, vm_title: str = "WinXP for VB6",
-               ahk_exe: str = None, agent3_ahk: str = None):
-    """Builds the INI from calibration + patient_data, then runs agent3.ahk via AutoHotkey."""
+               ahk_exe: str = None, agent3_ahk: str = None, coords: dict = None, timer=None):
+    """Builds the INI from calibration + patient_data, then runs agent3.ahk via AutoHotkey.
+
+    The payload build and the AutoHotkey subprocess are timed into `timer`
+    (default: the process-wide agent3 timer); the steps inside agent3.ahk
+    are not visible from here.
+    """
+    timer = timer or get_timer("agent3")
+    with timer.record():
+        return _run_agent3(patient_data, vm_title, ahk_exe, agent3_ahk, coords, timer.action)
+
+
+def _run_agent3(patient_data, vm_title, ahk_exe, agent3_ahk, coords, action):
     ahk_exe = _path(ahk_exe or os.getenv("AHK_EXE", AHK_EXE_DEFAULT))
     agent3_ahk = _path(agent3_ahk or os.getenv("AGENT3_AHK", AGENT3_AHK_DEFAULT))
 
@@ -31,15 +48,16 @@ def run_agent3(patient_data: dict, vm_title: str = "WinXP for VB6",
             f"Expected it next to this runner. If you placed it elsewhere, "
             f"set env var AGENT3_AHK or pass agent3_ahk=..."
         )
-    if not os.path.isfile(CALIB_JSON):
-        raise FileNotFoundError(
-            f"calibration.json not found at:\n  {CALIB_JSON}\n"
-            f"Run calibrate.py first and copy the file here."
-        )
+    if coords is None:
+        if not os.path.isfile(CALIB_JSON):
+            raise FileNotFoundError(
+                f"calibration.json not found at:\n  {CALIB_JSON}\n"
+                f"Run calibrate.py first and copy the file here."
+            )
 
-    # --- load calibration ---
-    with open(CALIB_JSON, "r", encoding="utf-8") as f:
-        coords = json.load(f)
+        # --- load calibration ---
+        with open(CALIB_JSON, "r", encoding="utf-8") as f:
+            coords = json.load(f)
 
     # helper to make "name_field=x,y" lines
     def pair(name: str) -> str:
@@ -73,13 +91,15 @@ def run_agent3(patient_data: dict, vm_title: str = "WinXP for VB6",
         pair("add_button"),
         ""
     ]
-    with open(PAYLOAD_INI, "w", encoding="utf-8") as f:
-        f.write("\n".join(ini_lines))
+    with action("write_payload"):
+        with open(PAYLOAD_INI, "w", encoding="utf-8") as f:
+            f.write("\n".join(ini_lines))
 
     # --- call AutoHotkey ---
     cmd = [ahk_exe, agent3_ahk, PAYLOAD_INI]
     try:
-        completed = subprocess.run(cmd, check=True)
+        with action("ahk_run"):
+            completed = subprocess.run(cmd, check=True)
         return completed.returncode
     except subprocess.CalledProcessError as e:
         raise RuntimeError(
@@ -0,0 +1,264 @@
+# bench_simulator.py - end-to-end insert benchmark against form_simulator.py
+#
+# Starts the simulated VB6 form (optionally on its own Xvfb display), drives
+# it with an unmodified agent automator through real X input (pyautogui), and
+# compares what the form received with what was sent.  Reports records/min,
+# record and field error rates, and, per window of records, throughput and
+# memory of both processes so long soak runs show drift.
+#
+#   python insert/bench_simulator.py --xvfb --agent 2 --records 50
+#   python insert/bench_simulator.py --xvfb --agent 2 --records 5000 --window 250 \
+#       --latency-ms 3 --drop-rate 0.001 --sleep-scale 0.25 --report soak.json
+#
+# Linux/X11 only (Xvfb, plus xclip or xsel for the agent 2 clipboard paste).
+# Agent 3 drives AutoHotkey on Windows and cannot run here.
+#
+# --headless needs no display: the automators drive form_simulator.HeadlessForm
+# (a model of the same form behind a fake input backend), which writes the
+# same log, so the log/compare path and the error rates can be checked
+# anywhere.  Its records/min is modeled VM time (the automators' waits plus
+# --latency-ms per key), not measured X input.
+#
+# Experimental: the X run has not been run end to end yet; there are no
+# reference numbers for real input.
+#
+#   python insert/bench_simulator.py --headless --agent 2 --records 200 --drop-rate 0.001
+import os
+import sys
+import json
+import time
+import random
+import string
+import argparse
+import subprocess
+from typing import Dict, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+if BASE_DIR not in sys.path:
+    sys.path.append(BASE_DIR)
+
+from input_backend import LiveBackend
+from service import load_agent
+
+
+def rss_kb(pid="self") -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class SimWindow:
+    def __init__(self, state: Dict):
+        self.title = state["title"]
+        self.left, self.top = state["left"], state["top"]
+        self.width, self.height = state["width"], state["height"]
+
+    def activate(self):
+        pass
+
+
+class SimulatorBackend(LiveBackend):
+    """Real X input, but the window comes from the simulator's state file.
+
+    sleep_scale < 1 shortens the automators' waits to stress the form.
+    """
+
+    def __init__(self, state: Dict, sleep_scale: float = 1.0):
+        super().__init__()
+        # No pauses between pyautogui calls beyond the automators' own sleeps
+        self._pyautogui.PAUSE = 0
+        self._window = SimWindow(state)
+        self.sleep_scale = sleep_scale
+
+    def find_window(self, title: str):
+        if title not in self._window.title:
+            raise IndexError(title)
+        return self._window
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds * self.sleep_scale)
+
+
+def make_records(n: int, seed: int = 1) -> List[Dict]:
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        # Unique, mixed-case names so received rows can be matched back
+        tag = "".join(string.ascii_lowercase[int(d)] for d in str(i))
+        out.append({
+            "name": rng.choice(["Jorge", "Ann", "Maria", "Tom"]) + " " + tag.capitalize(),
+            "address": f"{rng.randint(1, 999)} {rng.choice(['High St', 'Main Rd', 'Oak Ave'])}",
+            "date_of_birth": f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(1930, 2020)}",
+            "age": str(rng.randint(1, 95)),
+            "sex": rng.choice(["M", "F"]),
+        })
+    return out
+
+
+def read_log(path: str) -> List[Dict]:
+    if not os.path.isfile(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(sent: List[Dict], received: List[Dict]) -> Dict:
+    """Matches received records to sent ones by name, then counts field errors."""
+    by_name = {r["record"].get("name"): r["record"] for r in received}
+    exact = missing = 0
+    field_errors: Dict[str, int] = {}
+    for rec in sent:
+        got = by_name.get(rec["name"])
+        if got is None:
+            missing += 1
+            continue
+        bad = [k for k, v in rec.items() if got.get(k, "") != v]
+        if not bad:
+            exact += 1
+        for k in bad:
+            field_errors[k] = field_errors.get(k, 0) + 1
+    n = max(1, len(sent))
+    return {
+        "sent": len(sent),
+        "received": len(received),
+        "exact": exact,
+        "unmatched": missing,
+        "record_error_rate": round(1 - exact / n, 4),
+        "field_errors": field_errors,
+    }
+
+
+def wait_for_state(path: str, proc: subprocess.Popen, timeout: float = 20.0) -> Dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Simulator exited early (code {proc.returncode}).")
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        time.sleep(0.1)
+    raise RuntimeError("Simulator did not come up.")
+
+
+# ------------------------------------ CLI -------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark an insert agent against the simulated VB6 form.")
+    ap.add_argument("--agent", choices=["1", "2"], default="2", help="Agent automator to drive.")
+    ap.add_argument("--records", type=int, default=50, help="Records to insert.")
+    ap.add_argument("--window", type=int, default=25, help="Records per throughput/memory sample.")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="Simulator processing time per keystroke.")
+    ap.add_argument("--drop-rate", type=float, default=0.0, help="Simulator dropped-keystroke rate.")
+    ap.add_argument("--sleep-scale", type=float, default=1.0, help="Scale the automators' waits (e.g. 0.25).")
+    ap.add_argument("--fill-mode", choices=["click", "tab"], help="Agent 2 fill mode (default: FILL_MODE / click).")
+    ap.add_argument("--input-mode", choices=["calls", "batch"], help="Per-call input or one compiled batch per record (default: INPUT_MODE / calls).")
+    ap.add_argument("--headless", action="store_true", help="Drive the form model instead of the Tk window (no X needed).")
+    ap.add_argument("--xvfb", action="store_true", help="Start a private Xvfb display for the run.")
+    ap.add_argument("--display", type=str, default=":99", help="Display used with --xvfb.")
+    ap.add_argument("--workdir", type=str, default="_sim_bench", help="Simulator log/state folder.")
+    ap.add_argument("--seed", type=int, default=1, help="Seed for records and dropped keys.")
+    ap.add_argument("--report", type=str, help="Write the JSON report here.")
+    args = ap.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    log_path = os.path.join(args.workdir, "received.jsonl")
+    state_path = os.path.join(args.workdir, "sim_state.json")
+    for p in (log_path, state_path):
+        if os.path.exists(p):
+            os.remove(p)
+
+    xvfb = sim = None
+    if args.xvfb and not args.headless:
+        xvfb = subprocess.Popen(["Xvfb", args.display, "-screen", "0", "1024x768x24", "-nolisten", "tcp"])
+        os.environ["DISPLAY"] = args.display
+        time.sleep(1.0)
+    if args.fill_mode:
+        os.environ["FILL_MODE"] = args.fill_mode
+    if args.input_mode:
+        os.environ["INPUT_MODE"] = args.input_mode
+
+    if args.headless:
+        from form_simulator import HeadlessForm, calibration
+        backend = HeadlessForm(log_path, latency_ms=args.latency_ms, drop_rate=args.drop_rate, seed=args.seed,
+                               sleep_scale=args.sleep_scale)
+        coords = calibration()
+        clock = backend.clock  # modeled VM time
+    else:
+        sim = subprocess.Popen([sys.executable, os.path.join(BASE_DIR, "form_simulator.py"),
+                                "--latency-ms", str(args.latency_ms), "--drop-rate", str(args.drop_rate),
+                                "--seed", str(args.seed), "--log", log_path, "--state", state_path])
+        clock = time.monotonic
+    try:
+        if sim is not None:
+            state = wait_for_state(state_path, sim)
+            backend = SimulatorBackend(state, sleep_scale=args.sleep_scale)
+            coords = state["calibration"]
+        insert = load_agent(args.agent, backend=backend, coords=coords)
+
+        records = make_records(args.records, seed=args.seed)
+        windows = []
+        failures = 0
+        t_start = t_win = clock()
+        for i, rec in enumerate(records, 1):
+            try:
+                insert(rec)
+            except Exception as e:
+                failures += 1
+                print(f"[warn] record {i}: {e}")
+            if i % args.window == 0 or i == len(records):
+                now = clock()
+                n = args.window if i % args.window == 0 else i % args.window
+                windows.append({
+                    "upto": i,
+                    "records_per_min": round(60.0 * n / (now - t_win), 2),
+                    "driver_rss_kb": rss_kb(),
+                    "simulator_rss_kb": rss_kb(sim.pid) if sim is not None else None,
+                })
+                sim_rss = f" sim={windows[-1]['simulator_rss_kb']}kB" if sim is not None else ""
+                print(f"[info] {i}/{len(records)}  {windows[-1]['records_per_min']} rec/min  "
+                      f"rss driver={windows[-1]['driver_rss_kb']}kB{sim_rss}")
+                t_win = now
+        elapsed = clock() - t_start
+        if sim is not None:
+            time.sleep(0.5)  # let the form process the last Add
+    finally:
+        if sim is not None:
+            sim.terminate()
+            sim.wait()
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+
+    received = read_log(log_path)
+    result = compare(records, received)
+    rates = [w["records_per_min"] for w in windows]
+    report = {
+        "agent": args.agent,
+        "headless": args.headless,
+        "settings": {k: getattr(args, k) for k in ("latency_ms", "drop_rate", "sleep_scale", "fill_mode", "input_mode")},
+        "elapsed_s": round(elapsed, 2),
+        "records_per_min": round(60.0 * len(records) / elapsed, 2) if elapsed else 0.0,
+        "automation_failures": failures,
+        "keys": received[-1]["keys"] if received else 0,
+        "dropped_keys": received[-1]["dropped"] if received else 0,
+        "throughput_drift": round(rates[-1] / rates[0] - 1, 4) if len(rates) > 1 and rates[0] else 0.0,
+        "windows": windows,
+        **result,
+    }
+    print(f"[ok] {report['received']}/{report['sent']} received, {report['exact']} exact "
+          f"(record error rate {report['record_error_rate']:.2%}), {report['records_per_min']} records/min, "
+          f"throughput drift {report['throughput_drift']:+.1%}")
+    if result["field_errors"]:
+        print(f"     field errors: {result['field_errors']}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"[ok] Report → {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+# form_simulator.py - local stand-in for the VB6 patient form
+#
+# A small Tk window with the VM's title ("WinXP for VB6") and the legacy form's
+# fields (Name, Address, Date of Birth, Age, Sex, Add).  The unmodified
+# automators can drive it, so insert changes can be benchmarked headless
+# (Xvfb) instead of being checked by eye against the real VM.
+#
+# Like the VB6 app it can be slow and lossy:
+#   --latency-ms  time the form spends processing each keystroke (blocks the
+#                 event loop, so input queues up as it does on a busy VM)
+#   --drop-rate   fraction of keystrokes silently lost
+# Every Add appends what the form actually received to --log (JSON lines),
+# and --state gets the window geometry plus a matching calibration.
+#
+# HeadlessForm is the same form as a fake input backend: it applies the
+# automators' clicks and keys to a model of the fields (focus, Ctrl+A, paste,
+# Tab, Backspace, dropped keys) and writes the same log, so the log/compare
+# path of bench_simulator.py can be checked without an X display.
+#
+#   python insert/form_simulator.py --latency-ms 5 --drop-rate 0.001 --log received.jsonl
+import os
+import json
+import time
+import random
+import sys
+import argparse
+import tkinter as tk
+from typing import Dict, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+if BASE_DIR not in sys.path:
+    sys.path.append(BASE_DIR)
+
+from input_backend import RecordingBackend
+
+WINDOW_TITLE = "WinXP for VB6"
+WIDTH, HEIGHT = 640, 480
+
+# (data key, label, y of the row centre); positions stay clear of the points the
+# automators click for focus: the title bar (100, 15) and the window centre.
+FIELDS = [
+    ("name", "Name", 70),
+    ("address", "Address", 105),
+    ("date_of_birth", "Date of Birth", 140),
+    ("age", "Age", 175),
+    ("sex", "Sex", 210),
+]
+ENTRY_X, ENTRY_W = 180, 300
+ADD_BUTTON = (320, 330)
+
+MODIFIER_KEYS = {"Shift_L", "Shift_R", "Control_L", "Control_R", "Alt_L", "Alt_R"}
+
+
+def _rss_kb() -> Optional[int]:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def append_received(log_path: str, seq: int, record: Dict, keys: int, dropped: int) -> None:
+    """One received record as a JSON line (the format bench_simulator.read_log expects)."""
+    line = {"seq": seq, "ts": round(time.time(), 3), "record": record,
+            "keys": keys, "dropped": dropped, "rss_kb": _rss_kb()}
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(line) + "\n")
+
+
+def calibration() -> Dict:
+    """Field / button positions relative to the window, in calibration.json format."""
+    coords = {f"{key}_field": {"x": ENTRY_X + ENTRY_W // 2, "y": y} for key, _, y in FIELDS}
+    coords["add_button"] = {"x": ADD_BUTTON[0], "y": ADD_BUTTON[1]}
+    coords["tab_order"] = [f"{key}_field" for key, _, _ in FIELDS]
+    return coords
+
+
+class FormSimulator:
+    def __init__(self, root: tk.Tk, log_path: str, latency_ms: float = 0.0, drop_rate: float = 0.0,
+                 seed: Optional[int] = None, title: str = WINDOW_TITLE):
+        self.root = root
+        self.log_path = log_path
+        self.latency = latency_ms / 1000.0
+        self.drop_rate = drop_rate
+        self.rng = random.Random(seed)
+        self.seq = 0
+        self.keys = 0
+        self.dropped = 0
+
+        root.title(title)
+        root.geometry(f"{WIDTH}x{HEIGHT}+0+0")
+        root.resizable(False, False)
+        # Stands in for the title bar the automators click to focus the VM
+        tk.Label(root, text=title, anchor="w", bg="#0a246a", fg="white").place(x=0, y=0, width=WIDTH, height=30)
+
+        self.entries: Dict[str, tk.Entry] = {}
+        for key, label, y in FIELDS:
+            tk.Label(root, text=f"{label}:", anchor="w").place(x=40, y=y - 11, width=130, height=22)
+            entry = tk.Entry(root)
+            entry.place(x=ENTRY_X, y=y - 11, width=ENTRY_W, height=22)
+            entry.bind("<KeyPress>", self._on_key)
+            # VB6 text boxes select all on Ctrl+A (Tk's default moves to line start)
+            entry.bind("<Control-a>", self._select_all)
+            self.entries[key] = entry
+        bx, by = ADD_BUTTON
+        tk.Button(root, text="Add", command=self._on_add).place(x=bx - 50, y=by - 15, width=100, height=30)
+        self.status = tk.Label(root, text="0 received", anchor="w")
+        self.status.place(x=40, y=HEIGHT - 40, width=400, height=22)
+
+    def _on_key(self, event):
+        if event.keysym in MODIFIER_KEYS:
+            return None
+        self.keys += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.drop_rate and self.rng.random() < self.drop_rate:
+            self.dropped += 1
+            return "break"
+        return None
+
+    def _select_all(self, event):
+        event.widget.select_range(0, tk.END)
+        event.widget.icursor(tk.END)
+        return "break"
+
+    def _on_add(self):
+        self.seq += 1
+        record = {key: entry.get() for key, entry in self.entries.items()}
+        append_received(self.log_path, self.seq, record, self.keys, self.dropped)
+        # The legacy form clears itself after a successful Add
+        for entry in self.entries.values():
+            entry.delete(0, tk.END)
+        self.status.config(text=f"{self.seq} received, {self.dropped}/{self.keys} keys dropped")
+
+    def calibration(self) -> Dict:
+        return calibration()
+
+    def state(self) -> Dict:
+        self.root.update_idletasks()
+        return {
+            "pid": os.getpid(),
+            "title": self.root.title(),
+            "left": self.root.winfo_rootx(),
+            "top": self.root.winfo_rooty(),
+            "width": WIDTH,
+            "height": HEIGHT,
+            "log": os.path.abspath(self.log_path),
+            "calibration": self.calibration(),
+        }
+
+
+class HeadlessForm(RecordingBackend):
+    """Fake input backend that feeds the form model; the window sits at (0, 0).
+
+    Keys typed with no field focused are counted but go nowhere, as on the
+    real form.  Dropdown keys (Alt, Down, Enter) do nothing in a text box.
+    """
+
+    def __init__(self, log_path: str, latency_ms: float = 0.0, drop_rate: float = 0.0, seed: Optional[int] = None,
+                 sleep_scale: float = 1.0, title: str = WINDOW_TITLE):
+        super().__init__(window_titles=(title,))
+        self.log_path = log_path
+        self.latency = latency_ms / 1000.0
+        self.drop_rate = drop_rate
+        self.rng = random.Random(seed)
+        self.sleep_scale = sleep_scale
+        self.order: List[str] = [key for key, _, _ in FIELDS]
+        self.values: Dict[str, str] = {key: "" for key in self.order}
+        self.focus: Optional[str] = None
+        self.selected = False
+        self.held = set()
+        self.seq = 0
+        self.keys = 0
+        self.dropped = 0
+
+    def _field_at(self, x: int, y: int) -> Optional[str]:
+        for key, _, fy in FIELDS:
+            if ENTRY_X <= x <= ENTRY_X + ENTRY_W and abs(y - fy) <= 11:
+                return key
+        return None
+
+    def click(self, x: int, y: int):
+        super().click(x, y)
+        bx, by = ADD_BUTTON
+        if abs(x - bx) <= 50 and abs(y - by) <= 15:
+            self.seq += 1
+            append_received(self.log_path, self.seq, dict(self.values), self.keys, self.dropped)
+            self.values = {key: "" for key in self.order}
+            self.focus, self.selected = None, False
+            return
+        # A click places the cursor and clears any selection
+        self.focus, self.selected = self._field_at(x, y), False
+
+    def _insert(self, text: str):
+        if self.focus is None:
+            return
+        if self.selected:
+            self.values[self.focus], self.selected = "", False
+        self.values[self.focus] += text
+
+    def _key(self, key: str):
+        if key in ("shift", "ctrl", "alt") and key not in self.held:
+            return  # a bare modifier tap
+        self.keys += 1
+        # Processing time per key is modeled as VM time, like the automators' sleeps
+        self.waited += self.latency
+        if self.drop_rate and self.rng.random() < self.drop_rate:
+            self.dropped += 1
+            return
+        if "ctrl" in self.held:
+            if key == "a" and self.focus is not None:
+                self.selected = True
+            elif key == "v":
+                self._insert(self.clipboard)
+        elif key == "tab":
+            i = self.order.index(self.focus) + 1 if self.focus in self.order else len(self.order)
+            # Tab from the last field moves to the Add button
+            self.focus, self.selected = (self.order[i] if i < len(self.order) else None), False
+        elif key == "backspace":
+            if self.focus is not None:
+                if self.selected:
+                    self.values[self.focus], self.selected = "", False
+                else:
+                    self.values[self.focus] = self.values[self.focus][:-1]
+        elif len(key) == 1:
+            self._insert(key.upper() if "shift" in self.held else key)
+
+    def press(self, key: str):
+        super().press(key)
+        self._key(key)
+
+    def key_down(self, key: str):
+        super().key_down(key)
+        self.held.add(key)
+
+    def key_up(self, key: str):
+        super().key_up(key)
+        self.held.discard(key)
+
+    def write(self, text: str, interval: float = 0.0):
+        super().write(text, interval)
+        for ch in text:
+            self._key(ch)
+
+    def sleep(self, seconds: float):
+        super().sleep(seconds * self.sleep_scale)
+
+
+# ------------------------------------ CLI -------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Tk stand-in for the VB6 patient form.")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="Processing time per keystroke.")
+    ap.add_argument("--drop-rate", type=float, default=0.0, help="Fraction of keystrokes lost (0-1).")
+    ap.add_argument("--seed", type=int, default=None, help="Seed for the dropped-keystroke RNG.")
+    ap.add_argument("--log", type=str, default="received.jsonl", help="Append received records here (JSON lines).")
+    ap.add_argument("--state", type=str, help="Write window geometry + calibration here once the window is up.")
+    ap.add_argument("--write-calibration", type=str, help="Also write the matching calibration.json here.")
+    args = ap.parse_args()
+
+    root = tk.Tk()
+    sim = FormSimulator(root, args.log, latency_ms=args.latency_ms, drop_rate=args.drop_rate, seed=args.seed)
+
+    def publish():
+        state = sim.state()
+        if args.state:
+            tmp = args.state + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f, indent=2)
+            os.replace(tmp, args.state)
+        if args.write_calibration:
+            with open(args.write_calibration, "w", encoding="utf-8") as f:
+                json.dump(state["calibration"], f, indent=4)
+        print(f"[ok] Simulator up at ({state['left']}, {state['top']}) {WIDTH}x{HEIGHT}, logging to {args.log}")
+
+    root.after(200, publish)
+    root.mainloop()
+
+
+if __name__ == "__main__":
+    main()
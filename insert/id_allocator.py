@@ -0,0 +1,148 @@
+# id_allocator.py - concurrency-safe patient ID allocation
+#
+# Replaces the unlocked read/rewrite of id_counter.txt.  IDs are handed out
+# from blocks reserved in a SQLite database: reserving a block is one short
+# BEGIN IMMEDIATE transaction (serialised across processes by SQLite's file
+# lock), and every ID inside the block is then served from memory.  The
+# high-water mark only moves up while other workers may hold blocks above it,
+# so a crash loses the unused rest of a block (a gap) but never causes an ID
+# to be handed out twice.  On a clean shutdown release() hands the unused rest
+# back when this worker's block is still the newest one.
+#
+# All agents sharing a counter must run on one machine: SQLite's file locks
+# are not reliable on network shares, so the database belongs on a local disk.
+import os
+import socket
+import sqlite3
+import time
+from typing import Optional
+
+
+class BlockIdAllocator:
+    def __init__(self, db_path: str, block_size: int = 20, start: int = 25,
+                 worker: Optional[str] = None, seed_file: Optional[str] = None):
+        self.db_path = db_path
+        self.block_size = max(1, int(block_size))
+        self.worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+        self._next = 0
+        self._end = 0  # exclusive
+        self._init_db(int(start), seed_file)
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: we issue BEGIN IMMEDIATE ourselves
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _init_db(self, start: int, seed_file: Optional[str]):
+        con = self._connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            con.execute("CREATE TABLE IF NOT EXISTS counter (name TEXT PRIMARY KEY, next_id INTEGER NOT NULL)")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS blocks ("
+                " worker TEXT NOT NULL, first_id INTEGER NOT NULL, end_id INTEGER NOT NULL, reserved_at REAL NOT NULL)"
+            )
+            row = con.execute("SELECT next_id FROM counter WHERE name = 'patient'").fetchone()
+            if row is None:
+                # First run: continue from the legacy id_counter.txt if there is one
+                con.execute("INSERT INTO counter (name, next_id) VALUES ('patient', ?)",
+                            (max(start, _read_seed(seed_file)),))
+            con.execute("COMMIT")
+        except Exception:
+            # BEGIN IMMEDIATE itself may have failed (e.g. lock timeout); don't mask that
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+
+    def _reserve(self, count: int, at_least: int = 0) -> int:
+        con = self._connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            (first,) = con.execute("SELECT next_id FROM counter WHERE name = 'patient'").fetchone()
+            first = max(first, at_least)
+            con.execute("UPDATE counter SET next_id = ? WHERE name = 'patient'", (first + count,))
+            con.execute("INSERT INTO blocks (worker, first_id, end_id, reserved_at) VALUES (?, ?, ?, ?)",
+                        (self.worker, first, first + count, time.time()))
+            con.execute("COMMIT")
+            return first
+        except Exception:
+            # BEGIN IMMEDIATE itself may have failed (e.g. lock timeout); don't mask that
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+
+    def next_id(self) -> int:
+        """Next unused ID; touches the database only once per block."""
+        if self._next >= self._end:
+            self._next = self._reserve(self.block_size)
+            self._end = self._next + self.block_size
+        v = self._next
+        self._next += 1
+        return v
+
+    def ensure_above(self, used_id: int) -> None:
+        """Records that `used_id` was taken manually so it is never handed out."""
+        used_id = int(used_id)
+        if self._next <= used_id < self._end:
+            self._next = used_id + 1
+            return
+        if used_id >= self._end:
+            self._next = self._reserve(self.block_size, at_least=used_id + 1)
+            self._end = self._next + self.block_size
+
+    def release(self, pending: Optional[int] = None) -> int:
+        """Returns the unused rest of the current block; call on clean shutdown.
+
+        `pending` is an ID that was handed out but never used (the one
+        prefilled in the form).  IDs can only be returned while no other
+        worker has reserved past this block; otherwise they stay a gap.
+        Returns how many IDs were given back.
+        """
+        if pending is not None and int(pending) == self._next - 1:
+            self._next -= 1
+        if self._next >= self._end:
+            return 0
+        con = self._connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            (nxt,) = con.execute("SELECT next_id FROM counter WHERE name = 'patient'").fetchone()
+            returned = 0
+            if nxt == self._end:
+                con.execute("UPDATE counter SET next_id = ? WHERE name = 'patient'", (self._next,))
+                con.execute("UPDATE blocks SET end_id = ? WHERE worker = ? AND end_id = ?",
+                            (self._next, self.worker, self._end))
+                con.execute("DELETE FROM blocks WHERE first_id = end_id")
+                returned = self._end - self._next
+            con.execute("COMMIT")
+        except Exception:
+            # BEGIN IMMEDIATE itself may have failed (e.g. lock timeout); don't mask that
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+        self._next = self._end = 0
+        return returned
+
+    def high_water_mark(self) -> int:
+        """Highest ID reserved by any worker so far (0 if none)."""
+        con = self._connect()
+        try:
+            (nxt,) = con.execute("SELECT next_id FROM counter WHERE name = 'patient'").fetchone()
+            (reserved,) = con.execute("SELECT COUNT(*) FROM blocks").fetchone()
+            return nxt - 1 if reserved else 0
+        finally:
+            con.close()
+
+
+def _read_seed(path: Optional[str]) -> int:
+    if not path:
+        return 0
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return int((f.read() or "").strip())
+    except Exception:
+        return 0
@@ -0,0 +1,249 @@
+# input_backend.py - input/window backends shared by the insert agents
+#
+# The automators talk to the VM only through a backend object, so the same
+# fill logic can drive the real VM (LiveBackend) or a RecordingBackend that
+# just logs events and adds up the waits (used for benchmarks and dry runs).
+import os
+import time
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+# Seconds pyautogui/pydirectinput pause after each call while send() plays a
+# batch: the explicit "wait" events carry the pacing, but the VM still drops
+# keys sent back to back with no gap at all.
+BATCH_MIN_PAUSE = float(os.environ.get("BATCH_MIN_PAUSE", "0.01"))
+
+
+class LiveBackend:
+    """pyautogui + pydirectinput (when available) + pyperclip + pygetwindow."""
+
+    def __init__(self):
+        import pyautogui
+        import pyperclip
+        try:
+            import pygetwindow as gw
+        except Exception:
+            # pygetwindow has no Linux support; subclasses (e.g. the simulator bench) find windows themselves
+            gw = None
+        try:
+            import pydirectinput as pdi
+        except Exception:
+            pdi = None
+        self._pyautogui = pyautogui
+        self._gw = gw
+        self._pyperclip = pyperclip
+        self._pdi = pdi
+        self._windows = {}
+
+    def find_window(self, title: str):
+        """First window with `title`; raises IndexError when there is none.
+
+        The handle is cached, so a long-lived backend only enumerates windows
+        again once the cached one has gone away.
+        """
+        win = self._windows.get(title)
+        if win is not None:
+            try:
+                if title in win.title:
+                    return win
+            except Exception:
+                pass
+        if self._gw is None:
+            raise RuntimeError("pygetwindow is not available on this platform; cannot locate windows.")
+        win = self._gw.getWindowsWithTitle(title)[0]
+        self._windows[title] = win
+        return win
+
+    def clock(self) -> float:
+        return time.monotonic()
+
+    def click(self, x: int, y: int):
+        self._pyautogui.click(x, y)
+
+    def move_to(self, x: int, y: int):
+        self._pyautogui.moveTo(x, y, duration=0)
+
+    def scroll(self, clicks: int):
+        self._pyautogui.scroll(clicks)
+
+    def press(self, key: str):
+        if self._pdi:
+            self._pdi.press(key)
+        else:
+            self._pyautogui.press(key)
+
+    def key_down(self, key: str):
+        if self._pdi:
+            self._pdi.keyDown(key)
+        else:
+            self._pyautogui.keyDown(key)
+
+    def key_up(self, key: str):
+        if self._pdi:
+            self._pdi.keyUp(key)
+        else:
+            self._pyautogui.keyUp(key)
+
+    def write(self, text: str, interval: float = 0.0):
+        self._pyautogui.typewrite(text, interval=interval)
+
+    @property
+    def direct_input(self) -> bool:
+        return self._pdi is not None
+
+    def copy(self, text: str):
+        self._pyperclip.copy(text)
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+    def send(self, events: List[tuple]):
+        """Plays a compiled event list (key_events.py).
+
+        Each event is still its own library call; the libraries' PAUSE after
+        every call is lowered to BATCH_MIN_PAUSE for the batch, and the list's
+        ("wait", s) events do the rest of the pacing.
+        """
+        libs = [m for m in (self._pyautogui, self._pdi) if m is not None and hasattr(m, "PAUSE")]
+        saved = [m.PAUSE for m in libs]
+        for m in libs:
+            m.PAUSE = BATCH_MIN_PAUSE
+        try:
+            _play(self, events)
+        finally:
+            for m, pause in zip(libs, saved):
+                m.PAUSE = pause
+
+
+def _play(backend, events: List[tuple]):
+    handlers = {
+        "click": backend.click, "move": backend.move_to, "press": backend.press,
+        "key_down": backend.key_down, "key_up": backend.key_up, "copy": backend.copy, "wait": backend.sleep,
+    }
+    for kind, *args in events:
+        handlers[kind](*args)
+
+
+# Placeholder calibration for fake-backend runs (coordinates are never used for real input)
+FAKE_CALIBRATION = {
+    "name_field": {"x": 539, "y": 418},
+    "address_field": {"x": 529, "y": 518},
+    "date_of_birth_field": {"x": 463, "y": 608},
+    "age_field": {"x": 445, "y": 700},
+    "sex_field": {"x": 423, "y": 784},
+    "add_button": {"x": 687, "y": 948},
+    "tab_order": ["name_field", "address_field", "date_of_birth_field", "age_field", "sex_field"],
+}
+
+
+class FakeWindow:
+    def __init__(self, backend: "RecordingBackend", title: str, left: int = 0, top: int = 0,
+                 width: int = 1024, height: int = 768):
+        self._backend = backend
+        self.title = title
+        self.left, self.top, self.width, self.height = left, top, width, height
+
+    def activate(self):
+        self._backend._record(("activate", self.title))
+
+
+class RecordingBackend:
+    """Fake backend: records every input event and sums sleeps instead of waiting.
+
+    `events` holds the last `max_events` (kind, *args) tuples (None keeps
+    all of them; long fake runs would otherwise grow without bound) and
+    `n_events` counts every event; `waited` is the total time the
+    automation would have slept, which dominates per-record time on the VM.
+    `calls` counts backend calls; send() plays its list event by event, so
+    it counts one per event, as the live libraries make one call per event.
+    time_scale > 0 really sleeps that fraction of it (1.0 = VM pace), for
+    pipeline runs that need realistic insert timing.
+    """
+
+    direct_input = True
+
+    def __init__(self, window_titles: Tuple[str, ...] = ("WinXP for VB6",), time_scale: float = 0.0,
+                 max_events: Optional[int] = 10000):
+        self.window_titles = window_titles
+        self.time_scale = time_scale
+        self.events: Deque[tuple] = deque(maxlen=max_events)
+        self.n_events = 0
+        self.clipboard = ""
+        self.waited = 0.0
+        self.sleeps = 0
+        self.calls = 0
+
+    def _record(self, event: tuple):
+        self.n_events += 1
+        self.events.append(event)
+
+    def find_window(self, title: str):
+        if title not in self.window_titles:
+            raise IndexError(title)
+        return FakeWindow(self, title)
+
+    def clock(self) -> float:
+        """Wall clock plus the waits that were skipped, i.e. modeled VM time."""
+        return time.monotonic() + self.waited * max(0.0, 1.0 - self.time_scale)
+
+    def click(self, x: int, y: int):
+        self.calls += 1
+        self._record(("click", x, y))
+
+    def move_to(self, x: int, y: int):
+        self.calls += 1
+        self._record(("move", x, y))
+
+    def scroll(self, clicks: int):
+        self.calls += 1
+        self._record(("scroll", clicks))
+
+    def press(self, key: str):
+        self.calls += 1
+        self._record(("press", key))
+
+    def key_down(self, key: str):
+        self.calls += 1
+        self._record(("key_down", key))
+
+    def key_up(self, key: str):
+        self.calls += 1
+        self._record(("key_up", key))
+
+    def write(self, text: str, interval: float = 0.0):
+        self.calls += 1
+        self._record(("write", text))
+        self.waited += interval * len(text)
+        if self.time_scale > 0 and interval > 0:
+            time.sleep(interval * len(text) * self.time_scale)
+
+    def copy(self, text: str):
+        self.calls += 1
+        self.clipboard = text
+        self._record(("copy", text))
+
+    def sleep(self, seconds: float):
+        self.calls += 1
+        self.waited += seconds
+        self.sleeps += 1
+        if self.time_scale > 0 and seconds > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def send(self, events: List[tuple]):
+        _play(self, events)
+        # LiveBackend.send leaves BATCH_MIN_PAUSE after every input call
+        pause = BATCH_MIN_PAUSE * sum(1 for ev in events if ev[0] not in ("wait", "copy"))
+        self.waited += pause
+        if self.time_scale > 0 and pause > 0:
+            time.sleep(pause * self.time_scale)
+
+    def reset(self):
+        self.events.clear()
+        self.n_events = 0
+        self.waited = 0.0
+        self.sleeps = 0
+        self.calls = 0
+
+    def summary(self) -> dict:
+        return {"events": self.n_events, "sleeps": self.sleeps, "calls": self.calls,
+                "waited_s": round(self.waited, 3)}
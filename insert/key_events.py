@@ -0,0 +1,163 @@
+# key_events.py - compile a record into a minimal input event sequence
+#
+# The automators' helpers send every character as its own press, wrap each
+# capital in its own Shift down/up, and sleep after every call (pyautogui and
+# pydirectinput add their PAUSE on top of that).  compile_record() builds the
+# whole form fill as one event list instead:
+#   - Shift is held across runs of capitals
+#   - a modifier released and pressed again with no key in between stays down
+#     (Ctrl+A then Ctrl+V becomes Ctrl down, a, [copy], v, Ctrl up)
+#   - clear + type becomes Ctrl+A + type, since typing or pasting replaces the
+#     selection (Backspace is only kept in front of the dropdown fallback)
+#   - waits come from a pacing table, only where the form needs them (after
+#     clicks, between typed keys, inside modifier chords, after each field),
+#     and adjacent ones merge
+# backend.send(events) then plays the list with the libraries' per-call PAUSE
+# cut down to a small floor (input_backend.BATCH_MIN_PAUSE); it is still one
+# pyautogui/pydirectinput call per event.
+#
+# Events: ("click", x, y) ("move", x, y) ("press", key) ("key_down", key)
+#         ("key_up", key) ("copy", text) ("wait", seconds)
+from typing import Dict, List, Optional
+
+FIELD_ORDER = ["name_field", "address_field", "date_of_birth_field", "age_field", "sex_field"]
+
+# Seconds; override per VM with "pacing": {...} in calibration.json
+PACING = {
+    "click": 0.2,    # after focusing a field with a click
+    "key": 0.07,     # between typed characters (the VM drops faster keys)
+    "select": 0.05,  # after Ctrl+A, before the selection is replaced
+    "paste": 0.02,   # after Ctrl+V
+    "tab": 0.05,     # after Tab to the next field
+    "menu": 0.1,     # after each dropdown key
+    "chord": 0.03,   # between a modifier going down/up and the key it modifies
+    "field": 0.1,    # settle after each field
+}
+
+MODIFIERS = ("shift", "ctrl", "alt")
+
+
+def type_events(text: str, pacing: Dict[str, float]) -> List[tuple]:
+    out: List[tuple] = []
+    shift = False
+    for ch in str(text):
+        if ch.isalpha() and ch.isupper():
+            if not shift:
+                out.extend([("key_down", "shift"), ("wait", pacing["chord"])])
+                shift = True
+            out.append(("press", ch.lower()))
+        else:
+            if shift:
+                out.append(("key_up", "shift"))
+                shift = False
+            out.append(("press", ch))
+        out.append(("wait", pacing["key"]))
+    if shift:
+        out.append(("key_up", "shift"))
+    return out
+
+
+def select_all(pacing: Dict[str, float]) -> List[tuple]:
+    return [("key_down", "ctrl"), ("wait", pacing["chord"]), ("press", "a"), ("wait", pacing["chord"]),
+            ("key_up", "ctrl"), ("wait", pacing["select"])]
+
+
+def value_events(data_key: str, value, entry: str, clear: bool, pacing: Dict[str, float]) -> List[tuple]:
+    """Events for one field's value; `entry` is "type" (keystrokes) or "paste" (clipboard)."""
+    value = "" if value is None else str(value)
+    if data_key == "sex":
+        # Same normalization as the automators: first letter, upper case
+        normalized = value.strip().upper()[:1]
+        if normalized not in ("M", "F") and normalized:
+            normalized = next((ch.upper() for ch in value if ch.isalpha()), normalized)
+        if normalized not in ("M", "F"):
+            # Dropdown fallback: the selection is not replaced by typing here
+            out = (select_all(pacing) + [("press", "backspace")]) if clear else []
+            out += [("press", "alt"), ("wait", pacing["menu"]), ("press", "down"), ("wait", pacing["menu"])]
+            if value:
+                out += type_events(value[0].upper(), pacing)
+            return out + [("press", "enter"), ("wait", pacing["menu"])]
+        value, entry = normalized, "type"
+
+    out = select_all(pacing) if clear else []
+    if not value:
+        # Nothing will replace the selection, so delete it
+        return (out + [("press", "backspace")]) if clear else out
+    if entry == "paste":
+        return out + [("copy", value), ("key_down", "ctrl"), ("wait", pacing["chord"]), ("press", "v"),
+                      ("wait", pacing["chord"]), ("key_up", "ctrl"), ("wait", pacing["paste"])]
+    return out + type_events(value, pacing)
+
+
+def optimize(events: List[tuple]) -> List[tuple]:
+    """Drops modifier up/down pairs with no key in between and merges adjacent waits."""
+    out: List[tuple] = []
+    for ev in events:
+        if ev[0] == "wait":
+            if ev[1] <= 0:
+                continue
+            if out and out[-1][0] == "wait":
+                out[-1] = ("wait", out[-1][1] + ev[1])
+            else:
+                out.append(ev)
+            continue
+        if ev[0] == "key_down" and ev[1] in MODIFIERS:
+            # Look back over waits (and clipboard copies) for a release of the same modifier
+            i = len(out) - 1
+            while i >= 0 and out[i][0] in ("wait", "copy"):
+                i -= 1
+            if i >= 0 and out[i] == ("key_up", ev[1]):
+                del out[i]
+                if 0 < i < len(out) and out[i - 1][0] == out[i][0] == "wait":
+                    out[i - 1:i + 1] = [("wait", out[i - 1][1] + out[i][1])]
+                continue
+        out.append(ev)
+    return out
+
+
+def compile_record(patient_data: Dict, coords: Dict, window, mode: str = "click", entry: str = "type",
+                   clear: Optional[bool] = None, pacing: Optional[Dict[str, float]] = None) -> List[tuple]:
+    """Whole form fill (field focus, values, Add click) as one optimized event list.
+
+    mode "click" focuses every field with its calibrated click; "tab" clicks
+    the first entry of coords["tab_order"] and tabs through the rest (only
+    clearing when `clear` / coords["tab_clear"] asks for it).
+    """
+    pacing = {**PACING, **(pacing or coords.get("pacing") or {})}
+    left, top = window.left, window.top
+    events: List[tuple] = []
+
+    def click(c: Dict):
+        # click() moves the pointer itself; no separate move
+        events.extend([("click", left + c["x"], top + c["y"]), ("wait", pacing["click"])])
+
+    if mode == "tab":
+        tab_order = coords.get("tab_order", FIELD_ORDER)
+        clear = bool(coords.get("tab_clear", False)) if clear is None else clear
+        click(coords[tab_order[0]])
+        for i, field_name in enumerate(tab_order):
+            if i:
+                events.extend([("press", "tab"), ("wait", pacing["tab"])])
+            if field_name not in FIELD_ORDER:
+                continue
+            data_key = field_name.replace("_field", "")
+            events.extend(value_events(data_key, patient_data.get(data_key, ""), entry, clear, pacing))
+            events.append(("wait", pacing["field"]))
+    else:
+        clear = True if clear is None else clear
+        for field_name in FIELD_ORDER:
+            data_key = field_name.replace("_field", "")
+            click(coords[field_name])
+            events.extend(value_events(data_key, patient_data.get(data_key, ""), entry, clear, pacing))
+            events.append(("wait", pacing["field"]))
+
+    add = coords["add_button"]
+    events.append(("click", left + add["x"], top + add["y"]))
+    return optimize(events)
+
+
+def count_events(events: List[tuple]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for ev in events:
+        counts[ev[0]] = counts.get(ev[0], 0) + 1
+    return counts
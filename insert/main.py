@@ -1,5 +1,6 @@
 import sys
 import os
+import argparse
 import subprocess
 
 BASE_DIR = os.path.dirname(__file__)
@@ -23,19 +24,39 @@ AGENTS = {
 }
 
 
-def choose_agent():
+def choose_agent_key():
     print("Select an Insert agent:")
     for k, meta in sorted(AGENTS.items()):
         print(f"  {k}) {meta['name']}")
-    choice = input("Enter choice: ").strip()
-    return AGENTS.get(choice)
+    return input("Enter choice: ").strip()
+
+
+def choose_agent():
+    return AGENTS.get(choose_agent_key())
 
 
 def main():
-    agent = choose_agent()
+    ap = argparse.ArgumentParser(description="Launch an Insert agent, or keep one warm as a local service.")
+    ap.add_argument("--agent", choices=sorted(AGENTS), help="Agent to use (prompted if omitted).")
+    ap.add_argument("--serve", action="store_true", help="Run a resident HTTP insert service on localhost.")
+    ap.add_argument("--host", type=str, default="127.0.0.1", help="Service bind address (default 127.0.0.1).")
+    ap.add_argument("--port", type=int, default=8765, help="Service port (default 8765).")
+    ap.add_argument("--fake", action="store_true", help="Service uses the recording input backend (no real input).")
+    ap.add_argument("--index-db", type=str, help="Inserted-patient index for the service (default insert/inserted_patients.db).")
+    args = ap.parse_args()
+
+    key = args.agent or choose_agent_key()
+    agent = AGENTS.get(key)
     if not agent:
         print("Invalid choice.")
         sys.exit(1)
+
+    if args.serve:
+        from service import serve
+        print(f"Serving: {agent['name']}")
+        serve(key, agent_name=agent["name"], host=args.host, port=args.port, fake=args.fake, index_db=args.index_db)
+        return
+
     print(f"Launching: {agent['name']}")
     cwd = agent.get("cwd", BASE_DIR)
     sys.exit(subprocess.call(agent["cmd"], cwd=cwd))
@@ -43,5 +64,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
-
@@ -0,0 +1,138 @@
+# patient_index.py - persistent index of patients already inserted into the VB6 app
+#
+# Overlapping scan pages and reruns produce the same patient row more than
+# once, and every redundant insert costs seconds of GUI automation.  The
+# index records every successful insert under two keys, the Patient_ID and a
+# normalized (name, date of birth) pair, and is consulted before a record
+# reaches fill_patient_form() / run_agent3().  Lookups for a whole parsed
+# batch are answered with a couple of indexed IN (...) queries.
+#
+# Records may use either the agent keys (id, name, date_of_birth) or the OCR
+# output keys (Patient_ID, Patient_Name, Date_Of_Birth).
+import os
+import re
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB = os.environ.get("INSERTED_INDEX_DB", os.path.join(BASE_DIR, "inserted_patients.db"))
+
+
+def _field(record: Dict, *names: str) -> str:
+    for n in names:
+        v = record.get(n)
+        if v not in (None, ""):
+            return str(v)
+    return ""
+
+
+def patient_keys(record: Dict) -> Tuple[Optional[str], Optional[str]]:
+    """(patient_id, name|dob) lookup keys; either may be None when unknown."""
+    pid = re.sub(r"[^\d]", "", _field(record, "id", "Patient_ID")) or None
+    name = re.sub(r"[^a-z ]", "", re.sub(r"\s+", " ", _field(record, "name", "Patient_Name").lower())).strip()
+    dob_parts = [p for p in re.split(r"[^\d]+", _field(record, "date_of_birth", "Date_Of_Birth")) if p]
+    dob = "-".join(str(int(p)) for p in dob_parts)
+    name_dob = f"{name}|{dob}" if name and dob else None
+    return pid, name_dob
+
+
+class PatientIndex:
+    def __init__(self, db_path: str = DEFAULT_DB):
+        self.db_path = db_path
+        self.avoided = 0
+        self._lock = threading.Lock()
+        # One connection, shared by the GUI worker / service threads under _lock
+        self._con = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._con:
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS inserted ("
+                " patient_id TEXT, name_dob TEXT, inserted_at REAL NOT NULL, source TEXT)"
+            )
+            self._con.execute("CREATE INDEX IF NOT EXISTS ix_inserted_id ON inserted (patient_id)")
+            self._con.execute("CREATE INDEX IF NOT EXISTS ix_inserted_name_dob ON inserted (name_dob)")
+
+    def _existing(self, column: str, values: List[str]) -> set:
+        found = set()
+        for i in range(0, len(values), 500):
+            chunk = values[i:i + 500]
+            q = f"SELECT {column} FROM inserted WHERE {column} IN ({','.join('?' * len(chunk))})"
+            found.update(v for (v,) in self._con.execute(q, chunk))
+        return found
+
+    def lookup_many(self, records: List[Dict]) -> List[bool]:
+        """For each record: already inserted (by ID or by name+DOB), or repeated earlier in `records`."""
+        keys = [patient_keys(r) for r in records]
+        with self._lock:
+            ids = self._existing("patient_id", sorted({k[0] for k in keys if k[0]}))
+            name_dobs = self._existing("name_dob", sorted({k[1] for k in keys if k[1]}))
+        out = []
+        for pid, nd in keys:
+            dup = (pid is not None and pid in ids) or (nd is not None and nd in name_dobs)
+            out.append(dup)
+            # Later copies inside the same batch count as duplicates too
+            if pid:
+                ids.add(pid)
+            if nd:
+                name_dobs.add(nd)
+        return out
+
+    def contains(self, record: Dict) -> bool:
+        return self.lookup_many([record])[0]
+
+    def filter_new(self, records: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """Splits a batch into (new, duplicates) and counts the avoided inserts."""
+        flags = self.lookup_many(records)
+        new = [r for r, dup in zip(records, flags) if not dup]
+        dupes = [r for r, dup in zip(records, flags) if dup]
+        self.avoided += len(dupes)
+        return new, dupes
+
+    def add_many(self, records: Iterable[Dict], source: str = "") -> None:
+        now = time.time()
+        rows = [patient_keys(r) + (now, source) for r in records]
+        rows = [r for r in rows if r[0] or r[1]]
+        with self._lock, self._con:
+            self._con.executemany("INSERT INTO inserted (patient_id, name_dob, inserted_at, source) VALUES (?, ?, ?, ?)", rows)
+
+    def add(self, record: Dict, source: str = "") -> None:
+        self.add_many([record], source=source)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._con.execute("SELECT COUNT(*) FROM inserted").fetchone()[0]
+
+    def close(self) -> None:
+        self._con.close()
+
+
+# ------------------------------------ CLI -------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Check or seed the index of already-inserted patients.")
+    ap.add_argument("command", choices=["check", "import"],
+                    help="check: report which records in FILE are already inserted; import: mark them inserted.")
+    ap.add_argument("file", type=str, help="JSON list of records (agent or OCR field names).")
+    ap.add_argument("--db", type=str, default=DEFAULT_DB, help="Index database path.")
+    ap.add_argument("--out", type=str, help="For check: write only the new records here.")
+    args = ap.parse_args()
+
+    with open(args.file, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    index = PatientIndex(args.db)
+    if args.command == "import":
+        index.add_many(records, source=os.path.basename(args.file))
+        print(f"[ok] Indexed {len(records)} records → {args.db} ({index.count()} total)")
+        return
+    new, dupes = index.filter_new(records)
+    print(f"[ok] {len(records)} records: {len(new)} new, {len(dupes)} already inserted (inserts avoided)")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(new, f, indent=2, ensure_ascii=False)
+        print(f"[ok] New records → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
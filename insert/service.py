@@ -0,0 +1,261 @@
+# service.py - resident local insert service
+#
+# insert/main.py normally starts a fresh Python process per agent run, which
+# re-imports pyautogui/pygetwindow/Tk and re-reads calibration every time.
+# This service loads one agent once (imports, calibration and the VM window
+# handle stay cached) and accepts insert jobs over HTTP on localhost:
+#
+#   POST /jobs      {"record": {...}} or {"records": [{...}, ...]}, optional "wait": true,
+#                   optional "force": true (insert even if already in the patient index)
+#                   -> {"job_id": ..., "status": ..., ...}
+#   GET  /jobs/<id> -> job status with per-record timings
+#   GET  /health    -> agent name, queue depth, jobs seen, inserts avoided
+#
+# Jobs are executed one at a time, in arrival order, on a single worker thread.
+import os
+import sys
+import json
+import time
+import queue
+import threading
+import importlib.util
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Seconds a POST with "wait": true blocks before answering 504 (override per request with "timeout")
+WAIT_TIMEOUT = float(os.environ.get("INSERT_WAIT_TIMEOUT", "300"))
+if BASE_DIR not in sys.path:
+    sys.path.append(BASE_DIR)
+
+
+def _load_module(name: str, path: str):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _load_calibration(path: str, fake: bool) -> Dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        if fake:
+            from input_backend import FAKE_CALIBRATION
+            return dict(FAKE_CALIBRATION)
+        raise Exception(f"Calibration file not found: {path}. Please run 'calibrate.py' first.")
+
+
+def load_agent(key: str, fake: bool = False, fake_time_scale: float = 0.0, backend=None,
+               coords: Optional[Dict] = None) -> Callable[[Dict], None]:
+    """Imports an agent once and returns insert(record) with everything cached.
+
+    With fake=True, fake_time_scale > 0 makes the recording backend really
+    wait that fraction of the automation's sleeps (see RecordingBackend).
+    `backend` / `coords` override the input backend and calibration (agents 1-2).
+    """
+    if key in ("1", "2"):
+        agent_dir = os.path.join(BASE_DIR, f"agent{key}")
+        automator = _load_module(f"agent{key}_automator", os.path.join(agent_dir, "automator.py"))
+        if coords is None:
+            coords = _load_calibration(os.path.join(agent_dir, "calibration.json"), fake)
+        if backend is None and fake:
+            from input_backend import RecordingBackend
+            backend = RecordingBackend(time_scale=fake_time_scale)
+        elif backend is None:
+            from input_backend import LiveBackend
+            backend = LiveBackend()
+
+        def insert(record: Dict) -> None:
+            automator.fill_patient_form(record, backend=backend, coords=coords)
+        return insert
+
+    if key == "3":
+        if fake:
+            raise SystemExit("Agent 3 drives AutoHotkey directly; the fake backend only supports agents 1 and 2.")
+        runner = _load_module("agent3_runner", os.path.join(BASE_DIR, "agent3", "agent3_runner.py"))
+        if coords is None:
+            coords = _load_calibration(runner.CALIB_JSON, fake)
+
+        def insert(record: Dict) -> None:
+            runner.run_agent3(record, coords=coords)
+        return insert
+
+    raise SystemExit(f"Unknown agent: {key}")
+
+
+class InsertService:
+    def __init__(self, insert: Callable[[Dict], None], agent_name: str = "", index=None):
+        self._insert = insert
+        self.agent_name = agent_name
+        self._index = index
+        self._jobs: Dict[str, Dict] = {}
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._thread = threading.Thread(target=self._run, name="insert-service", daemon=True)
+        self._thread.start()
+
+    def submit(self, records: List[Dict], force: bool = False) -> Dict:
+        with self._lock:
+            self._seq += 1
+            job_id = f"job-{self._seq}"
+            job = {
+                "job_id": job_id,
+                "status": "queued",
+                "records": len(records),
+                "results": [],
+                "submitted_at": time.time(),
+                "queued_s": None,
+                "run_s": None,
+                "skipped": 0,
+                "index_errors": 0,
+                "done": threading.Event(),
+            }
+            self._jobs[job_id] = job
+        self._queue.put((job, [dict(r) for r in records], force))
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {k: (list(v) if k == "results" else v) for k, v in job.items() if k != "done"}
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict]:
+        """Job snapshot once it finished, or as it stands when `timeout` expires."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job["done"].wait(timeout)
+        return self.get(job_id)
+
+    def is_done(self, job_id: str) -> bool:
+        job = self._jobs.get(job_id)
+        return job is not None and job["done"].is_set()
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def health(self) -> Dict:
+        return {"agent": self.agent_name, "queue_depth": self.depth(), "jobs": len(self._jobs),
+                "avoided": self._index.avoided if self._index is not None else 0}
+
+    def _run(self):
+        while True:
+            job, records, force = self._queue.get()
+            started = time.time()
+            with self._lock:
+                job["status"] = "running"
+                job["queued_s"] = round(started - job["submitted_at"], 3)
+            # One bulk lookup for the whole job against already-inserted patients
+            dup_flags = [False] * len(records)
+            if self._index is not None and not force:
+                try:
+                    dup_flags = self._index.lookup_many(records)
+                    self._index.avoided += sum(dup_flags)
+                except Exception as e:
+                    # An unreadable index must not stop the worker; insert as if nothing matched
+                    with self._lock:
+                        job["index_errors"] += 1
+                    print(f"[warn] {job['job_id']} index lookup failed, treating records as new: {e}")
+            failed = 0
+            for i, record in enumerate(records):
+                if dup_flags[i]:
+                    with self._lock:
+                        job["skipped"] += 1
+                        job["results"].append({"index": i, "ok": True, "skipped": True, "seconds": 0.0})
+                    continue
+                t0 = time.perf_counter()
+                try:
+                    self._insert(record)
+                    result = {"index": i, "ok": True}
+                except Exception as e:
+                    failed += 1
+                    result = {"index": i, "ok": False, "error": str(e)}
+                result["seconds"] = round(time.perf_counter() - t0, 3)
+                # Outside the insert's try: the record is in the form either way, and
+                # reporting it as failed would get it retried and inserted twice
+                if result["ok"] and self._index is not None:
+                    try:
+                        self._index.add(record, source=self.agent_name)
+                    except Exception as e:
+                        result["index_error"] = str(e)
+                        print(f"[warn] {job['job_id']} record {i} inserted but not indexed: {e}")
+                with self._lock:
+                    job["results"].append(result)
+                    if "index_error" in result:
+                        job["index_errors"] += 1
+            with self._lock:
+                job["run_s"] = round(time.time() - started, 3)
+                job["status"] = "failed" if failed == len(records) and records else ("partial" if failed else "done")
+            job["done"].set()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service: InsertService = None
+
+    def _reply(self, code: int, payload: Dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            return self._reply(200, self.service.health())
+        if self.path.startswith("/jobs/"):
+            job = self.service.get(self.path[len("/jobs/"):])
+            if job is None:
+                return self._reply(404, {"error": "unknown job"})
+            return self._reply(200, job)
+        self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            return self._reply(404, {"error": "not found"})
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            records = payload["records"] if "records" in payload else [payload["record"]]
+            if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+                raise ValueError("records must be a list of objects")
+            timeout = float(payload.get("timeout", WAIT_TIMEOUT))
+        except (ValueError, KeyError, TypeError) as e:
+            return self._reply(400, {"error": f"bad request: {e}"})
+        job = self.service.submit(records, force=bool(payload.get("force")))
+        if payload.get("wait"):
+            done = self.service.wait(job["job_id"], timeout=timeout)
+            if not self.service.is_done(job["job_id"]):
+                # Still queued or running: the client can poll GET /jobs/<id>
+                return self._reply(504, {"error": "timed out waiting for the job", **done})
+            return self._reply(200, done)
+        self._reply(202, job)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def make_server(service: InsertService, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    handler = type("Handler", (_Handler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def serve(agent_key: str, agent_name: str = "", host: str = "127.0.0.1", port: int = 8765, fake: bool = False,
+          index_db: Optional[str] = None):
+    from patient_index import PatientIndex, DEFAULT_DB
+    t0 = time.perf_counter()
+    service = InsertService(load_agent(agent_key, fake=fake), agent_name=agent_name or f"agent{agent_key}",
+                            index=PatientIndex(index_db or DEFAULT_DB))
+    server = make_server(service, host, port)
+    print(f"[ok] {service.agent_name} warm in {time.perf_counter() - t0:.2f}s"
+          f"{' (fake input backend)' if fake else ''}; listening on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
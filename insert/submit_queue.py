@@ -0,0 +1,127 @@
+# submit_queue.py - background submission worker for the Tk entry GUIs
+#
+# fill_patient_form() takes several seconds per record.  Running it on the Tk
+# main thread freezes the window, so the GUIs push records onto this worker
+# instead and poll its event queue from root.after().  Records are typed into
+# the VM strictly one at a time, in submission order.
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+class SubmissionWorker:
+    """Single background thread that runs `fill(record)` for queued records.
+
+    Tk is not thread-safe, so the worker never touches widgets: it reports
+    progress as tuples on `events`, which the GUI drains with poll():
+        ("running",  job_no, record)
+        ("skipped",  job_no, record)            already in the inserted-patient index
+        ("done",     job_no, record, seconds)
+        ("failed",   job_no, record, error_text)
+        ("verified", report, records_to_reinsert, job_nos)   job_nos[i] typed records_to_reinsert[i]
+        ("verify_failed", error_text)
+    """
+
+    def __init__(self, fill: Callable[[Dict], None], verifier=None, index=None):
+        self._fill = fill
+        self._verifier = verifier
+        self._index = index
+        self._jobs: "queue.Queue" = queue.Queue()
+        self._events: "queue.Queue" = queue.Queue()
+        self._count = 0
+        self._pending = 0
+        self.index_errors = 0
+        self._unverified: List[tuple] = []   # (job_no, record) since the last verified batch
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="submission-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: Dict, force: bool = False) -> int:
+        """Queues a record; force=True types it even if the index says it was inserted."""
+        with self._lock:
+            self._count += 1
+            self._pending += 1
+            job_no = self._count
+        self._jobs.put((job_no, dict(record), force))
+        return job_no
+
+    @property
+    def avoided(self) -> int:
+        return self._index.avoided if self._index is not None else 0
+
+    def depth(self) -> int:
+        """Records queued or currently being typed."""
+        with self._lock:
+            return self._pending
+
+    def poll(self) -> List[tuple]:
+        out = []
+        while True:
+            try:
+                out.append(self._events.get_nowait())
+            except queue.Empty:
+                return out
+
+    def stop(self, timeout: Optional[float] = None):
+        self._jobs.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            job_no, record, force = job
+            if self._index is not None and not force and self._is_duplicate(job_no, record):
+                with self._lock:
+                    self._pending -= 1
+                self._events.put(("skipped", job_no, record))
+                continue
+            self._events.put(("running", job_no, record))
+            t0 = time.monotonic()
+            try:
+                self._fill(record)
+            except Exception as e:
+                self._events.put(("failed", job_no, record, str(e)))
+                ok = False
+            else:
+                self._events.put(("done", job_no, record, time.monotonic() - t0))
+                ok = True
+                if self._index is not None:
+                    try:
+                        self._index.add(record, source="gui")
+                    except Exception as e:
+                        self._index_error(job_no, f"inserted but not indexed: {e}")
+            finally:
+                with self._lock:
+                    self._pending -= 1
+            if ok and self._verifier is not None:
+                self._verify(job_no, record)
+
+    def _is_duplicate(self, job_no: int, record: Dict) -> bool:
+        try:
+            return bool(self._index.filter_new([record])[1])
+        except Exception as e:
+            # An unreadable index must not stop the worker; type the record as new
+            self._index_error(job_no, f"index lookup failed, treating it as new: {e}")
+            return False
+
+    def _index_error(self, job_no: int, text: str):
+        with self._lock:
+            self.index_errors += 1
+        print(f"[warn] job #{job_no}: {text}")
+
+    def _verify(self, job_no: int, record: Dict):
+        self._unverified.append((job_no, record))
+        try:
+            report = self._verifier.add(record)
+        except Exception as e:
+            self._events.put(("verify_failed", str(e)))
+            return
+        if report is not None:
+            retry, self._verifier.to_reinsert = self._verifier.to_reinsert, []
+            # The verifier keeps copies, so flagged records are matched back by value
+            jobs = [next((n for n, r in reversed(self._unverified) if r == rec), None) for rec in retry]
+            self._unverified = []
+            self._events.put(("verified", report, retry, jobs))
@@ -0,0 +1,152 @@
+# lazy_deps.py - deferred heavy imports and cached Tesseract discovery
+#
+# Importing cv2/numpy/pytesseract costs a noticeable part of a second, and the
+# Tesseract probe (env lookup, PATH search, Windows install locations, version
+# subprocess) used to run on every import of ocr_table_model.py.  Modules here
+# are stand-ins that import the real module on first attribute access, and the
+# resolved Tesseract binary + version are cached in a small JSON state file.
+import os
+import json
+import shutil
+import importlib
+import subprocess
+from typing import Callable, Dict, Optional
+
+TESSERACT_CACHE = os.environ.get(
+    "TESSERACT_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "legacy_gui_connector", "tesseract.json"),
+)
+
+TESSERACT_WINDOWS_CANDIDATES = [
+    r"C:\Program Files\Tesseract-OCR\tesseract.exe",
+    r"C:\Program Files (x86)\Tesseract-OCR\tesseract.exe",
+]
+
+
+class LazyModule:
+    """Imports `name` on first attribute access, then runs `on_load(module)` once."""
+
+    def __init__(self, name: str, on_load: Optional[Callable] = None):
+        self.__dict__["_name"] = name
+        self.__dict__["_on_load"] = on_load
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = importlib.import_module(self.__dict__["_name"])
+            self.__dict__["_module"] = module
+            on_load = self.__dict__["_on_load"]
+            if on_load:
+                on_load(module)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return f"<LazyModule {self.__dict__['_name']} ({state})>"
+
+
+# ------------------------- Tesseract Path Auto-Detect -------------------------
+def _read_cache() -> Dict:
+    try:
+        with open(TESSERACT_CACHE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _write_cache(state: Dict) -> None:
+    try:
+        os.makedirs(os.path.dirname(TESSERACT_CACHE), exist_ok=True)
+        tmp = TESSERACT_CACHE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp, TESSERACT_CACHE)
+    except Exception:
+        pass
+
+
+def _probe_tesseract() -> Optional[str]:
+    # 1) Use env var if provided (resolve_tesseract() rejects a missing one)
+    env_path = os.environ.get("TESSERACT_PATH")
+    if env_path:
+        return env_path
+    # 2) If tesseract is on PATH, use it
+    found = shutil.which("tesseract")
+    if found:
+        return found
+    # 3) Common Windows locations
+    for c in TESSERACT_WINDOWS_CANDIDATES:
+        if os.path.isfile(c):
+            return c
+    return None
+
+
+def _probe_version(cmd: str) -> str:
+    try:
+        out = subprocess.run([cmd, "--version"], capture_output=True, text=True, timeout=10)
+        first = (out.stdout or out.stderr).strip().splitlines()
+        return first[0].split()[-1] if first else ""
+    except Exception:
+        return ""
+
+
+_RESOLVED: Dict[Optional[str], Dict] = {}  # per TESSERACT_PATH value, for this process
+
+
+def resolve_tesseract() -> Dict:
+    """Returns {"cmd": path-or-None, "version": str}, using the state file when valid.
+
+    The cache entry is trusted while the binary still exists with the same
+    mtime; TESSERACT_PATH always wins over the cache.  The result, including
+    "not found", is kept for the rest of the process.
+    """
+    env_path = os.environ.get("TESSERACT_PATH")
+    if env_path not in _RESOLVED:
+        _RESOLVED[env_path] = _resolve_tesseract(env_path)
+    return _RESOLVED[env_path]
+
+
+def _resolve_tesseract(env_path: Optional[str]) -> Dict:
+    if env_path and not os.path.isfile(env_path):
+        # Don't quietly fall back to another binary; pytesseract reports this path when OCR runs
+        print(f"[warn] TESSERACT_PATH points at a missing file: {env_path}")
+        return {"cmd": None, "version": "", "missing": env_path}
+    state = _read_cache()
+    cmd = state.get("cmd")
+    if cmd and (not env_path or env_path == cmd):
+        try:
+            if os.path.getmtime(cmd) == state.get("mtime"):
+                return state
+        except OSError:
+            pass
+
+    cmd = _probe_tesseract()
+    if not cmd:
+        # Otherwise, let pytesseract raise a helpful error later
+        return {"cmd": None, "version": ""}
+    state = {"cmd": cmd, "mtime": os.path.getmtime(cmd), "version": _probe_version(cmd)}
+    _write_cache(state)
+    return state
+
+
+def _configure_pytesseract(module) -> None:
+    state = resolve_tesseract()
+    cmd = state.get("cmd") or state.get("missing")
+    if cmd:
+        module.pytesseract.tesseract_cmd = cmd
+
+
+def tesseract_version() -> str:
+    return resolve_tesseract().get("version", "")
+
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+pytesseract = LazyModule("pytesseract", on_load=_configure_pytesseract)
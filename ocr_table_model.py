@@ -1,45 +1,23 @@
+from __future__ import annotations
 
 import os
 import json
 import glob
 import re
 import math
+import random
+import time
 import argparse
-import shutil
+import atexit
+import threading
 from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Tuple, Optional
 
-import cv2
-import numpy as np
-import pytesseract
-
-
-# ------------------------- Tesseract Path Auto-Detect -------------------------
-def _ensure_tesseract_path():
-    # 1) Use env var if provided
-    env_path = os.environ.get("TESSERACT_PATH")
-    if env_path and os.path.isfile(env_path):
-        pytesseract.pytesseract.tesseract_cmd = env_path
-        return
-
-    # 2) If tesseract is on PATH, use it
-    found = shutil.which("tesseract")
-    if found:
-        pytesseract.pytesseract.tesseract_cmd = found
-        return
-
-    # 3) Common Windows locations
-    candidates = [
-        r"C:\Program Files\Tesseract-OCR\tesseract.exe",
-        r"C:\Program Files (x86)\Tesseract-OCR\tesseract.exe",
-    ]
-    for c in candidates:
-        if os.path.isfile(c):
-            pytesseract.pytesseract.tesseract_cmd = c
-            return
-
-    # Otherwise, let pytesseract raise a helpful error later
-_ensure_tesseract_path()
+# cv2 / numpy / pytesseract are imported on first use (see lazy_deps.py), and
+# the Tesseract binary is resolved once and cached instead of on every import.
+from lazy_deps import cv2, np, pytesseract
+from debug_writer import DebugWriter
 
 
 # ------------------------------ Config / Aliases ------------------------------
@@ -54,6 +32,10 @@ EXPECTED_HEADERS = [
 
 DATE_RE = re.compile(r"\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b")
 
+# Templates are learned on pages upscaled by this factor, so their x_cuts and
+# header_bottom_y live in that coordinate space.
+TEMPLATE_SCALE = 1.8
+
 
 # --------------------------------- Utilities ----------------------------------
 def imread_gray(path: str) -> np.ndarray:
@@ -82,8 +64,9 @@ def deskew(img: np.ndarray) -> np.ndarray:
     return cv2.warpAffine(img, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
 
 
-def preprocess(img: np.ndarray, scale: float = 1.8) -> np.ndarray:
-    img = deskew(img)
+def preprocess(img: np.ndarray, scale: float = 1.8, do_deskew: bool = True) -> np.ndarray:
+    if do_deskew:
+        img = deskew(img)
     if scale != 1.0:
         img = cv2.resize(img, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
     # Denoise + sharpen
@@ -123,15 +106,102 @@ def norm(s: str) -> str:
     return re.sub(r"\s+", " ", s.strip().lower())
 
 
-def header_match(tok: str) -> Optional[str]:
-    t = norm(tok)
-    for h in EXPECTED_HEADERS:
-        if t == norm(h["name"]):
-            return h["name"]
-        for a in h["aliases"]:
-            if t == norm(a):
-                return h["name"]
-    return None
+def levenshtein(a: str, b: str, limit: Optional[int] = None) -> int:
+    """Edit distance; stops early (returns limit + 1) once it must exceed `limit`."""
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if limit is not None and min(cur) > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+
+class HeaderIndex:
+    """Header names + aliases compiled once: exact dict lookup, then a BK-tree.
+
+    The BK-tree answers "closest alias within distance d" without comparing
+    the token against every alias.  A match is only accepted if the distance
+    is also at most len(alias) // 4, so short aliases ("id", "age", "sex")
+    still need an exact hit while "Addres" or "Pat1ent ID" are recovered.
+    """
+
+    def __init__(self, headers: List[Dict], max_dist: int = 2):
+        self.max_dist = max_dist
+        self.exact: Dict[str, str] = {}
+        self._order: Dict[str, int] = {}
+        self._root = None  # [key, {distance: child_node}]
+        for h in headers:
+            self.add(h["name"], [h["name"]] + list(h["aliases"]))
+
+    def add(self, name: str, aliases: List[str]) -> None:
+        for a in aliases:
+            for key in {norm(a), norm(a.replace("_", " "))}:
+                if not key or key in self.exact:
+                    continue
+                self.exact[key] = name
+                self._order[key] = len(self._order)
+                self._insert(key)
+
+    def _insert(self, key: str) -> None:
+        if self._root is None:
+            self._root = [key, {}]
+            return
+        node = self._root
+        while True:
+            d = levenshtein(key, node[0])
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = [key, {}]
+                return
+            node = child
+
+    def match(self, tok: str, max_dist: Optional[int] = None) -> Optional[str]:
+        t = norm(tok)
+        hit = self.exact.get(t) or self.exact.get(t.replace("_", " "))
+        if hit or self._root is None:
+            return hit
+        max_dist = self.max_dist if max_dist is None else max_dist
+        best = None  # (distance, insertion order, key)
+        stack = [self._root]
+        while stack:
+            key, children = stack.pop()
+            d = levenshtein(t, key)
+            if d <= min(max_dist, len(key) // 4):
+                cand = (d, self._order[key], key)
+                if best is None or cand < best:
+                    best = cand
+            # Triangle inequality: only subtrees with |child_d - d| <= max_dist can match
+            for cd, child in children.items():
+                if d - max_dist <= cd <= d + max_dist:
+                    stack.append(child)
+        return self.exact[best[2]] if best else None
+
+
+def load_aliases(path: str, index: Optional[HeaderIndex] = None) -> HeaderIndex:
+    """Extends the header index from a JSON file: {"Patient_Name": ["pt name", ...], ...}."""
+    index = index or HEADER_INDEX
+    with open(path, "r", encoding="utf-8") as f:
+        extra = json.load(f)
+    known = {h["name"] for h in EXPECTED_HEADERS}
+    for name, aliases in extra.items():
+        if name not in known:
+            raise RuntimeError(f"Unknown header '{name}' in alias file {path}. Expected one of: {sorted(known)}")
+        index.add(name, [str(a) for a in aliases])
+    return index
+
+
+HEADER_INDEX = HeaderIndex(EXPECTED_HEADERS)
+
+
+def header_match(tok: str, max_dist: Optional[int] = None) -> Optional[str]:
+    return HEADER_INDEX.match(tok, max_dist=max_dist)
 
 
 @dataclass
@@ -139,13 +209,19 @@ class Template:
     columns: List[Tuple[str, float]]   # [(col_name, x_center), ...] sorted by x
     x_cuts: List[float]                # [x1, x2, ...] between columns
     header_bottom_y: float             # Y below headers
+    fingerprint: Optional[List[float]] = None  # header-band ink profile (see _fingerprint_image, band_profile)
+    header_band: float = 0.0                   # header band height as a fraction of page height
 
     def to_dict(self) -> Dict:
-        return {
+        d = {
             "columns": self.columns,
             "x_cuts": self.x_cuts,
             "header_bottom_y": self.header_bottom_y,
         }
+        if self.fingerprint is not None:
+            d["fingerprint"] = self.fingerprint
+            d["header_band"] = self.header_band
+        return d
 
     @staticmethod
     def from_dict(d: Dict) -> "Template":
@@ -153,6 +229,8 @@ class Template:
             columns=[(str(name), float(x)) for name, x in d["columns"]],
             x_cuts=[float(x) for x in d["x_cuts"]],
             header_bottom_y=float(d["header_bottom_y"]),
+            fingerprint=[float(v) for v in d["fingerprint"]] if d.get("fingerprint") else None,
+            header_band=float(d.get("header_band", 0.0)),
         )
 
 
@@ -180,25 +258,112 @@ def _merge_header_tokens(header_items_sorted: List[Dict]) -> List[Dict]:
     return merged
 
 
-def learn_template_from_folder(folder: str, psm: int = 6, debug: bool = False, outdir: Optional[str] = None) -> Template:
+# ------------------------------- Debug Overlays -------------------------------
+# Called on the DebugWriter thread; inputs must not be mutated after submit().
+def _render_header_overlay(bin_img: np.ndarray, merged: List[Dict]) -> np.ndarray:
+    # Merged header boxes for QA
+    dbg = cv2.cvtColor(bin_img, cv2.COLOR_GRAY2BGR)
+    for m in merged:
+        cv2.rectangle(dbg, (int(m["left"]), int(m["top"])), (int(m["right"]), int(m["bottom"])), (0, 0, 255), 2)
+        cv2.putText(dbg, m["text"], (int(m["left"]), max(15, int(m["top"]) - 5)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (100, 255, 100), 1, cv2.LINE_AA)
+    return dbg
+
+
+def _render_xcuts(cols: List[Tuple[str, float]], x_cuts: List[float]) -> np.ndarray:
+    # A simple visual of x cuts
+    vis = np.full((400, int(cols[-1][1] + 100)), 255, dtype=np.uint8)
+    for name, x in cols:
+        cv2.line(vis, (int(x), 0), (int(x), 399), 200, 1)
+        cv2.putText(vis, name, (int(x) - 40, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, 0, 1, cv2.LINE_AA)
+    for xc in x_cuts:
+        cv2.line(vis, (int(xc), 0), (int(xc), 399), 0, 1)
+    return vis
+
+
+def _render_rows_overlay(bin_img: np.ndarray, rows: List[List[Dict]], f: float, dy: float = 0.0) -> np.ndarray:
+    # Row bands for QA; `f` maps template coordinates (less the crop offset dy) onto bin_img
+    dbg = cv2.cvtColor(bin_img, cv2.COLOR_GRAY2BGR)
+    for r in rows:
+        ys = [w["top"] for w in r] + [w["bottom"] for w in r]
+        y1, y2 = (min(ys) - dy) * f, (max(ys) - dy) * f
+        cv2.rectangle(dbg, (0, int(y1)), (dbg.shape[1]-1, int(y2)), (0, 255, 0), 1)
+    return dbg
+
+
+def _columns_converged(header_hits: Dict[str, List[float]], history: Dict[str, List[float]],
+                       tol: float, required: List[str], patience: int = 3) -> bool:
+    """Records each column's running median; True once every `required` column is found and stable.
+
+    Stable: the median moved less than `tol` over the last `patience` images
+    and its standard error (from the MAD spread) is below `tol` as well.  A
+    required column that no image has matched yet keeps learning going.
+    """
+    done = all(header_hits.get(name) for name in required)
+    for name, xs in header_hits.items():
+        if not xs:
+            continue
+        arr = np.asarray(xs, dtype=np.float64)
+        med = float(np.median(arr))
+        hist = history.setdefault(name, [])
+        hist.append(med)
+        sigma = 1.4826 * float(np.median(np.abs(arr - med)))
+        stderr = 1.2533 * sigma / math.sqrt(len(arr))
+        recent = hist[-patience:]
+        if name in required and (len(recent) < patience or max(recent) - min(recent) > tol or stderr > tol):
+            done = False
+    return done
+
+
+def learn_template_from_folder(folder: str, psm: int = 6, debug: bool = False, outdir: Optional[str] = None,
+                               writer: Optional[DebugWriter] = None, converge_tol: Optional[float] = None,
+                               min_samples: int = 5, max_samples: Optional[int] = None,
+                               seed: Optional[int] = None, columns: Optional[List[str]] = None) -> Template:
+    """Learns column positions from the header words of every image in `folder`.
+
+    With `converge_tol` (template pixels) the images are visited in random
+    order and learning stops once every expected column (or each of
+    `columns`) has been found and its median x-centre has converged (see
+    _columns_converged), after at least `min_samples` and at most
+    `max_samples` images.
+    """
+    known = [h["name"] for h in EXPECTED_HEADERS]
+    required = list(columns) if columns else known
+    unknown = [c for c in required if c not in known]
+    if unknown:
+        raise ValueError(f"Unknown column(s) {unknown}; expected some of {known}")
     paths = sorted(
         [p for p in glob.glob(os.path.join(folder, "*.*")) if p.lower().endswith((".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp"))]
     )
     if not paths:
         raise RuntimeError(f"No images found in: {folder}")
+    total = len(paths)
+    if converge_tol is not None:
+        random.Random(seed).shuffle(paths)
+    if max_samples:
+        paths = paths[:max_samples]
+    history: Dict[str, List[float]] = {}
+    used = 0
 
     header_hits: Dict[str, List[float]] = {h["name"]: [] for h in EXPECTED_HEADERS}
     header_bottoms: List[float] = []
+    header_bands: List[float] = []
+    smalls: List[np.ndarray] = []
 
-    if outdir:
-        os.makedirs(outdir, exist_ok=True)
+    own_writer = None
+    if debug and outdir and writer is None:
+        writer = own_writer = DebugWriter(outdir)
+    elif not (debug and outdir):
+        writer = None
 
     for p in paths:
+        used += 1
         img = imread_gray(p)
-        bin_img = preprocess(img, scale=1.8)
+        bin_img = preprocess(img, scale=TEMPLATE_SCALE)
         items = tsv(bin_img, psm=psm)
         if not items:
             continue
+        smalls.append(_fingerprint_image(img))
 
         H, W = bin_img.shape[:2]
         header_limit = H * 0.45
@@ -213,15 +378,22 @@ def learn_template_from_folder(folder: str, psm: int = 6, debug: bool = False, o
             if col_name:
                 header_hits[col_name].append(m["cx"])
                 header_bottoms.append(m["bottom"])
-
-        if debug and outdir:
-            # Draw merged header boxes for QA
-            dbg = cv2.cvtColor(bin_img, cv2.COLOR_GRAY2BGR)
-            for m in merged:
-                cv2.rectangle(dbg, (int(m["left"]), int(m["top"])), (int(m["right"]), int(m["bottom"])), (0, 0, 255), 2)
-                cv2.putText(dbg, m["text"], (int(m["left"]), max(15, int(m["top"]) - 5)),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (100, 255, 100), 1, cv2.LINE_AA)
-            cv2.imwrite(os.path.join(outdir, f"debug_headers_{os.path.basename(p)}"), dbg)
+                header_bands.append(m["bottom"] / H)
+
+        if writer is not None:
+            writer.submit(f"debug_headers_{os.path.basename(p)}", _render_header_overlay, bin_img, merged)
+
+        if converge_tol is not None:
+            converged = _columns_converged(header_hits, history, converge_tol, required)
+            if converged and used >= min_samples:
+                print(f"[info] Columns converged (±{converge_tol:g}px) after {used} of {total} images")
+                break
+    else:
+        if converge_tol is not None:
+            missing = [c for c in required if not header_hits[c]]
+            scope = f"all {used} images" if used == total else f"the {used} sampled images (of {total}, --max-samples)"
+            print(f"[warn] Columns did not converge; using {scope}"
+                  + (f". Never matched: {', '.join(missing)}" if missing else ""))
 
     # Build columns list from medians
     cols: List[Tuple[str, float]] = []
@@ -234,23 +406,204 @@ def learn_template_from_folder(folder: str, psm: int = 6, debug: bool = False, o
             cols.append((name, median_x))
 
     if len(cols) < 3:
+        if own_writer is not None:
+            own_writer.close()
         raise RuntimeError("Not enough headers recognized to learn a template. Improve OCR or header aliases.")
 
     cols.sort(key=lambda x: x[1])
     x_cuts = [ (cols[i][1] + cols[i+1][1]) / 2.0 for i in range(len(cols) - 1) ]
     header_bottom_y = sorted(header_bottoms)[len(header_bottoms) // 2] if header_bottoms else 0.0
 
-    if debug and outdir:
-        # Create a simple visual of x cuts
-        vis = np.full((400, int(cols[-1][1] + 100)), 255, dtype=np.uint8)
-        for name, x in cols:
-            cv2.line(vis, (int(x), 0), (int(x), 399), 200, 1)
-            cv2.putText(vis, name, (int(x) - 40, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, 0, 1, cv2.LINE_AA)
-        for xc in x_cuts:
-            cv2.line(vis, (int(xc), 0), (int(xc), 399), 0, 1)
-        cv2.imwrite(os.path.join(outdir, "debug_template_xcuts.png"), vis)
+    if writer is not None:
+        writer.submit("debug_template_xcuts.png", _render_xcuts, cols, x_cuts, always=True)
+    if own_writer is not None:
+        own_writer.close()
+    # Layout fingerprint for template libraries: mean band_profile() of the header band
+    # Layout fingerprint for template libraries: mean header-band profile
+    header_band = sorted(header_bands)[len(header_bands) // 2] if header_bands else 0.45
+    profiles = [band_profile(sm, header_band) for sm in smalls]
+    fingerprint = _unit(np.mean(profiles, axis=0)).round(5).tolist() if profiles else None
+
+    return Template(columns=cols, x_cuts=x_cuts, header_bottom_y=header_bottom_y,
+                    fingerprint=fingerprint, header_band=header_band)
+
+
+# ---- Rule / whitespace learner ----
+# learn_template_from_folder() OCRs every training page in full.  The learner
+# below finds the columns geometrically instead: vertical ruled lines if the
+# table has them, otherwise the whitespace gutters of the vertical projection.
+# Only the small header cells go through Tesseract, to name the columns.
+def _ink_mask(page: np.ndarray) -> np.ndarray:
+    return cv2.threshold(page, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+
+
+def _runs(mask: np.ndarray) -> List[Tuple[int, int]]:
+    """[start, end) of each run of True in a 1-D mask."""
+    m = np.concatenate(([0], mask.astype(np.int8), [0]))
+    d = np.diff(m)
+    return list(zip(np.flatnonzero(d == 1).tolist(), np.flatnonzero(d == -1).tolist()))
+
+
+def _table_rules(ink: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Vertical and horizontal ruled lines (ink = 1) by morphological opening."""
+    H, W = ink.shape[:2]
+    v = cv2.morphologyEx(ink, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(15, H // 12))))
+    h = cv2.morphologyEx(ink, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (max(15, W // 8), 1)))
+    return v, h
+
+
+def _line_blocks(line: np.ndarray, min_gap: int) -> List[Tuple[int, int]]:
+    """Ink blocks of one text line, merging gaps narrower than `min_gap` (word spaces)."""
+    merged: List[List[int]] = []
+    for a, b in _runs(line.sum(axis=0) > 0):
+        if merged and a - merged[-1][1] < min_gap:
+            merged[-1][1] = b
+        else:
+            merged.append([a, b])
+    return [(a, b) for a, b in merged]
+
+
+def _page_columns(page: np.ndarray) -> Optional[Dict]:
+    """Column spans and header line of one (deskewed) page, in page pixels."""
+    ink = _ink_mask(page)
+    vrules, hrules = _table_rules(ink)
+    text = ink & ~(vrules | hrules)
+    text = cv2.morphologyEx(text, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))  # specks
+
+    lines = [(y1, y2) for y1, y2 in _runs(text.sum(axis=1) > 0) if y2 - y1 >= 4]
+    if len(lines) < 2:
+        return None
+    line_h = float(np.median([y2 - y1 for y1, y2 in lines]))
+    # Word gaps inside a cell are well under a line height; column gutters are wider
+    min_gap = max(6, int(round(1.2 * line_h)))
+
+    # Header: the first text line split into at least 3 blocks
+    header = next(((y1, y2) for y1, y2 in lines if len(_line_blocks(text[y1:y2], min_gap)) >= 3), None)
+    if header is None:
+        return None
+    hy1, hy2 = header
+    body = [ln for ln in lines if ln[0] >= hy2]
+    y_end = body[-1][1] if body else hy2
+
+    x_rules = [(a + b) / 2.0 for a, b in _runs(vrules[hy1:y_end].sum(axis=0) > 0.6 * (y_end - hy1))]
+    x_text = np.flatnonzero(text[hy1:y_end].sum(axis=0) > 0)
+    left, right = float(x_text[0]), float(x_text[-1] + 1)
+    if len(x_rules) >= 2:
+        source = "rules"
+        inner = [x for x in x_rules if left < x < right]
+        bounds = [left] + inner + [right]
+    else:
+        source = "gutters"
+        gaps = [(a, b) for a, b in _runs(text[hy1:y_end].sum(axis=0) == 0) if b - a >= min_gap and a > left and b < right]
+        bounds = [left] + [(a + b) / 2.0 for a, b in gaps] + [right]
+
+    spans = [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+    return {"spans": spans, "header": (hy1, hy2), "source": source, "shape": page.shape[:2]}
+
+
+def _name_header_cell(page: np.ndarray, box: Tuple[int, int, int, int], psm: int) -> Optional[str]:
+    x1, y1, x2, y2 = box
+    crop = page[y1:y2, x1:x2]
+    if crop.size == 0:
+        return None
+    bin_crop = preprocess(crop, scale=TEMPLATE_SCALE, do_deskew=False)
+    words = tsv(bin_crop, psm=psm)
+    text = " ".join(w["text"] for w in sorted(words, key=lambda w: w["left"]))
+    return header_match(text.replace("_", " ")) if text else None
+
+
+def learn_template_from_rules(folder: str, psm: int = 7, name_samples: int = 3,
+                              writer: Optional[DebugWriter] = None) -> Template:
+    """Learns a template from table geometry; OCRs only the header cells of `name_samples` pages.
+
+    Column boundaries are the median across pages (of those agreeing on the
+    most common column count) of the ruled-line or gutter positions.  Columns
+    whose header cell cannot be named are folded into their left neighbour.
+    """
+    paths = sorted(
+        [p for p in glob.glob(os.path.join(folder, "*.*")) if p.lower().endswith((".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp"))]
+    )
+    if not paths:
+        raise RuntimeError(f"No images found in: {folder}")
+
+    found: List[Tuple[np.ndarray, Dict]] = []
+    smalls: List[np.ndarray] = []
+    for p in paths:
+        img = imread_gray(p)
+        page = deskew(img)
+        layout = _page_columns(page)
+        if layout is None:
+            print(f"[warn] {os.path.basename(p)}: no table header line found")
+            continue
+        smalls.append(_fingerprint_image(img))
+        found.append((page, layout))
+    if not found:
+        raise RuntimeError("No table layout found in any training image.")
+
+    counts = [len(l["spans"]) for _, l in found]
+    n_cols = max(set(counts), key=counts.count)
+    agree = [(page, l) for page, l in found if len(l["spans"]) == n_cols]
+    if len(agree) < len(found):
+        print(f"[warn] {len(found) - len(agree)} page(s) disagree on the column count ({n_cols}); ignored")
+
+    s = TEMPLATE_SCALE
+    bounds = np.median([[a for a, _ in l["spans"]] + [l["spans"][-1][1]] for _, l in agree], axis=0) * s
+    header_bottom_y = float(np.median([l["header"][1] for _, l in agree])) * s
+    header_band = float(np.median([l["header"][1] / l["shape"][0] for _, l in agree]))
+
+    # Name each span by majority vote over a few pages' header cells
+    votes: List[Dict[str, int]] = [{} for _ in range(n_cols)]
+    for page, l in agree[:max(1, name_samples)]:
+        hy1, hy2 = l["header"]
+        pad = max(2, (hy2 - hy1) // 3)
+        for i, (a, b) in enumerate(l["spans"]):
+            name = _name_header_cell(page, (int(a), max(0, hy1 - pad), int(math.ceil(b)), hy2 + pad), psm)
+            if name:
+                votes[i][name] = votes[i].get(name, 0) + 1
+
+    names = [max(v, key=v.get) if v else None for v in votes]
+    cols: List[Tuple[str, float]] = []
+    x_cuts: List[float] = []
+    used = set()
+    for i, name in enumerate(names):
+        if not name or name in used:
+            continue
+        used.add(name)
+        if cols:
+            x_cuts.append(float(bounds[i]))
+        cols.append((name, float((bounds[i] + bounds[i + 1]) / 2.0)))
+    if len(cols) < 3:
+        raise RuntimeError("Not enough header cells named to learn a template. Improve OCR or header aliases.")
+
+    if writer is not None:
+        writer.submit("debug_template_xcuts.png", _render_xcuts, cols, x_cuts, always=True)
+
+    profiles = [band_profile(sm, header_band) for sm in smalls]
+    fingerprint = _unit(np.mean(profiles, axis=0)).round(5).tolist() if profiles else None
+    sources = sorted({l["source"] for _, l in agree})
+    print(f"[info] Columns from {'/'.join(sources)} on {len(agree)} page(s); "
+          f"header cells OCRed on {min(len(agree), max(1, name_samples))}")
+    return Template(columns=cols, x_cuts=x_cuts, header_bottom_y=header_bottom_y,
+                    fingerprint=fingerprint, header_band=header_band)
 
-    return Template(columns=cols, x_cuts=x_cuts, header_bottom_y=header_bottom_y)
+
+def compare_templates(a: Template, b: Template) -> Dict:
+    """Differences between two templates of the same layout (template pixels)."""
+    ca, cb = dict(a.columns), dict(b.columns)
+    common = [n for n in ca if n in cb]
+
+    def cuts(tpl: Template) -> Dict[Tuple[str, str], float]:
+        return {(tpl.columns[i][0], tpl.columns[i + 1][0]): x for i, x in enumerate(tpl.x_cuts)}
+
+    cuts_a, cuts_b = cuts(a), cuts(b)
+    cut_diffs = [abs(x - cuts_b[k]) for k, x in cuts_a.items() if k in cuts_b]
+    return {
+        "only_first": [n for n in ca if n not in cb],
+        "only_second": [n for n in cb if n not in ca],
+        "center_diff": round(max((abs(ca[n] - cb[n]) for n in common), default=0.0), 1),
+        "cut_diff": round(max(cut_diffs, default=0.0), 1),
+        "header_bottom_diff": round(abs(a.header_bottom_y - b.header_bottom_y), 1),
+    }
 
 
 # ------------------------------- Parse with Template --------------------------
@@ -311,40 +664,342 @@ def postprocess_row(row: Dict[str, str]) -> Dict[str, str]:
     return row
 
 
-def parse_image_with_template(path: str, template: Template, psm: int = 6, debug: bool = False, outdir: Optional[str] = None) -> List[Dict]:
-    img = imread_gray(path)
-    bin_img = preprocess(img, scale=1.8)
-    items = tsv(bin_img, psm=psm)
+def cell_is_valid(col: str, text: str) -> bool:
+    """Cheap shape check of a cleaned cell; failing cells are re-OCRed in adaptive mode."""
+    if not text:
+        return True
+    if col == "Patient_ID":
+        return bool(re.fullmatch(r"\d+", text))
+    if col == "Age":
+        return bool(re.fullmatch(r"\d{1,3}", text))
+    if col == "Date_Of_Birth":
+        return bool(DATE_RE.fullmatch(text))
+    if col == "Sex":
+        return bool(re.fullmatch(r"[A-Za-z]+", text))
+    return True
+
+
+def _scale_items(items: List[Dict], f: float) -> List[Dict]:
+    if f == 1.0:
+        return items
+    keys = ("left", "top", "width", "height", "right", "bottom", "cx", "cy")
+    return [{**it, **{k: it[k] * f for k in keys}} for it in items]
+
+
+def _assign_cells(row: List[Dict], template: Template) -> Dict[str, List[Dict]]:
+    cells: Dict[str, List[Dict]] = {name: [] for name, _ in template.columns}
+    for w in row:
+        cells[assign_column(w["cx"], template)].append(w)
+    return cells
+
+
+def _cells_to_row(cells: Dict[str, List[Dict]]) -> Dict[str, str]:
+    row_out = {name: clean_cell(name, " ".join(w["text"] for w in words).strip()) for name, words in cells.items()}
+    return postprocess_row(row_out)
+
+
+def _cells_confidence(cells: Dict[str, List[Dict]]) -> Dict[str, Optional[float]]:
+    """Lowest word confidence per cell (None for empty cells)."""
+    return {name: (min(float(w["conf"]) for w in words) if words else None) for name, words in cells.items()}
+
+
+def _judged_value(col: str, words: List[Dict], row_out: Dict[str, str]) -> str:
+    """Cell text as cell_is_valid() should see it."""
+    if col == "Patient_ID":
+        # clean_cell drops non-digits, so judge the raw OCR text ("l3" -> "3")
+        return "".join(w["text"] for w in words)
+    return row_out.get(col, "")
+
+
+def _weak_cells(cell_rows: List[Dict[str, List[Dict]]], conf_threshold: float) -> List[Tuple[int, str]]:
+    weak = []
+    for i, cells in enumerate(cell_rows):
+        row_out = _cells_to_row(cells)
+        for col, words in cells.items():
+            if not words:
+                continue
+            value = _judged_value(col, words, row_out)
+            if min(w["conf"] for w in words) < conf_threshold or not cell_is_valid(col, value):
+                weak.append((i, col))
+    return weak
+
+
+def _cell_box(row: List[Dict], col: str, template: Template, shape: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    """Cell rectangle (x1, y1, x2, y2) in unscaled page coordinates."""
+    H, W = shape[:2]
+    names = [c[0] for c in template.columns]
+    i = names.index(col)
+    x1 = template.x_cuts[i - 1] if i > 0 else 0.0
+    x2 = template.x_cuts[i] if i < len(template.x_cuts) else W * TEMPLATE_SCALE
+    y1 = min(w["top"] for w in row)
+    y2 = max(w["bottom"] for w in row)
+    pad = (y2 - y1) * 0.3
+    return (
+        max(0, int(x1 / TEMPLATE_SCALE)), max(0, int((y1 - pad) / TEMPLATE_SCALE)),
+        min(W, int(math.ceil(x2 / TEMPLATE_SCALE))), min(H, int(math.ceil((y2 + pad) / TEMPLATE_SCALE))),
+    )
+
+
+def _reocr_cell(page: np.ndarray, box: Tuple[int, int, int, int], scale: float) -> Optional[Dict]:
+    x1, y1, x2, y2 = box
+    if x2 - x1 < 2 or y2 - y1 < 2:
+        return None
+    words = tsv(preprocess(page[y1:y2, x1:x2], scale=scale, do_deskew=False), psm=7)
+    if not words:
+        return None
+    return {"text": " ".join(w["text"] for w in words), "conf": min(w["conf"] for w in words)}
+
+
+LOCATE_WIDTH = 1024
+
+
+def locate_table(page: np.ndarray, pad_lines: float = 1.5, min_saving: float = 0.1) -> Optional[Tuple[int, int, int, int]]:
+    """Table region (x1, y1, x2, y2) of a deskewed page, found on a downsampled copy.
+
+    The table is the span from the first to the last text line that splits
+    into 3+ column blocks, widened to any ruled lines; letterheads, footers
+    and margins fall outside.  Returns None when cropping would save less
+    than `min_saving` of the page or no table is found.
+    """
+    H, W = page.shape[:2]
+    f = min(1.0, LOCATE_WIDTH / float(W))
+    small = cv2.resize(page, (max(1, int(W * f)), max(1, int(H * f))), interpolation=cv2.INTER_AREA) if f < 1.0 else page
+    ink = _ink_mask(small)
+    vrules, hrules = _table_rules(ink)
+    text = ink & ~(vrules | hrules)
+
+    lines = [(y1, y2) for y1, y2 in _runs(text.sum(axis=1) > 0) if y2 - y1 >= 2]
+    if not lines:
+        return None
+    line_h = float(np.median([y2 - y1 for y1, y2 in lines]))
+    min_gap = max(4, int(round(1.2 * line_h)))
+    table = [(y1, y2) for y1, y2 in lines if len(_line_blocks(text[y1:y2], min_gap)) >= 3]
+    if not table:
+        return None
+    y1, y2 = table[0][0], table[-1][1]
+    xs = np.flatnonzero(text[y1:y2].sum(axis=0) > 0)
+    x1, x2 = int(xs[0]), int(xs[-1]) + 1
+    rules = np.argwhere(vrules | hrules)
+    if rules.size:
+        ry1, rx1 = rules.min(axis=0)
+        ry2, rx2 = rules.max(axis=0) + 1
+        x1, y1, x2, y2 = min(x1, rx1), min(y1, ry1), max(x2, rx2), max(y2, ry2)
+
+    pad = pad_lines * line_h
+    box = (max(0, int((x1 - pad) / f)), max(0, int((y1 - pad) / f)),
+           min(W, int(math.ceil((x2 + pad) / f))), min(H, int(math.ceil((y2 + pad) / f))))
+    if (box[2] - box[0]) * (box[3] - box[1]) > (1.0 - min_saving) * W * H:
+        return None
+    return box
+
+
+def _offset_items(items: List[Dict], dx: float, dy: float) -> List[Dict]:
+    if not dx and not dy:
+        return items
+    return [{**it, "left": it["left"] + dx, "right": it["right"] + dx, "cx": it["cx"] + dx,
+             "top": it["top"] + dy, "bottom": it["bottom"] + dy, "cy": it["cy"] + dy} for it in items]
+
+
+def split_bands(bin_img: np.ndarray, n: int, min_gap: int = 4) -> List[Tuple[int, int]]:
+    """Splits a binarized page (white background) into up to `n` horizontal bands.
+
+    Cuts are only made in the middle of blank row runs at least `min_gap`
+    tall, picked as close as possible to equal band heights, so no text line
+    is ever cut.
+    """
+    H = bin_img.shape[0]
+    if n <= 1:
+        return [(0, H)]
+    blank = _runs((bin_img < 128).sum(axis=1) == 0)
+    candidates = [(a + b) // 2 for a, b in blank if b - a >= min_gap and 0 < a and b < H]
+    if not candidates:
+        return [(0, H)]
+    cuts = sorted({min(candidates, key=lambda c: abs(c - H * k / n)) for k in range(1, n)})
+    edges = [0] + cuts + [H]
+    return [(edges[i], edges[i + 1]) for i in range(len(edges) - 1) if edges[i + 1] > edges[i]]
+
+
+_BAND_POOL: Dict[int, ThreadPoolExecutor] = {}
+_BAND_POOL_LOCK = threading.Lock()
+
+
+def _band_pool(workers: int) -> ThreadPoolExecutor:
+    # Shared across pages; Tesseract runs as a subprocess, so threads overlap fully.
+    # The lock keeps concurrent pages (pipeline OCR workers) from creating duplicates.
+    with _BAND_POOL_LOCK:
+        pool = _BAND_POOL.get(workers)
+        if pool is None:
+            pool = _BAND_POOL[workers] = ThreadPoolExecutor(workers, thread_name_prefix="ocr-band")
+        return pool
+
+
+@atexit.register
+def _shutdown_band_pools() -> None:
+    with _BAND_POOL_LOCK:
+        pools = list(_BAND_POOL.values())
+        _BAND_POOL.clear()
+    for pool in pools:
+        pool.shutdown(wait=True)
+
+
+def ocr_page(bin_img: np.ndarray, psm: int = 6, band_workers: int = 0) -> List[Dict]:
+    """tsv() of a whole page, or of its row bands in parallel (offset back and merged)."""
+    bands = split_bands(bin_img, band_workers) if band_workers > 1 else [(0, bin_img.shape[0])]
+    if len(bands) == 1:
+        return tsv(bin_img, psm=psm)
+    pool = _band_pool(band_workers)
+    futures = [pool.submit(tsv, bin_img[y1:y2], psm) for y1, y2 in bands]
+    items: List[Dict] = []
+    for (y1, _), fut in zip(bands, futures):
+        items.extend(_offset_items(fut.result(), 0, y1))
+    return items
+
+
+def parse_image_with_template(path: str, template: Template, psm: int = 6, debug: bool = False, outdir: Optional[str] = None,
+                              adaptive: bool = False, conf_threshold: float = 60.0, max_weak_frac: float = 0.3,
+                              img: Optional[np.ndarray] = None, writer: Optional[DebugWriter] = None,
+                              confidences: Optional[List[Dict]] = None, crop: bool = False,
+                              band_workers: int = 0) -> List[Dict]:
+    """Parses one page with a learned template.
+
+    adaptive=True OCRs the page at native scale first and re-OCRs only cells
+    whose words fall below `conf_threshold` (or fail cell_is_valid) at
+    TEMPLATE_SCALE.  If more than `max_weak_frac` of the cells are weak the
+    whole page is redone at TEMPLATE_SCALE, as in the default mode.
+    `img` may be passed when the caller already decoded the page.  Debug
+    overlays go through `writer` when given, else are written inline.  If a
+    `confidences` list is given, the per-cell OCR confidence of each returned
+    row is appended to it.  crop=True preprocesses and OCRs only the region
+    found by locate_table(); word boxes are shifted back by the crop offset
+    so the template's page coordinates still apply.  band_workers > 1 OCRs
+    the page as that many row bands concurrently (see split_bands) instead
+    of one Tesseract call.
+    """
+    if img is None:
+        img = imread_gray(path)
+    page = deskew(img)
+    box = locate_table(page) if crop else None
+    region = page[box[1]:box[3], box[0]:box[2]] if box else page
+    dx, dy = (box[0] * TEMPLATE_SCALE, box[1] * TEMPLATE_SCALE) if box else (0.0, 0.0)
+    scale = 1.0 if adaptive else TEMPLATE_SCALE
+    bin_img = preprocess(region, scale=scale, do_deskew=False)
+    items = _offset_items(_scale_items(ocr_page(bin_img, psm, band_workers), TEMPLATE_SCALE / scale), dx, dy)
     if not items:
         return []
 
     rows = group_rows(items, start_y=template.header_bottom_y)
+    cell_rows = [_assign_cells(r, template) for r in rows]
+
+    if adaptive:
+        weak = _weak_cells(cell_rows, conf_threshold)
+        n_cells = sum(1 for cells in cell_rows for words in cells.values() if words)
+        if weak and len(weak) > max_weak_frac * max(1, n_cells):
+            # Too many weak cells: one full pass at the template scale is cheaper
+            scale = TEMPLATE_SCALE
+            bin_img = preprocess(region, scale=scale, do_deskew=False)
+            items = _offset_items(ocr_page(bin_img, psm, band_workers), dx, dy)
+            rows = group_rows(items, start_y=template.header_bottom_y)
+            cell_rows = [_assign_cells(r, template) for r in rows]
+        else:
+            for i, col in weak:
+                better = _reocr_cell(page, _cell_box(rows[i], col, template, page.shape), TEMPLATE_SCALE)
+                if not better:
+                    continue
+                old = cell_rows[i][col]
+                old_valid = cell_is_valid(col, _judged_value(col, old, _cells_to_row(cell_rows[i])))
+                new_value = _judged_value(col, [better], {col: clean_cell(col, better["text"])})
+                # Keep the re-OCR if it is at least as confident, or if it fixes an invalid
+                # cell with a real value (cell_is_valid() also accepts empty text)
+                if better["conf"] >= min(w["conf"] for w in old) or (
+                        not old_valid and new_value and cell_is_valid(col, new_value)):
+                    cell_rows[i][col] = [better]
 
-    col_names = [c[0] for c in template.columns]
     parsed_rows: List[Dict] = []
-
-    for r in rows:
-        cells: Dict[str, List[str]] = {name: [] for name in col_names}
-        for w in r:
-            col = assign_column(w["cx"], template)
-            cells[col].append(w["text"])
-        row_out = {name: clean_cell(name, " ".join(cells[name]).strip()) for name in col_names}
-        row_out = postprocess_row(row_out)
+    for cells in cell_rows:
+        row_out = _cells_to_row(cells)
         if any(v for v in row_out.values()):
             parsed_rows.append(row_out)
+            if confidences is not None:
+                confidences.append(_cells_confidence(cells))
 
     if debug and outdir:
         # Save a quick overlay of rows for QA
-        dbg = cv2.cvtColor(bin_img, cv2.COLOR_GRAY2BGR)
-        for r in rows:
-            ys = [w["top"] for w in r] + [w["bottom"] for w in r]
-            y1, y2 = min(ys), max(ys)
-            cv2.rectangle(dbg, (0, int(y1)), (dbg.shape[1]-1, int(y2)), (0, 255, 0), 1)
-        cv2.imwrite(os.path.join(outdir, f"debug_rows_{os.path.basename(path)}"), dbg)
+        if writer is None:
+            writer = DebugWriter(outdir, workers=0)
+        writer.submit(f"debug_rows_{os.path.basename(path)}", _render_rows_overlay, bin_img, rows, scale / TEMPLATE_SCALE, dy)
 
     return parsed_rows
 
 
+# ------------------------------ Template Library ------------------------------
+FINGERPRINT_WIDTH = 512
+FINGERPRINT_BINS = 128
+
+
+def _fingerprint_image(img: np.ndarray) -> np.ndarray:
+    """Page shrunk to a fixed width and binarized (ink = 1); no OCR involved."""
+    h, w = img.shape[:2]
+    small = cv2.resize(img, (FINGERPRINT_WIDTH, max(1, int(round(h * FINGERPRINT_WIDTH / w)))),
+                       interpolation=cv2.INTER_AREA)
+    ink = cv2.threshold(small, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+    return ink
+
+
+def _unit(v: np.ndarray) -> np.ndarray:
+    v = np.asarray(v, dtype=np.float64)
+    v = v - v.mean()
+    n = np.linalg.norm(v)
+    return v / n if n > 0 else v
+
+
+def band_profile(ink: np.ndarray, band: float) -> np.ndarray:
+    """Vertical projection (ink per column) of the top `band` fraction of the page."""
+    y1 = max(1, int(round(ink.shape[0] * min(1.0, band + 0.02))))
+    cols = ink[:y1].sum(axis=0, dtype=np.float64)
+    return _unit(cols.reshape(FINGERPRINT_BINS, -1).sum(axis=1))
+
+
+class TemplateLibrary:
+    """A directory of learned templates (*.json) plus fingerprint-based selection.
+
+    select() scores each template by correlating its stored header-band
+    profile with the same band of the page, so choosing a template costs a
+    resize and a column sum per candidate rather than an OCR pass.
+    """
+
+    def __init__(self, templates: Dict[str, Template]):
+        if not templates:
+            raise RuntimeError("Template library is empty.")
+        self.templates = templates
+
+    @staticmethod
+    def load(folder: str) -> "TemplateLibrary":
+        templates: Dict[str, Template] = {}
+        for p in sorted(glob.glob(os.path.join(folder, "*.json"))):
+            with open(p, "r", encoding="utf-8") as f:
+                templates[os.path.splitext(os.path.basename(p))[0]] = Template.from_dict(json.load(f))
+        if not templates:
+            raise RuntimeError(f"No templates (*.json) found in: {folder}")
+        return TemplateLibrary(templates)
+
+    def select(self, img: np.ndarray) -> Tuple[str, Template, float]:
+        """Best (name, template, score) for a grayscale page; score is a correlation in [-1, 1]."""
+        if len(self.templates) == 1:
+            name, tpl = next(iter(self.templates.items()))
+            return name, tpl, 1.0
+        ink = _fingerprint_image(img)
+        best: Optional[Tuple[str, Template, float]] = None
+        for name, tpl in self.templates.items():
+            if not tpl.fingerprint:
+                continue
+            score = float(np.dot(band_profile(ink, tpl.header_band), tpl.fingerprint))
+            if best is None or score > best[2]:
+                best = (name, tpl, score)
+        if best is None:
+            raise RuntimeError("No template in the library has a fingerprint. Re-learn them with this version.")
+        return best
+
+
 # ------------------------------------ CLI -------------------------------------
 def main():
     ap = argparse.ArgumentParser(description="Mini OCR table model: learn a layout once, parse many images.")
@@ -352,26 +1007,119 @@ def main():
     ap.add_argument("--parse", type=str, help="Folder with images to parse.")
     ap.add_argument("--template", type=str, help="Path to template.json (required for --parse unless also doing --learn).")
     ap.add_argument("--save-template", type=str, default="template.json", help="Where to save learned template.")
-    ap.add_argument("--out", type=str, default="rows.json", help="Where to save parsed JSON rows.")
+    ap.add_argument("--learner", choices=["header", "rules"], default="header",
+                    help="header: OCR whole training pages; rules: columns from ruled lines / whitespace, OCR header cells only.")
+    ap.add_argument("--name-samples", type=int, default=3, help="Pages whose header cells --learner rules OCRs to name columns.")
+    ap.add_argument("--converge-tol", type=float, help="Header learner: sample images in random order and stop once column positions move less than this (template px).")
+    ap.add_argument("--min-samples", type=int, default=5, help="Images to learn from before --converge-tol may stop.")
+    ap.add_argument("--max-samples", type=int, help="Learn from at most this many images.")
+    ap.add_argument("--seed", type=int, help="Seed for the --converge-tol sampling order.")
+    ap.add_argument("--columns", type=str,
+                    help="Comma-separated columns --converge-tol must find before stopping (default: all expected headers).")
+    ap.add_argument("--cross-check", action="store_true", help="With --learner rules, also run the header learner and report differences.")
+    ap.add_argument("--template-dir", type=str, help="Template library folder: --learn adds to it, --parse picks a template per image.")
+    ap.add_argument("--template-name", type=str, help="Name for the learned template in --template-dir (default: learn folder name).")
+    ap.add_argument("--out", type=str, help="Where to save parsed JSON rows (default rows.json; skipped with --out-db).")
+    ap.add_argument("--out-db", type=str, help="Also upsert rows (+ source image, row index, cell confidence) into this SQLite store.")
     ap.add_argument("--psm", type=int, default=6, help="Tesseract page segmentation mode (default 6).")
+    ap.add_argument("--aliases", type=str, help="JSON file with extra header aliases ({header: [alias, ...]}).")
+    ap.add_argument("--header-dist", type=int, default=2, help="Max edit distance for fuzzy header matching (0 = exact only).")
+    ap.add_argument("--adaptive", action="store_true", help="OCR at native scale and re-OCR only low-confidence cells upscaled.")
+    ap.add_argument("--crop", action="store_true", help="Find the table on a downsampled page and preprocess/OCR only that region.")
+    ap.add_argument("--band-workers", type=int, default=0, help="OCR each page as this many row bands in parallel (split at blank rows).")
+    ap.add_argument("--conf-threshold", type=float, default=60.0, help="Word confidence below which --adaptive re-OCRs a cell.")
+    ap.add_argument("--dedup", choices=["skip", "link"], help="Detect near-duplicate scans before OCR: skip them, or link (record which earlier image they duplicate, without re-emitting its rows).")
+    ap.add_argument("--hash-index", type=str, default="scan_hashes.json", help="Persistent page-hash index used by --dedup.")
+    ap.add_argument("--dedup-dist", type=int, default=48, help="Max differing hash bits (of 4096) for two scans to be compared as possible duplicates.")
+    ap.add_argument("--dedup-report", type=str, help="Write the list of deduplicated images to this JSON file.")
+    ap.add_argument("--shard", type=str, help="Parse only shard i of N (e.g. 0/4) of the images; writes <out>.manifest.json.")
+    ap.add_argument("--shard-key", choices=["path", "content"], default="path",
+                    help="Shard by image path relative to --parse, or by file content hash.")
+    ap.add_argument("--merge", type=str, nargs="+", help="Merge per-shard row files into --out (checks coverage).")
     ap.add_argument("--debug", action="store_true", help="Save debug overlays.")
     ap.add_argument("--outdir", type=str, default="_ocr_debug", help="Debug output folder if --debug is set.")
+    ap.add_argument("--debug-every", type=int, default=1, help="Keep the debug overlay of every Nth image only.")
+    ap.add_argument("--debug-scale", type=float, default=1.0, help="Downscale factor for debug overlays (e.g. 0.5).")
+    ap.add_argument("--debug-format", choices=["png", "jpg"], default="", help="Debug overlay file format (default: the image's own).")
+    ap.add_argument("--debug-queue", type=int, default=8, help="Overlays waiting to be written before new ones are dropped.")
     args = ap.parse_args()
 
+    writer: Optional[DebugWriter] = None
+    if args.debug:
+        # Overlays are drawn and encoded on a background thread
+        writer = DebugWriter(args.outdir, every=args.debug_every, scale=args.debug_scale,
+                             fmt=args.debug_format, queue_size=args.debug_queue)
+    try:
+        _run_cli(args, writer)
+    finally:
+        if writer is not None:
+            writer.close()
+            print(f"[ok] Debug overlays: {writer.summary()}")
+
+
+def _run_cli(args, writer: Optional[DebugWriter]):
+    if args.out is None and not (args.out_db and args.parse and not args.shard):
+        args.out = "rows.json"
+    if args.merge:
+        from sharding import merge_shards
+        rows, problems = merge_shards(args.merge)
+        for msg in problems:
+            print(f"[error] {msg}")
+        if problems:
+            raise SystemExit(f"Merge aborted: {len(problems)} problem(s); {args.out} not written.")
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2, ensure_ascii=False)
+        print(f"[ok] Merged {len(args.merge)} shards, {len(rows)} rows → {args.out}")
+        return
+
+    HEADER_INDEX.max_dist = args.header_dist
+    if args.aliases:
+        load_aliases(args.aliases)
+
     tpl: Optional[Template] = None
 
     if args.learn:
-        tpl = learn_template_from_folder(args.learn, psm=args.psm, debug=args.debug, outdir=args.outdir if args.debug else None)
-        with open(args.save_template, "w", encoding="utf-8") as f:
+        sampling = dict(converge_tol=args.converge_tol, min_samples=args.min_samples,
+                        max_samples=args.max_samples, seed=args.seed,
+                        columns=[c.strip() for c in args.columns.split(",")] if args.columns else None)
+        t0 = time.perf_counter()
+        if args.learner == "rules":
+            tpl = learn_template_from_rules(args.learn, name_samples=args.name_samples, writer=writer)
+        else:
+            tpl = learn_template_from_folder(args.learn, psm=args.psm, debug=args.debug, outdir=args.outdir if args.debug else None,
+                                             writer=writer, **sampling)
+        print(f"[info] {args.learner} learner took {time.perf_counter() - t0:.2f}s")
+        if args.cross_check and args.learner == "rules":
+            t0 = time.perf_counter()
+            ref = learn_template_from_folder(args.learn, psm=args.psm, **sampling)
+            diff = compare_templates(tpl, ref)
+            print(f"[info] header learner took {time.perf_counter() - t0:.2f}s; cross-check: {json.dumps(diff)}")
+            # Cuts further apart than a third of the narrowest inner column can move words between columns
+            widths = np.diff(tpl.x_cuts).tolist()
+            tol = min(widths) / 3.0 if widths else 20.0
+            if diff["only_first"] or diff["only_second"] or diff["cut_diff"] > tol:
+                print("[warn] rules and header learners disagree; check the template before parsing")
+            else:
+                print("[ok] rules and header learners agree")
+        save_path = args.save_template
+        if args.template_dir:
+            os.makedirs(args.template_dir, exist_ok=True)
+            name = args.template_name or os.path.basename(os.path.normpath(args.learn))
+            save_path = os.path.join(args.template_dir, f"{name}.json")
+        with open(save_path, "w", encoding="utf-8") as f:
             json.dump(tpl.to_dict(), f, indent=2)
-        print(f"[ok] Template learned and saved → {args.save_template}")
+        print(f"[ok] Template learned and saved → {save_path}")
         if not args.parse:
             return
 
     if args.parse:
-        if tpl is None:
+        library: Optional[TemplateLibrary] = None
+        if args.template_dir:
+            library = TemplateLibrary.load(args.template_dir)
+            print(f"[info] Template library: {', '.join(library.templates)}")
+        elif tpl is None:
             if not args.template:
-                raise SystemExit("Provide --template (or run --learn at the same time).")
+                raise SystemExit("Provide --template or --template-dir (or run --learn at the same time).")
             with open(args.template, "r", encoding="utf-8") as f:
                 tpl = Template.from_dict(json.load(f))
 
@@ -381,13 +1129,94 @@ def main():
         )
         if not paths:
             print(f"[warn] No images found in {args.parse}")
+        total_images = len(paths)
+        shard = None
+        if args.shard:
+            from sharding import parse_shard_spec, select_shard, write_manifest, relative_image_path
+            shard = parse_shard_spec(args.shard)
+            paths = select_shard(paths, args.parse, shard, key=args.shard_key)
+            print(f"[info] Shard {shard[0]}/{shard[1]}: {len(paths)} of {total_images} images")
+        image_log: List[Dict] = []
+        store = None
+        if args.out_db:
+            from row_store import RowStore
+            from sharding import relative_image_path
+            store = RowStore(args.out_db)
+        hash_index = None
+        dedup_report: List[Dict] = []
+        if args.dedup:
+            from scan_dedup import ScanHashIndex, page_hash, same_page
+            hash_index = ScanHashIndex(args.hash_index, max_dist=args.dedup_dist)
+
         for p in paths:
-            rows = parse_image_with_template(p, tpl, psm=args.psm, debug=args.debug, outdir=args.outdir if args.debug else None)
+            img = imread_gray(p)
+            if hash_index is not None:
+                h = page_hash(img)
+                hit = None
+                # The hash only nominates candidates; confirm against the earlier image
+                for entry, dist in hash_index.find(h, exclude=p)[:3]:
+                    if not os.path.isfile(entry["image"]):
+                        print(f"[warn] Can't verify {os.path.basename(p)} against missing {entry['image']}; parsing it")
+                        continue
+                    if same_page(img, imread_gray(entry["image"])):
+                        hit = (entry, dist)
+                        break
+                if hit is not None:
+                    entry, dist = hit
+                    dedup_report.append({"image": p, "duplicate_of": entry["image"], "distance": dist, "action": args.dedup})
+                    print(f"[info] {os.path.basename(p)} duplicates {entry['image']} (distance {dist}) → {args.dedup}")
+                    # No rows either way: the earlier image's rows are already in this or an earlier output
+                    log_entry = {"image": p, "rows": 0, "status": "skipped"}
+                    if args.dedup == "link":
+                        log_entry.update(status="linked", linked_to=entry["image"])
+                        if store is not None:
+                            store.link_image(relative_image_path(p, args.parse),
+                                             relative_image_path(entry["image"], args.parse))
+                    image_log.append(log_entry)
+                    continue
+            page_tpl = tpl
+            tpl_name = os.path.basename(args.template) if args.template and not args.learn else "learned"
+            if library is not None:
+                name, page_tpl, score = library.select(img)
+                tpl_name = name
+                print(f"[info] {os.path.basename(p)} → template '{name}' (score {score:.2f})")
+                if score < 0.5:
+                    print(f"[warn] Low layout match for {os.path.basename(p)}; rows may be misaligned.")
+            confs: List[Dict] = []
+            rows = parse_image_with_template(p, page_tpl, psm=args.psm, debug=args.debug, outdir=args.outdir if args.debug else None,
+                                             adaptive=args.adaptive, conf_threshold=args.conf_threshold, img=img,
+                                             writer=writer, confidences=confs, crop=args.crop,
+                                             band_workers=args.band_workers)
             all_rows.extend(rows)
-
-        with open(args.out, "w", encoding="utf-8") as f:
-            json.dump(all_rows, f, indent=2, ensure_ascii=False)
-        print(f"[ok] Parsed {len(all_rows)} rows → {args.out}")
+            if store is not None:
+                store.write_image(relative_image_path(p, args.parse), rows, confs, template=tpl_name)
+            image_log.append({"image": p, "rows": len(rows), "status": "parsed"})
+            if hash_index is not None:
+                hash_index.add(h, p, rows)
+
+        if hash_index is not None:
+            hash_index.save()
+            print(f"[ok] Deduplicated {len(dedup_report)} of {len(paths)} images (index: {args.hash_index})")
+            if args.dedup_report:
+                with open(args.dedup_report, "w", encoding="utf-8") as f:
+                    json.dump(dedup_report, f, indent=2, ensure_ascii=False)
+
+        if store is not None:
+            store.flush()
+            print(f"[ok] Parsed {len(all_rows)} rows → {args.out_db} ({store.count()} rows stored)")
+            store.close()
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(all_rows, f, indent=2, ensure_ascii=False)
+            print(f"[ok] Parsed {len(all_rows)} rows → {args.out}")
+        if shard is not None:
+            for e in image_log:
+                e["image"] = relative_image_path(e["image"], args.parse)
+                if "linked_to" in e:
+                    e["linked_to"] = relative_image_path(e["linked_to"], args.parse)
+            write_manifest(args.out, shard, args.shard_key, total_images,
+                           [relative_image_path(p, args.parse) for p in paths], image_log)
+            print(f"[ok] Shard manifest → {args.out}.manifest.json")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,339 @@
+# pipeline.py - capture → OCR → insert, overlapped with asyncio
+#
+# The stages used to be separate manual runs (capture a screen, parse it with
+# ocr_table_model.py, type the rows with an agent), so nothing overlapped.
+# Here they are asyncio tasks connected by bounded queues:
+#
+#   capture ──frames──▶ OCR (thread pool, N pages in flight) ──records──▶ insert
+#
+# OCR is CPU/subprocess bound and runs in a thread pool (Tesseract is a
+# separate process and OpenCV releases the GIL).  Results are re-sequenced
+# so records reach the insert stage in capture order; the insert stage is a
+# single consumer on its own thread because the VM takes one GUI input
+# stream.  Full queues block the stage upstream (backpressure), so a slow
+# insert stage throttles capture instead of buffering frames without bound.
+#
+# Run against recorded frames and the fake input backend:
+#   python pipeline.py --frames-dir <recorded_frames> --template template.json --agent 2 --fake
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from lazy_deps import np
+from screen_capture import ScreenCapture, DirectorySource, make_source
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INSERT_DIR = os.path.join(BASE_DIR, "insert")
+if INSERT_DIR not in sys.path:
+    sys.path.append(INSERT_DIR)
+
+
+def row_to_record(row: Dict) -> Dict:
+    """Maps an OCR row (ocr_table_model / read_patient_list keys) to agent form keys."""
+    age, sex = row.get("Age", ""), row.get("Sex", "")
+    if "Age/Sex" in row and not (age or sex):
+        parts = str(row["Age/Sex"]).replace("/", " ").split()
+        age = parts[0] if parts else ""
+        sex = parts[1] if len(parts) > 1 else ""
+    return {
+        "id": row.get("Patient_ID", ""),
+        "name": row.get("Patient_Name", ""),
+        "address": row.get("Address", ""),
+        "date_of_birth": row.get("Date_Of_Birth", ""),
+        "age": age,
+        "sex": sex,
+    }
+
+
+class StageStats:
+    """Rolling latency window (seconds) and item count for one stage."""
+
+    def __init__(self, window: int = 512):
+        self.count = 0
+        self._lat: deque = deque(maxlen=window)
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self._lat.append(seconds)
+
+    def summary(self) -> Dict[str, float]:
+        lat = sorted(self._lat)
+        if not lat:
+            return {"count": self.count}
+        return {
+            "count": self.count,
+            "mean_ms": round(1000 * sum(lat) / len(lat), 2),
+            "p50_ms": round(1000 * lat[len(lat) // 2], 2),
+            "p95_ms": round(1000 * lat[min(len(lat) - 1, int(len(lat) * 0.95))], 2),
+            "max_ms": round(1000 * lat[-1], 2),
+        }
+
+
+class Pipeline:
+    """capture → OCR → insert with bounded queues between the stages.
+
+    parse(frame) -> list of OCR rows runs in the OCR pool; insert(record)
+    runs on a dedicated single thread, strictly in capture order.  Frames
+    identical to the previous one are not OCRed again (a static screen), and
+    a patient seen in an earlier frame (same ID or name + DOB) is only
+    inserted once per run, with or without an index.
+    """
+
+    def __init__(self, capture: ScreenCapture, parse: Callable[[np.ndarray], List[Dict]],
+                 insert: Callable[[Dict], None], max_frames: Optional[int] = None,
+                 frame_queue: int = 4, record_queue: int = 32, ocr_workers: int = 2,
+                 index=None, report_every: float = 5.0):
+        self.capture = capture
+        self.parse = parse
+        self.insert = insert
+        self.max_frames = max_frames
+        self.ocr_workers = max(1, ocr_workers)
+        self.index = index
+        self.report_every = report_every
+        self.frame_queue_size = frame_queue
+        self.record_queue_size = record_queue
+        self.stats = {name: StageStats() for name in ("capture", "ocr", "insert", "end_to_end")}
+        self.max_depth = {"frames": 0, "ocr_in_flight": 0, "records": 0}
+        self.counts = {"frames": 0, "unchanged": 0, "rows": 0, "inserted": 0, "failed": 0, "skipped": 0,
+                       "index_errors": 0}
+        self.errors: List[str] = []
+        self._seen: set = set()  # patient_keys of records already sent to insert
+
+    # ---- Stages ----
+    async def _capture_stage(self, frames: asyncio.Queue, loop, pool):
+        prev = None
+        n = 0
+        period = (1.0 / self.capture.fps) if self.capture.fps else 0.0
+        while self.max_frames is None or n < self.max_frames:
+            t0 = time.perf_counter()
+            # grab() returns a ring slot; copy it, the OCR stage holds it for a while
+            frame = await loop.run_in_executor(pool, lambda: self.capture.grab().copy())
+            n += 1
+            self.stats["capture"].add(time.perf_counter() - t0)
+            if prev is not None and np.array_equal(prev, frame):
+                self.counts["unchanged"] += 1
+            else:
+                prev = frame
+                self.counts["frames"] += 1
+                await frames.put((n, time.perf_counter(), frame))
+            if period:
+                await asyncio.sleep(max(0.0, t0 + period - time.perf_counter()))
+        await frames.put(None)
+
+    async def _ocr_stage(self, frames: asyncio.Queue, in_flight: asyncio.Queue, loop, pool):
+        # Submits up to ocr_workers pages at once; in_flight keeps them in capture order
+        while True:
+            item = await frames.get()
+            if item is None:
+                await in_flight.put(None)
+                return
+            frame_no, captured_at, frame = item
+            fut = loop.run_in_executor(pool, self._timed_parse, frame)
+            await in_flight.put((frame_no, captured_at, fut))
+
+    def _timed_parse(self, frame: np.ndarray):
+        t0 = time.perf_counter()
+        rows = self.parse(frame)
+        return rows, time.perf_counter() - t0
+
+    async def _sequence_stage(self, in_flight: asyncio.Queue, records: asyncio.Queue):
+        while True:
+            item = await in_flight.get()
+            if item is None:
+                await records.put(None)
+                return
+            frame_no, captured_at, fut = item
+            try:
+                rows, secs = await fut
+            except Exception as e:
+                self.errors.append(f"frame {frame_no}: OCR failed: {e}")
+                continue
+            self.stats["ocr"].add(secs)
+            self.counts["rows"] += len(rows)
+            for row in rows:
+                await records.put((frame_no, captured_at, row_to_record(row)))
+
+    async def _insert_stage(self, records: asyncio.Queue, loop, pool):
+        from patient_index import patient_keys
+
+        while True:
+            item = await records.get()
+            if item is None:
+                return
+            frame_no, captured_at, record = item
+            keys = {k for k in patient_keys(record) if k}
+            if keys & self._seen or (self.index is not None and self._indexed(frame_no, record)):
+                self.counts["skipped"] += 1
+                continue
+            # Marked before the attempt: a failed insert may still have reached the form
+            self._seen |= keys
+            t0 = time.perf_counter()
+            try:
+                await loop.run_in_executor(pool, self.insert, record)
+            except Exception as e:
+                self.counts["failed"] += 1
+                self.errors.append(f"frame {frame_no}: insert of {record.get('name', '')!r} failed: {e}")
+                continue
+            t1 = time.perf_counter()
+            self.counts["inserted"] += 1
+            self.stats["insert"].add(t1 - t0)
+            self.stats["end_to_end"].add(t1 - captured_at)
+            if self.index is not None:
+                try:
+                    self.index.add(record, source="pipeline")
+                except Exception as e:
+                    self.counts["index_errors"] += 1
+                    self.errors.append(f"frame {frame_no}: {record.get('name', '')!r} inserted but not indexed: {e}")
+
+    def _indexed(self, frame_no: int, record: Dict) -> bool:
+        try:
+            return bool(self.index.filter_new([record])[1])
+        except Exception as e:
+            # An unreadable index must not stop the stage; the in-run seen-set still applies
+            self.counts["index_errors"] += 1
+            self.errors.append(f"frame {frame_no}: index lookup failed, treating {record.get('name', '')!r} as new: {e}")
+            return False
+
+    async def _monitor(self, frames: asyncio.Queue, in_flight: asyncio.Queue, records: asyncio.Queue):
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(0.05)
+            depths = {"frames": frames.qsize(), "ocr_in_flight": in_flight.qsize(), "records": records.qsize()}
+            for k, v in depths.items():
+                self.max_depth[k] = max(self.max_depth[k], v)
+            if self.report_every and time.perf_counter() - last >= self.report_every:
+                last = time.perf_counter()
+                print(f"[info] queues {depths}  inserted={self.counts['inserted']} rows={self.counts['rows']}")
+
+    # ---- Run ----
+    async def run(self) -> Dict:
+        loop = asyncio.get_running_loop()
+        frames: asyncio.Queue = asyncio.Queue(maxsize=self.frame_queue_size)
+        in_flight: asyncio.Queue = asyncio.Queue(maxsize=self.ocr_workers)
+        records: asyncio.Queue = asyncio.Queue(maxsize=self.record_queue_size)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(1, thread_name_prefix="capture") as cap_pool, \
+                ThreadPoolExecutor(self.ocr_workers, thread_name_prefix="ocr") as ocr_pool, \
+                ThreadPoolExecutor(1, thread_name_prefix="insert") as ins_pool:
+            monitor = asyncio.ensure_future(self._monitor(frames, in_flight, records))
+            try:
+                await asyncio.gather(
+                    self._capture_stage(frames, loop, cap_pool),
+                    self._ocr_stage(frames, in_flight, loop, ocr_pool),
+                    self._sequence_stage(in_flight, records),
+                    self._insert_stage(records, loop, ins_pool),
+                )
+            finally:
+                monitor.cancel()
+        return self.report(time.perf_counter() - t0)
+
+    def report(self, elapsed: float) -> Dict:
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "counts": dict(self.counts),
+            "max_queue_depth": dict(self.max_depth),
+            "latency": {name: st.summary() for name, st in self.stats.items()},
+            "errors": list(self.errors),
+        }
+
+
+# ------------------------------------ CLI -------------------------------------
+def make_parser(template_path: Optional[str], template_dir: Optional[str], psm: int, adaptive: bool, crop: bool = False,
+                band_workers: int = 0):
+    import ocr_table_model as otm
+
+    library = otm.TemplateLibrary.load(template_dir) if template_dir else None
+    tpl = None
+    if library is None:
+        with open(template_path, "r", encoding="utf-8") as f:
+            tpl = otm.Template.from_dict(json.load(f))
+
+    def parse(frame: np.ndarray) -> List[Dict]:
+        page_tpl = library.select(frame)[1] if library is not None else tpl
+        return otm.parse_image_with_template("frame", page_tpl, psm=psm, adaptive=adaptive, img=frame, crop=crop,
+                                             band_workers=band_workers)
+    return parse
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Overlapped capture → OCR → insert pipeline.")
+    ap.add_argument("--frames-dir", type=str, help="Replay recorded frames from this folder instead of the screen.")
+    ap.add_argument("--region", type=str,
+                    help="left,top,width,height of the source list to capture (default with --frames-dir: whole frame; "
+                         "required live, and must not be the VM window the agent types into).")
+    ap.add_argument("--fps", type=float, default=None, help="Capture rate (default: as fast as the queues allow).")
+    ap.add_argument("--count", type=int, help="Frames to capture (default: each recorded frame once; live: until Ctrl+C).")
+    ap.add_argument("--template", type=str, default="template.json", help="Learned template (see ocr_table_model.py).")
+    ap.add_argument("--template-dir", type=str, help="Template library; picks a template per frame.")
+    ap.add_argument("--psm", type=int, default=6, help="Tesseract page segmentation mode.")
+    ap.add_argument("--adaptive", action="store_true", help="Native-scale OCR with low-confidence cell re-OCR.")
+    ap.add_argument("--crop", action="store_true", help="OCR only the table region of each frame.")
+    ap.add_argument("--band-workers", type=int, default=0, help="OCR each frame as this many row bands in parallel.")
+    ap.add_argument("--agent", choices=["1", "2", "3"], default="2", help="Insert agent.")
+    ap.add_argument("--fake", action="store_true", help="Use the recording input backend (no real input).")
+    ap.add_argument("--fake-time-scale", type=float, default=0.0,
+                    help="With --fake, really wait this fraction of the agent's sleeps (1.0 = VM pace).")
+    ap.add_argument("--ocr-workers", type=int, default=2, help="Pages OCRed concurrently.")
+    ap.add_argument("--frame-queue", type=int, default=4, help="Captured frames waiting for OCR.")
+    ap.add_argument("--record-queue", type=int, default=32, help="Parsed records waiting to be inserted.")
+    ap.add_argument("--index-db", type=str, help="Skip patients already in this inserted-patient index.")
+    ap.add_argument("--report", type=str, help="Write the final stats as JSON here.")
+    args = ap.parse_args()
+
+    if not (args.region or args.frames_dir):
+        # Capturing the VM window would OCR the agent's own inserts back in
+        ap.error("--region is required for live capture: the screen area showing the source list")
+    source = make_source(args.frames_dir)
+    if args.region:
+        region = tuple(int(v) for v in args.region.split(","))
+    else:
+        w, h = source.frame_size
+        region = (0, 0, w, h)
+    count = args.count
+    if count is None and isinstance(source, DirectorySource):
+        count = len(source.paths)
+
+    from service import load_agent
+    index = None
+    if args.index_db:
+        from patient_index import PatientIndex
+        index = PatientIndex(args.index_db)
+
+    pipe = Pipeline(
+        ScreenCapture(region, source=source, fps=args.fps),
+        make_parser(args.template, args.template_dir, args.psm, args.adaptive, args.crop, args.band_workers),
+        load_agent(args.agent, fake=args.fake, fake_time_scale=args.fake_time_scale),
+        max_frames=count, frame_queue=args.frame_queue, record_queue=args.record_queue,
+        ocr_workers=args.ocr_workers, index=index,
+    )
+    try:
+        report = asyncio.run(pipe.run())
+    except KeyboardInterrupt:
+        report = pipe.report(0.0)
+    finally:
+        pipe.capture.close()
+
+    c = report["counts"]
+    print(f"[ok] {c['frames']} frames ({c['unchanged']} unchanged) → {c['rows']} rows → "
+          f"{c['inserted']} inserted, {c['skipped']} skipped, {c['failed']} failed in {report['elapsed_s']}s")
+    for name, st in report["latency"].items():
+        if "mean_ms" in st:
+            print(f"     {name:<10} n={st['count']:<5} mean={st['mean_ms']}ms p50={st['p50_ms']}ms p95={st['p95_ms']}ms")
+    print(f"     max queue depth {report['max_queue_depth']}")
+    for err in report["errors"]:
+        print(f"[warn] {err}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
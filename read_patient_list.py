@@ -1,28 +1,42 @@
 # read_patient_list.py (Ultimate Self-Contained Version)
-import pyautogui
-import pytesseract
-from PIL import Image
+import os
+import sys
 import json
-import cv2
-import numpy as np
 import time
 import re
+import hashlib
+import argparse
 
-# This path should point to your Tesseract installation.
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+# Heavy imports are deferred; the Tesseract path is auto-detected and cached
+# (TESSERACT_PATH env var, PATH, then the default Windows install locations).
+from lazy_deps import cv2, np, pytesseract
+from screen_capture import ScreenCapture
+from debug_writer import DebugWriter
 
 # Your captured coordinates
 TOP_LEFT_CORNER = (256, 367)
 BOTTOM_RIGHT_CORNER = (1862, 753)
 
-def advanced_parse_ocr_data(text):
+# Debug copy of the processed image: "jpg" (default), "png" or "off";
+# written in the background while OCR runs, optionally downscaled.
+LIST_DEBUG_IMAGE = os.environ.get("LIST_DEBUG_IMAGE", "jpg").lower()
+LIST_DEBUG_SCALE = float(os.environ.get("LIST_DEBUG_SCALE", "1.0"))
+
+# "tesseract" (default) or "glyph": exact glyph-bitmap matching against a font
+# learned once with glyph_ocr.py (LIST_GLYPH_FONT, default glyph_font.json).
+LIST_OCR_ENGINE = os.environ.get("LIST_OCR_ENGINE", "tesseract").lower()
+
+# Rows the list moves per mouse-wheel notch (Windows default: 3 lines)
+LIST_WHEEL_LINES = int(os.environ.get("LIST_WHEEL_LINES", "3"))
+
+def advanced_parse_ocr_data(text, skip_header=True):
     """Uses Regular Expressions (regex) to intelligently parse the OCR text."""
     patients = []
     lines = text.strip().split('\n')
     date_pattern = re.compile(r'\d{1,2}[/-]\d{1,2}[/-]\d{4}')
     
     # Skip header line by starting the loop from the second line
-    for line in lines[1:]:
+    for line in (lines[1:] if skip_header else lines):
         if not line.strip(): continue
         
         # Find the date to anchor our parsing
@@ -51,48 +65,263 @@ def advanced_parse_ocr_data(text):
             
     return patients
 
-def read_patient_data():
-    """Applies a definitive, simplified pipeline for maximum OCR accuracy."""
-    
-    left, top = TOP_LEFT_CORNER
-    width = BOTTOM_RIGHT_CORNER[0] - left
-    height = BOTTOM_RIGHT_CORNER[1] - top
-    
+def grab_list_view(top_left=TOP_LEFT_CORNER, bottom_right=BOTTOM_RIGHT_CORNER, capture=None):
+    """Captures the patient list region as raw grayscale."""
+    left, top = top_left
+    width = bottom_right[0] - left
+    height = bottom_right[1] - top
+
     if width <= 0 or height <= 0:
-        print("ERROR: The corner coordinates are incorrect.")
-        return
+        raise ValueError("The corner coordinates are incorrect.")
 
-    print(f"Capturing screen region: Left={left}, Top={top}, Width={width}, Height={height}")
-    screenshot = pyautogui.screenshot(region=(left, top, width, height))
-    
+    # One grab into a reusable buffer (see screen_capture.py)
+    if capture is None:
+        capture = ScreenCapture((left, top, width, height), ring_size=1)
+    return capture.grab()
+
+
+def capture_list_image(top_left=TOP_LEFT_CORNER, bottom_right=BOTTOM_RIGHT_CORNER, capture=None):
+    """Captures the patient list region and returns the processed (binary) image."""
+    return process_list_image(grab_list_view(top_left, bottom_right, capture))
+
+
+def process_list_image(img_cv):
+    """Processing applied to a raw grayscale capture of the list before OCR."""
     # --- ULTIMATE IMAGE PROCESSING PIPELINE ---
-    
-    # 1. Convert to OpenCV format and upscale (the most effective step)
-    img_cv = cv2.cvtColor(np.array(screenshot), cv2.COLOR_RGB2GRAY)
+
+    # 1. Upscale (the most effective step)
     img_cv = cv2.resize(img_cv, (0, 0), fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
 
     # 2. Apply an inverted binary threshold to get clean black text on a white background
     # This is a simple and powerful way to create a high-contrast image.
     _, img_cv = cv2.threshold(img_cv, 128, 255, cv2.THRESH_BINARY_INV)
     # --- END OF PROCESSING ---
+    return img_cv
 
-    timestamp = time.strftime("%Y%m%d-%H%M%S")
-    final_image_path = f"debug_ultimate_{timestamp}.png"
-    cv2.imwrite(final_image_path, img_cv)
-    print(f"Saved final processed image to: {final_image_path}")
-    
-    print("\n--- Reading Data from Screen ---")
+
+def ocr_patient_list(img_cv, skip_header=True):
+    """Runs Tesseract on a processed list image and returns (raw_text, patients)."""
     # Use Page Segmentation Mode 6, which is optimized for tables
     config = r'--oem 3 --psm 6'
     extracted_text = pytesseract.image_to_string(img_cv, config=config)
+    return extracted_text, advanced_parse_ocr_data(extracted_text, skip_header=skip_header)
+
+
+def ocr_list_view(gray, skip_header=True, engine=None):
+    """OCRs a raw grayscale list view with `engine` (default LIST_OCR_ENGINE); returns (raw_text, patients)."""
+    if (engine or LIST_OCR_ENGINE) == "glyph":
+        from glyph_ocr import get_reader
+        text = get_reader().read_text(gray)
+        return text, advanced_parse_ocr_data(text, skip_header=skip_header)
+    return ocr_patient_list(process_list_image(gray), skip_header=skip_header)
+
+
+def read_patient_list(capture=None, engine=None):
+    """One capture + one OCR pass over the legacy list; returns parsed patients."""
+    return ocr_list_view(grab_list_view(capture=capture), engine=engine)[1]
+
+
+# ---- Bulk export: page through the whole list ----
+# Each view is split into row bands (horizontal ink projection) and every band
+# is hashed.  Rows whose hash was already seen (the overlap with the previous
+# view, the header) are not OCRed again; only the new bands are stacked into
+# one strip and OCRed.  A view with no new rows means the list stopped moving.
+
+def split_row_bands(gray, min_height=4, max_gap=2, dark=128):
+    """(top, bottom) pixel rows of each text line in a raw grayscale list view."""
+    ink_rows = (gray < dark).sum(axis=1) > 0
+    bands = []
+    start = None
+    gap = 0
+    for y, has_ink in enumerate(ink_rows):
+        if has_ink:
+            if start is None:
+                start = y
+            gap = 0
+        elif start is not None:
+            gap += 1
+            if gap > max_gap:
+                if y - gap + 1 - start >= min_height:
+                    bands.append((start, y - gap + 1))
+                start, gap = None, 0
+    if start is not None and len(ink_rows) - gap - start >= min_height:
+        bands.append((start, len(ink_rows) - gap))
+    return bands
+
+
+def row_hash(band, dark=128):
+    """Exact hash of a row's ink pattern (screen pixels are deterministic)."""
+    ink = np.packbits(band < dark, axis=1)
+    return hashlib.blake2b(ink.tobytes() + str(band.shape).encode(), digest_size=16).hexdigest()
+
+
+def _stack_bands(gray, bands, pad=4):
+    # Blank (background) padding, not the neighbouring rows: a sliver of the
+    # next line's ink would read as an extra line
+    background = np.full((pad, gray.shape[1]), int(np.median(gray)), dtype=gray.dtype)
+    parts = [background]
+    for top, bottom in bands:
+        parts += [gray[top:bottom], background]
+    return np.vstack(parts)
+
+
+def iter_all_patients(capture=None, backend=None, scroll="pagedown", max_views=1000, settle=0.4,
+                      ocr=None, stats=None):
+    """Yields every patient in the legacy list once, scrolling until it stops moving.
+
+    scroll: "pagedown" (PageDown key after a click into the list) or "wheel".
+    The wheel step is sized from the first view to move a couple of rows less
+    than one view.  Every later view must share a data row (not the header)
+    with the previous view; if one doesn't, the wheel is scrolled back and
+    retried with half the step (PageDown can't be, so it only warns).
+    ocr(raw_gray, skip_header) -> (text, patients) defaults to ocr_list_view.
+    `stats`, if given, is a dict updated with views / rows_seen / rows_ocred / patients / gaps.
+    """
+    left, top = TOP_LEFT_CORNER
+    width = BOTTOM_RIGHT_CORNER[0] - left
+    height = BOTTOM_RIGHT_CORNER[1] - top
+    if capture is None:
+        capture = ScreenCapture((left, top, width, height), ring_size=1)
+    if backend is None:
+        insert_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "insert")
+        if insert_dir not in sys.path:
+            sys.path.append(insert_dir)
+        from input_backend import LiveBackend
+        backend = LiveBackend()
+    ocr = ocr or ocr_list_view
+    stats = stats if stats is not None else {}
+    stats.update(views=0, rows_seen=0, rows_ocred=0, patients=0, gaps=0)
+
+    seen_rows = set()
+    seen_ids = set()
+    # Focus the list once so PageDown / wheel scroll it
+    cx, cy = left + width // 2, top + height // 2
+    backend.click(cx, cy)
+    backend.sleep(settle)
+
+    step = 0  # wheel notches per scroll, sized from the first view
+    prev_rows = set()  # data-row hashes of the last accepted view
+    for view in range(max_views):
+        gray = capture.grab()
+        stats["views"] += 1
+        bands = split_row_bands(gray)
+        hashes = [row_hash(gray[band[0]:band[1]]) for band in bands]
+        # The first band is the header line, which is in every view and proves nothing
+        data_rows = set(hashes[1:])
+        if view and data_rows and not prev_rows & data_rows:
+            # No data row from the previous view: the scroll jumped past rows we never saw
+            stats["gaps"] += 1
+            if scroll == "wheel" and step > 1:
+                print(f"[warn] View {view} doesn't overlap the previous one; scrolling back with "
+                      f"{step // 2} notches instead of {step}", file=sys.stderr)
+                backend.move_to(cx, cy)
+                backend.scroll(step)
+                step //= 2
+                backend.scroll(-step)
+                backend.sleep(settle)
+                continue
+            print(f"[warn] View {view} doesn't overlap the previous one; rows may have been missed", file=sys.stderr)
+        stats["rows_seen"] += len(bands)
+        prev_rows = data_rows
+        new_bands = []
+        for band, h in zip(bands, hashes):
+            if h not in seen_rows:
+                seen_rows.add(h)
+                new_bands.append(band)
+        if not new_bands:
+            break
+        stats["rows_ocred"] += len(new_bands)
+        # The first view starts with the list's header line
+        _, patients = ocr(_stack_bands(gray, new_bands), view == 0)
+        for patient in patients:
+            # A row re-rendered differently (e.g. the selection highlight) is caught here
+            if patient["Patient_ID"] in seen_ids:
+                continue
+            seen_ids.add(patient["Patient_ID"])
+            stats["patients"] += 1
+            yield patient
+
+        if scroll == "wheel":
+            if not step:
+                # Leave two rows of overlap (the first view also holds the header line)
+                step = max(1, (len(bands) - 3) // LIST_WHEEL_LINES)
+            backend.move_to(cx, cy)
+            backend.scroll(-step)
+        else:
+            backend.press("pagedown")
+        backend.sleep(settle)
+
+
+def read_patient_data():
+    """Applies a definitive, simplified pipeline for maximum OCR accuracy."""
+
+    left, top = TOP_LEFT_CORNER
+    width = BOTTOM_RIGHT_CORNER[0] - left
+    height = BOTTOM_RIGHT_CORNER[1] - top
+
+    if width <= 0 or height <= 0:
+        print("ERROR: The corner coordinates are incorrect.")
+        return
+
+    print(f"Capturing screen region: Left={left}, Top={top}, Width={width}, Height={height}")
+    gray = grab_list_view()
+    # The glyph engine reads the raw capture; the debug copy shows what the engine saw
+    img_cv = gray if LIST_OCR_ENGINE == "glyph" else process_list_image(gray)
+
+    writer = None
+    if LIST_DEBUG_IMAGE != "off":
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        writer = DebugWriter(".", scale=LIST_DEBUG_SCALE, fmt=LIST_DEBUG_IMAGE)
+        ext = "jpg" if LIST_DEBUG_IMAGE in ("jpg", "jpeg") else "png"
+        final_image_name = f"debug_ultimate_{timestamp}.{ext}"
+        writer.submit(final_image_name, lambda img: img, img_cv)
+    
+    print("\n--- Reading Data from Screen ---")
+    t0 = time.perf_counter()
+    if LIST_OCR_ENGINE == "glyph":
+        extracted_text, patient_list = ocr_list_view(gray)
+    else:
+        extracted_text, patient_list = ocr_patient_list(img_cv)
+    print(f"[info] {LIST_OCR_ENGINE} read the list in {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    if writer is not None:
+        if writer.close()["written"]:
+            print(f"Saved final processed image to: {writer.path_for(final_image_name)}")
+        else:
+            print(f"[warn] Final processed image not saved: {writer.summary()}")
     
     print("\n--- Raw OCR Text Output ---")
     print(extracted_text)
     
-    patient_list = advanced_parse_ocr_data(extracted_text)
-    
     print("\n--- Parsed Patient Data (Final) ---")
     print(json.dumps(patient_list, indent=4))
 
+def export_all_patients():
+    ap = argparse.ArgumentParser(description="Read the legacy patient list (one view, or --all pages).")
+    ap.add_argument("--all", action="store_true", help="Scroll through the whole list and export every patient.")
+    ap.add_argument("--scroll", choices=["pagedown", "wheel"], default="pagedown", help="How to advance the list.")
+    ap.add_argument("--settle", type=float, default=0.4, help="Seconds to wait after scrolling before capturing.")
+    ap.add_argument("--max-views", type=int, default=1000, help="Safety limit on list views.")
+    ap.add_argument("--out", type=str, help="Write patients as JSON lines here (default: stdout).")
+    args = ap.parse_args()
+
+    if not args.all:
+        read_patient_data()
+        return
+
+    stats = {}
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    t0 = time.perf_counter()
+    try:
+        for patient in iter_all_patients(scroll=args.scroll, max_views=args.max_views, settle=args.settle, stats=stats):
+            out.write(json.dumps(patient) + "\n")
+            out.flush()
+    finally:
+        if args.out:
+            out.close()
+    print(f"[ok] {stats['patients']} patients from {stats['views']} views in {time.perf_counter() - t0:.1f}s "
+          f"({stats['rows_ocred']} of {stats['rows_seen']} row images OCRed, {stats['gaps']} gaps)", file=sys.stderr)
+
+
 if __name__ == "__main__":
-    read_patient_data()
\ No newline at end of file
+    export_all_patients()
\ No newline at end of file
@@ -0,0 +1,149 @@
+# row_store.py - indexed SQLite output for ocr_table_model.py --parse
+#
+# rows.json is one pretty-printed array: every lookup loads the whole file and
+# every run rewrites it.  With --out-db the parsed rows also go into SQLite,
+# keyed by (source image, row index) and indexed on Patient_ID, name and date
+# of birth.  Rows are written in batched transactions, and a rerun of an image
+# upserts its rows in place (dropping rows the new parse no longer has).
+# The images table has one entry per source image; a scan that --dedup link
+# found to duplicate an earlier one has no rows and names it in linked_to.
+#
+#   python row_store.py rows.db --patient-id 1234
+#   python row_store.py rows.db --image scan_017.png
+#   python row_store.py rows.db --name "jorge" --dob 01/01/1980
+import json
+import time
+import sqlite3
+import argparse
+from typing import Dict, List, Optional
+
+COLUMNS = ["Patient_ID", "Patient_Name", "Address", "Date_Of_Birth", "Age", "Sex"]
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS rows ("
+    " image TEXT NOT NULL, row_index INTEGER NOT NULL,"
+    " Patient_ID TEXT, Patient_Name TEXT, Address TEXT, Date_Of_Birth TEXT, Age TEXT, Sex TEXT,"
+    " conf TEXT, template TEXT, parsed_at REAL NOT NULL,"
+    " PRIMARY KEY (image, row_index))",
+    "CREATE INDEX IF NOT EXISTS ix_rows_patient_id ON rows (Patient_ID)",
+    "CREATE INDEX IF NOT EXISTS ix_rows_name ON rows (Patient_Name COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS ix_rows_dob ON rows (Date_Of_Birth)",
+    "CREATE TABLE IF NOT EXISTS images ("
+    " image TEXT PRIMARY KEY, row_count INTEGER NOT NULL, template TEXT, linked_to TEXT, parsed_at REAL NOT NULL)",
+]
+
+_UPSERT = (
+    f"INSERT INTO rows (image, row_index, {', '.join(COLUMNS)}, conf, template, parsed_at)"
+    f" VALUES ({', '.join('?' * (len(COLUMNS) + 5))})"
+    " ON CONFLICT (image, row_index) DO UPDATE SET "
+    + ", ".join(f"{c} = excluded.{c}" for c in COLUMNS + ["conf", "template", "parsed_at"])
+)
+
+_UPSERT_IMAGE = (
+    "INSERT INTO images (image, row_count, template, linked_to, parsed_at) VALUES (?, ?, ?, ?, ?)"
+    " ON CONFLICT (image) DO UPDATE SET row_count = excluded.row_count, template = excluded.template,"
+    " linked_to = excluded.linked_to, parsed_at = excluded.parsed_at"
+)
+
+
+class RowStore:
+    """Parsed rows by (image, row_index); writes are buffered and committed in batches."""
+
+    def __init__(self, path: str, batch_size: int = 500):
+        self.path = path
+        self.batch_size = batch_size
+        self._con = sqlite3.connect(path)
+        self._pending: List[tuple] = []
+        self._trims: List[tuple] = []
+        self._images: List[tuple] = []
+        with self._con:
+            for stmt in SCHEMA:
+                self._con.execute(stmt)
+
+    def write_image(self, image: str, rows: List[Dict], confidences: Optional[List[Dict]] = None,
+                    template: str = "") -> None:
+        """Queues all rows of one image (replacing whatever an earlier run stored for it)."""
+        now = time.time()
+        for i, row in enumerate(rows):
+            conf = confidences[i] if confidences and i < len(confidences) else None
+            self._pending.append(
+                (image, i, *[row.get(c, "") for c in COLUMNS],
+                 json.dumps(conf) if conf is not None else None, template, now)
+            )
+        self._trims.append((image, len(rows)))
+        self._images.append((image, len(rows), template, None, now))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def link_image(self, image: str, linked_to: str) -> None:
+        """Records `image` as a duplicate of `linked_to`; it keeps no rows of its own."""
+        self._trims.append((image, 0))
+        self._images.append((image, 0, "", linked_to, time.time()))
+
+    def flush(self) -> None:
+        if not self._pending and not self._trims:
+            return
+        with self._con:
+            self._con.executemany(_UPSERT, self._pending)
+            # A rerun that finds fewer rows must not leave the old tail behind
+            self._con.executemany("DELETE FROM rows WHERE image = ? AND row_index >= ?", self._trims)
+            self._con.executemany(_UPSERT_IMAGE, self._images)
+        self._pending, self._trims, self._images = [], [], []
+
+    def find(self, patient_id: Optional[str] = None, image: Optional[str] = None,
+             name: Optional[str] = None, dob: Optional[str] = None) -> List[Dict]:
+        where, params = [], []
+        if patient_id is not None:
+            where.append("Patient_ID = ?"); params.append(patient_id)
+        if image is not None:
+            where.append("image = ?"); params.append(image)
+        if name is not None:
+            where.append("Patient_Name = ? COLLATE NOCASE"); params.append(name)
+        if dob is not None:
+            where.append("Date_Of_Birth = ?"); params.append(dob)
+        q = "SELECT * FROM rows" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY image, row_index"
+        cur = self._con.execute(q, params)
+        names = [d[0] for d in cur.description]
+        out = []
+        for values in cur:
+            rec = dict(zip(names, values))
+            rec["conf"] = json.loads(rec["conf"]) if rec["conf"] else None
+            out.append(rec)
+        return out
+
+    def linked_to(self, image: str) -> Optional[str]:
+        row = self._con.execute("SELECT linked_to FROM images WHERE image = ?", (image,)).fetchone()
+        return row[0] if row else None
+
+    def count(self) -> int:
+        return self._con.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def close(self) -> None:
+        self.flush()
+        self._con.close()
+
+
+# ------------------------------------ CLI -------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Query the SQLite row store written by ocr_table_model.py --out-db.")
+    ap.add_argument("db", type=str, help="Row store database.")
+    ap.add_argument("--patient-id", type=str, help="Rows with this Patient_ID.")
+    ap.add_argument("--image", type=str, help="Rows parsed from this image (path relative to the --parse folder).")
+    ap.add_argument("--name", type=str, help="Rows with this Patient_Name (case-insensitive).")
+    ap.add_argument("--dob", type=str, help="Rows with this Date_Of_Birth.")
+    args = ap.parse_args()
+
+    store = RowStore(args.db)
+    if not any([args.patient_id, args.image, args.name, args.dob]):
+        print(f"[ok] {store.count()} rows in {args.db}")
+        return
+    rows = store.find(patient_id=args.patient_id, image=args.image, name=args.name, dob=args.dob)
+    print(json.dumps(rows, indent=2, ensure_ascii=False))
+    print(f"[ok] {len(rows)} rows")
+    link = store.linked_to(args.image) if args.image else None
+    if link:
+        print(f"[info] {args.image} duplicates {link}; its rows are stored under that image")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# scan_dedup.py - near-duplicate scan detection for ocr_table_model.py --parse
+#
+# Scan folders often hold the same page twice (rescanned, or re-exported at a
+# different resolution).  Each page gets a perceptual hash computed from the
+# decoded grayscale image before any preprocessing/OCR; a persistent index maps
+# hashes to the rows already parsed from that page, so a near-duplicate can be
+# skipped or linked to the earlier result instead of being OCRed again.
+#
+# Pages of the same list share their layout, so the hash has to see the text
+# itself, not just where the rows are: Otsu-binarize, crop to the ink bounding
+# box (removes margin/resolution differences), normalize to a fixed width,
+# blur away stroke-level noise and average down to a 64x64 grid; a bit is set
+# where a cell holds more ink than the median.  Plain dHash on white pages is
+# dominated by scanner noise in empty regions.
+#
+# The hash only nominates candidates.  same_page() then compares the two pages
+# tile by tile at working resolution, so a page that differs in a single cell
+# (another patient, a corrected value) is never skipped or linked.
+import os
+import json
+from typing import Dict, List, Optional, Tuple
+
+from lazy_deps import cv2, np
+
+HASH_SIZE = 64          # 64x64 = 4096-bit hash
+DEFAULT_MAX_DIST = 48   # bits; rescans land around 20-50, other pages of the same list 90+
+VERIFY_WIDTH = 1000     # working width for same_page()
+VERIFY_TILE = 32        # px; roughly one character at VERIFY_WIDTH
+VERIFY_MAX_MISS = 0.15  # max share of a tile's ink with no counterpart in the other page
+
+
+def _ink_crop(img: np.ndarray, width: int) -> np.ndarray:
+    """Otsu ink mask (0/1) cropped to its bounding box and resized to `width`."""
+    ink = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+    ys, xs = np.nonzero(ink)
+    if ys.size:
+        ink = ink[ys.min():ys.max() + 1, xs.min():xs.max() + 1]
+    h, w = ink.shape[:2]
+    ink = cv2.resize(ink, (width, max(1, int(round(h * width / w)))), interpolation=cv2.INTER_AREA)
+    return (ink > 96).astype(np.uint8)
+
+
+def page_hash(img: np.ndarray) -> np.ndarray:
+    """4096-bit perceptual hash of a grayscale page, packed into 512 bytes."""
+    ink = cv2.GaussianBlur(_ink_crop(img, 512).astype(np.float32), (0, 0), 3)
+    grid = cv2.resize(ink, (HASH_SIZE, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    return np.packbits((grid > np.median(grid)).ravel())
+
+
+def _tile_sums(mask: np.ndarray, tile: int) -> np.ndarray:
+    h, w = mask.shape
+    padded = np.zeros((-(-h // tile) * tile, -(-w // tile) * tile), np.float32)
+    padded[:h, :w] = mask
+    return padded.reshape(padded.shape[0] // tile, tile, padded.shape[1] // tile, tile).sum(axis=(1, 3))
+
+
+def page_mismatch(a: np.ndarray, b: np.ndarray) -> float:
+    """Worst per-tile share of ink in one page with no ink nearby in the other (0 = same page)."""
+    ia, ib = _ink_crop(a, VERIFY_WIDTH), _ink_crop(b, VERIFY_WIDTH)
+    if abs(ia.shape[0] - ib.shape[0]) > 0.02 * ia.shape[0]:
+        return 1.0  # different aspect ratio of the text block
+    ib = cv2.resize(ib, (ia.shape[1], ia.shape[0]), interpolation=cv2.INTER_NEAREST)
+    # Dilate so a pixel or two of rescan misregistration isn't counted
+    kernel = np.ones((5, 5), np.uint8)
+    miss_a = ia & (1 - cv2.dilate(ib, kernel))
+    miss_b = ib & (1 - cv2.dilate(ia, kernel))
+    # Floor the denominator so specks in near-empty tiles don't count
+    share_a = _tile_sums(miss_a, VERIFY_TILE) / np.maximum(_tile_sums(ia, VERIFY_TILE), 20)
+    share_b = _tile_sums(miss_b, VERIFY_TILE) / np.maximum(_tile_sums(ib, VERIFY_TILE), 20)
+    return float(max(share_a.max(), share_b.max()))
+
+
+def same_page(a: np.ndarray, b: np.ndarray, max_miss: float = VERIFY_MAX_MISS) -> bool:
+    return page_mismatch(a, b) <= max_miss
+
+
+class ScanHashIndex:
+    """Persistent (JSON) index of page hashes → source image and parsed rows.
+
+    Entries are keyed by absolute image path: adding a page that is already
+    indexed replaces its entry, and find() never returns the page itself, so
+    rerunning over the same folder doesn't dedupe every page against its own
+    earlier entry.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_dist: int = DEFAULT_MAX_DIST):
+        self.path = path
+        self.max_dist = max_dist
+        self.entries: List[Dict] = []
+        self._hashes: List[np.ndarray] = []
+        self._matrix: Optional[np.ndarray] = None  # stacked _hashes, rebuilt lazily
+        if path and os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("hash_size") != HASH_SIZE:
+                print(f"[warn] {path} was built with a different page hash; starting a new index")
+                return
+            for e in data.get("entries", []):
+                self._append(np.frombuffer(bytes.fromhex(e["hash"]), dtype=np.uint8), e)
+
+    def _append(self, h: np.ndarray, entry: Dict) -> None:
+        self.entries.append(entry)
+        self._hashes.append(h)
+        self._matrix = None
+
+    def find(self, h: np.ndarray, exclude: Optional[str] = None) -> List[Tuple[Dict, int]]:
+        """Stored pages within max_dist bits, closest first, as (entry, distance).
+
+        `exclude` is the image being checked; its own earlier entry is skipped.
+        """
+        if not self.entries:
+            return []
+        if self._matrix is None:
+            self._matrix = np.stack(self._hashes)
+        dists = np.unpackbits(np.bitwise_xor(self._matrix, h[None, :]), axis=1).sum(axis=1)
+        exclude = os.path.abspath(exclude) if exclude else None
+        return [(self.entries[i], int(dists[i])) for i in np.argsort(dists, kind="stable")
+                if dists[i] <= self.max_dist and self.entries[i]["image"] != exclude]
+
+    def add(self, h: np.ndarray, image_path: str, rows: List[Dict]) -> None:
+        image_path = os.path.abspath(image_path)
+        for i, e in enumerate(self.entries):
+            if e["image"] == image_path:
+                del self.entries[i]
+                del self._hashes[i]
+                break
+        self._append(h, {"hash": h.tobytes().hex(), "image": image_path, "rows": rows})
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"hash_size": HASH_SIZE, "entries": self.entries}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
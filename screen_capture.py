@@ -0,0 +1,265 @@
+# screen_capture.py - fast region capture into reusable NumPy buffers
+#
+# pyautogui.screenshot() builds a full PIL image for every call and the
+# scripts then copy it again into NumPy.  This module grabs only the VM window
+# region straight into a small ring of preallocated grayscale buffers, so a
+# continuous watcher does not allocate per frame.
+#
+# Sources (picked in this order by make_source()):
+#   - mss        : raw X11/GDI grab (works against Xvfb on Linux)
+#   - pyautogui  : fallback, slower but always available where the agents run
+#   - directory  : a folder of recorded frames, used as a stand-in for the VM
+from __future__ import annotations
+
+import os
+import glob
+import time
+import argparse
+from collections import deque
+from typing import List, Optional, Tuple, Dict, Iterator
+
+from lazy_deps import cv2, np
+
+try:
+    import mss
+except Exception:
+    mss = None
+
+TARGET_WINDOW_TITLE = "WinXP for VB6"
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+
+Region = Tuple[int, int, int, int]  # (left, top, width, height)
+
+
+# --------------------------------- Sources ------------------------------------
+class MssSource:
+    """Grabs a screen region with mss (BGRA) and converts in place to gray."""
+
+    def __init__(self):
+        if mss is None:
+            raise RuntimeError("mss is not installed. Run: pip install mss")
+        self._sct = mss.mss()
+
+    def grab_into(self, region: Region, out: np.ndarray) -> np.ndarray:
+        left, top, width, height = region
+        shot = self._sct.grab({"left": left, "top": top, "width": width, "height": height})
+        bgra = np.frombuffer(shot.raw, dtype=np.uint8).reshape(height, width, 4)
+        cv2.cvtColor(bgra, cv2.COLOR_BGRA2GRAY, dst=out)
+        return out
+
+    def close(self):
+        self._sct.close()
+
+
+class PyAutoGuiSource:
+    """Fallback source; still pays for the PIL image but writes into `out`."""
+
+    def __init__(self):
+        import pyautogui
+        self._pyautogui = pyautogui
+
+    def grab_into(self, region: Region, out: np.ndarray) -> np.ndarray:
+        shot = self._pyautogui.screenshot(region=region)
+        cv2.cvtColor(np.asarray(shot), cv2.COLOR_RGB2GRAY, dst=out)
+        return out
+
+    def close(self):
+        pass
+
+
+class DirectorySource:
+    """Replays recorded frames from a folder (sorted by name), looping forever.
+
+    Frames are decoded once up front so replay measures the capture path,
+    not PNG decoding.  The region is applied as a crop of each frame.
+    """
+
+    def __init__(self, folder: str):
+        paths = sorted(p for p in glob.glob(os.path.join(folder, "*.*")) if p.lower().endswith(IMAGE_EXTS))
+        if not paths:
+            raise RuntimeError(f"No frames found in: {folder}")
+        self.paths = paths
+        self._frames: List[np.ndarray] = []
+        for p in paths:
+            data = np.fromfile(p, dtype=np.uint8)
+            img = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+            if img is None:
+                raise RuntimeError(f"Failed to read frame: {p}")
+            self._frames.append(img)
+        self._i = 0
+
+    @property
+    def frame_size(self) -> Tuple[int, int]:
+        h, w = self._frames[0].shape[:2]
+        return w, h
+
+    def grab_into(self, region: Region, out: np.ndarray) -> np.ndarray:
+        left, top, width, height = region
+        k = self._i % len(self._frames)
+        self._i += 1
+        crop = self._frames[k][top:top + height, left:left + width]
+        if crop.shape != out.shape:
+            h, w = self._frames[k].shape[:2]
+            raise RuntimeError(f"Frame {self.paths[k]} is {w}x{h}, too small for capture region {region}")
+        np.copyto(out, crop)
+        return out
+
+    def close(self):
+        pass
+
+
+def make_source(frames_dir: Optional[str] = None):
+    if frames_dir:
+        return DirectorySource(frames_dir)
+    if mss is not None:
+        return MssSource()
+    return PyAutoGuiSource()
+
+
+def clip_region(region: Region, size: Tuple[int, int]) -> Region:
+    """Clips a region to a (width, height) frame; ValueError if nothing is left."""
+    left, top, width, height = region
+    w, h = size
+    x0, y0 = max(0, left), max(0, top)
+    x1, y1 = min(w, left + width), min(h, top + height)
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f"Capture region {region} lies outside the {w}x{h} frame")
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def window_region(title: str = TARGET_WINDOW_TITLE) -> Region:
+    """Screen region of the VM window (pygetwindow), as (left, top, width, height)."""
+    import pygetwindow as gw
+    try:
+        win = gw.getWindowsWithTitle(title)[0]
+    except IndexError:
+        raise Exception(f"The '{title}' window was not found. Is the application running in the VM?")
+    return (int(win.left), int(win.top), int(win.width), int(win.height))
+
+
+# --------------------------------- Capture ------------------------------------
+class ScreenCapture:
+    """Region capture with a preallocated ring of frames and latency stats.
+
+    grab() returns a view into the ring; it stays valid until `ring_size`
+    further grabs have happened.  Copy it if you need to keep it longer.
+    """
+
+    def __init__(self, region: Region, source=None, fps: Optional[float] = None,
+                 ring_size: int = 4, stats_window: int = 512):
+        left, top, width, height = [int(v) for v in region]
+        if width <= 0 or height <= 0:
+            raise ValueError(f"Invalid capture region: {region}")
+        self.source = source if source is not None else make_source()
+        size = getattr(self.source, "frame_size", None)
+        if size is not None:
+            # Recorded frames have a known size; a larger region would fail in every grab
+            clipped = clip_region((left, top, width, height), size)
+            if clipped != (left, top, width, height):
+                print(f"[warn] Capture region {tuple(region)} clipped to the {size[0]}x{size[1]} frame: {clipped}")
+            left, top, width, height = clipped
+        self.region: Region = (left, top, width, height)
+        self.fps = fps
+        self._ring = np.empty((max(1, ring_size), height, width), dtype=np.uint8)
+        self._stamps = [0.0] * len(self._ring)
+        self._next = 0
+        self._count = 0
+        self._latencies_ms: deque = deque(maxlen=stats_window)
+        self._last_grab_at: Optional[float] = None
+
+    def grab(self) -> np.ndarray:
+        slot = self._next
+        t0 = time.perf_counter()
+        self.source.grab_into(self.region, self._ring[slot])
+        t1 = time.perf_counter()
+        self._latencies_ms.append((t1 - t0) * 1000.0)
+        self._stamps[slot] = t1
+        self._next = (slot + 1) % len(self._ring)
+        self._count += 1
+        self._last_grab_at = t1
+        return self._ring[slot]
+
+    def latest(self) -> Optional[np.ndarray]:
+        if self._count == 0:
+            return None
+        return self._ring[(self._next - 1) % len(self._ring)]
+
+    def recent(self) -> List[Tuple[float, np.ndarray]]:
+        """Up to ring_size most recent (timestamp, frame) pairs, oldest first."""
+        n = min(self._count, len(self._ring))
+        out = []
+        for k in range(n, 0, -1):
+            slot = (self._next - k) % len(self._ring)
+            out.append((self._stamps[slot], self._ring[slot]))
+        return out
+
+    def frames(self, max_frames: Optional[int] = None) -> Iterator[np.ndarray]:
+        """Yield frames paced to the target FPS (as fast as possible if fps is None)."""
+        period = (1.0 / self.fps) if self.fps else 0.0
+        n = 0
+        while max_frames is None or n < max_frames:
+            if period and self._last_grab_at is not None:
+                wait = self._last_grab_at + period - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+            yield self.grab()
+            n += 1
+
+    def stats(self) -> Dict[str, float]:
+        lat = sorted(self._latencies_ms)
+        if not lat:
+            return {"count": self._count}
+        return {
+            "count": self._count,
+            "mean_ms": sum(lat) / len(lat),
+            "p50_ms": lat[len(lat) // 2],
+            "p95_ms": lat[min(len(lat) - 1, int(len(lat) * 0.95))],
+            "max_ms": lat[-1],
+        }
+
+    def close(self):
+        self.source.close()
+
+
+# ------------------------------------ CLI -------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Capture the VM window region and report per-frame latency.")
+    ap.add_argument("--region", type=str, help="left,top,width,height (default: the VM window).")
+    ap.add_argument("--title", type=str, default=TARGET_WINDOW_TITLE, help="VM window title.")
+    ap.add_argument("--frames-dir", type=str, help="Replay recorded frames from this folder instead of the screen.")
+    ap.add_argument("--fps", type=float, default=None, help="Target capture rate (default: unthrottled).")
+    ap.add_argument("--count", type=int, default=100, help="Number of frames to capture.")
+    ap.add_argument("--ring", type=int, default=4, help="Ring buffer size.")
+    args = ap.parse_args()
+    if args.count < 1:
+        ap.error("--count must be at least 1")
+
+    source = make_source(args.frames_dir)
+    if args.region:
+        region = tuple(int(v) for v in args.region.split(","))
+    elif isinstance(source, DirectorySource):
+        w, h = source.frame_size
+        region = (0, 0, w, h)
+    else:
+        region = window_region(args.title)
+
+    try:
+        cap = ScreenCapture(region, source=source, fps=args.fps, ring_size=args.ring)
+    except ValueError as e:
+        print(f"[error] {e}")
+        raise SystemExit(1)
+    print(f"Capturing region {cap.region} with {type(source).__name__} ...")
+    t0 = time.perf_counter()
+    for _ in cap.frames(max_frames=args.count):
+        pass
+    elapsed = time.perf_counter() - t0
+    cap.close()
+
+    st = cap.stats()
+    print(f"[ok] {st['count']} frames in {elapsed:.2f}s ({st['count'] / elapsed:.1f} fps)")
+    print(f"     latency mean={st['mean_ms']:.2f}ms p50={st['p50_ms']:.2f}ms "
+          f"p95={st['p95_ms']:.2f}ms max={st['max_ms']:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# scroll_test.py - headless check of read_patient_list.iter_all_patients scrolling
+#
+# Simulates the legacy list: a fixed header line over N data rows that the
+# mouse wheel moves --lines rows per notch, while read_patient_list assumes
+# LIST_WHEEL_LINES (default 3).  Passes when every data row is OCRed exactly
+# once; a list that scrolls further per notch than assumed must be caught by
+# the overlap check and retried, not skipped.
+#
+#   python scroll_test.py --lines 6
+import os
+import sys
+import argparse
+
+from lazy_deps import cv2, np
+import read_patient_list as rpl
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "insert"))
+from input_backend import RecordingBackend
+
+ROW_H = 24
+WIDTH = 900
+
+
+def _row_image(text: str) -> np.ndarray:
+    img = np.full((ROW_H, WIDTH), 240, np.uint8)
+    cv2.putText(img, text, (10, 17), cv2.FONT_HERSHEY_SIMPLEX, 0.5, 0, 1)
+    return img
+
+
+class SimulatedList:
+    """capture (grab) + backend (scroll) for a list with a fixed header line."""
+
+    def __init__(self, rows: int, visible: int, lines_per_notch: int):
+        self.header = _row_image("Patient_ID  Name  Address  DOB  Age/Sex")
+        self.rows = [_row_image(f"{100 + i}  Name{i}  {i} Street  01/02/19{10 + i % 90}  40 M") for i in range(rows)]
+        self.visible = visible
+        self.lines = lines_per_notch
+        self.top = 0
+
+    def grab(self) -> np.ndarray:
+        return np.vstack([self.header] + self.rows[self.top:self.top + self.visible])
+
+    def scroll(self, notches: int):
+        self.top = max(0, min(len(self.rows) - self.visible, self.top - notches * self.lines))
+
+
+class SimulatedBackend(RecordingBackend):
+    def __init__(self, view: SimulatedList):
+        super().__init__()
+        self.view = view
+
+    def scroll(self, clicks: int):
+        super().scroll(clicks)
+        self.view.scroll(clicks)
+
+
+def run(rows: int = 60, visible: int = 15, lines: int = 6, assumed: int = 3) -> dict:
+    view = SimulatedList(rows, visible, lines)
+    ocred = []
+
+    def ocr(strip, skip_header):
+        # One "patient" per data band; the strip is the stacked new bands
+        bands = rpl.split_row_bands(strip)
+        n = len(bands) - (1 if skip_header else 0)
+        ocred.extend(range(len(ocred), len(ocred) + n))
+        return "", []
+
+    rpl.LIST_WHEEL_LINES = assumed
+    stats = {}
+    list(rpl.iter_all_patients(capture=view, backend=SimulatedBackend(view), scroll="wheel", settle=0,
+                               ocr=ocr, stats=stats))
+    stats["data_rows_ocred"] = len(ocred)
+    return stats
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Headless check that --scroll wheel reads every row of the list.")
+    ap.add_argument("--rows", type=int, default=60, help="Data rows in the simulated list.")
+    ap.add_argument("--visible", type=int, default=15, help="Data rows visible per view.")
+    ap.add_argument("--lines", type=int, default=6, help="Rows the simulated list moves per wheel notch.")
+    ap.add_argument("--assumed", type=int, default=3, help="LIST_WHEEL_LINES used by read_patient_list.")
+    args = ap.parse_args()
+
+    stats = run(args.rows, args.visible, args.lines, args.assumed)
+    print(f"[info] {stats}")
+    if stats["data_rows_ocred"] != args.rows:
+        print(f"[error] OCRed {stats['data_rows_ocred']} of {args.rows} rows")
+        sys.exit(1)
+    print(f"[ok] All {args.rows} rows OCRed once ({stats['gaps']} gaps recovered)")
+
+
+if __name__ == "__main__":
+    main()
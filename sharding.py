@@ -0,0 +1,133 @@
+# sharding.py - split ocr_table_model.py --parse across machines, and merge back
+#
+# Every machine lists the same shared scan folder and keeps only the images
+# whose stable hash lands on its shard:
+#
+#   python ocr_table_model.py --parse scans --template t.json --shard 0/3 --out rows_0.json
+#   python ocr_table_model.py --parse scans --template t.json --shard 1/3 --out rows_1.json
+#   python ocr_table_model.py --parse scans --template t.json --shard 2/3 --out rows_2.json
+#   python ocr_table_model.py --merge rows_0.json rows_1.json rows_2.json --out rows.json
+#
+# The hash key is the image path relative to the parse folder ("path", same
+# on every machine that mounts the folder) or the file's bytes ("content",
+# immune to renames and different mount layouts).  Python's hash() is salted
+# per process, so blake2b is used.  Each shard writes <out>.manifest.json
+# next to its rows; merge uses the manifests to put the rows back in
+# single-machine order and to check that no image was missed or parsed twice.
+import os
+import json
+import hashlib
+from typing import Dict, List, Tuple
+
+
+def parse_shard_spec(spec: str) -> Tuple[int, int]:
+    """Parses "i/N" into (i, N) with 0 <= i < N."""
+    try:
+        i, n = (int(v) for v in spec.split("/"))
+    except ValueError:
+        raise SystemExit(f"--shard must look like i/N (e.g. 0/4), got: {spec}")
+    if n < 1 or not 0 <= i < n:
+        raise SystemExit(f"--shard index out of range: {spec}")
+    return i, n
+
+
+def relative_image_path(path: str, root: str) -> str:
+    return os.path.relpath(path, root).replace(os.sep, "/")
+
+
+def image_key(path: str, root: str, key: str = "path") -> str:
+    rel = relative_image_path(path, root)
+    if key == "content":
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+    return rel
+
+
+def shard_of(path: str, root: str, n: int, key: str = "path") -> int:
+    digest = hashlib.blake2b(image_key(path, root, key).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % n
+
+
+def select_shard(paths: List[str], root: str, shard: Tuple[int, int], key: str = "path") -> List[str]:
+    i, n = shard
+    return [p for p in paths if shard_of(p, root, n, key) == i]
+
+
+def manifest_path(out_path: str) -> str:
+    return out_path + ".manifest.json"
+
+
+def write_manifest(out_path: str, shard: Tuple[int, int], key: str, total_images: int,
+                   assigned: List[str], images: List[Dict]) -> None:
+    """images: [{"image": rel_path, "rows": n, "status": parsed|skipped|linked[, "linked_to": rel_path]}] in output order."""
+    data = {
+        "shard": list(shard),
+        "key": key,
+        "total_images": total_images,
+        "assigned": assigned,
+        "images": images,
+    }
+    with open(manifest_path(out_path), "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+def merge_shards(row_files: List[str]) -> Tuple[List[Dict], List[str]]:
+    """Combines per-shard outputs into single-machine order; returns (rows, problems)."""
+    problems: List[str] = []
+    per_image: Dict[str, List[Dict]] = {}
+    owner: Dict[str, str] = {}
+    shards_seen: Dict[int, str] = {}
+    n_values, keys, totals = set(), set(), set()
+
+    for rf in row_files:
+        mf = manifest_path(rf)
+        if not os.path.isfile(mf):
+            problems.append(f"{rf}: no manifest ({mf}); was it written with --shard?")
+            continue
+        with open(mf, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        with open(rf, "r", encoding="utf-8") as f:
+            rows = json.load(f)
+        i, n = manifest["shard"]
+        n_values.add(n)
+        keys.add(manifest["key"])
+        totals.add(manifest["total_images"])
+        if i in shards_seen:
+            problems.append(f"shard {i}/{n} appears twice: {shards_seen[i]} and {rf}")
+        shards_seen[i] = rf
+
+        if sum(e["rows"] for e in manifest["images"]) != len(rows):
+            problems.append(f"{rf}: row count does not match its manifest")
+            continue
+        done = [e["image"] for e in manifest["images"]]
+        for img in sorted(set(manifest["assigned"]) - set(done)):
+            problems.append(f"{img}: assigned to shard {i} but not processed")
+        pos = 0
+        for e in manifest["images"]:
+            img = e["image"]
+            if img in owner:
+                problems.append(f"{img}: processed by both {owner[img]} and {rf}")
+            owner[img] = rf
+            per_image[img] = rows[pos:pos + e["rows"]]
+            pos += e["rows"]
+
+    if len(n_values) > 1 or len(keys) > 1:
+        problems.append(f"shards disagree on N / key: N={sorted(n_values)} key={sorted(keys)}")
+    if len(n_values) == 1:
+        n = n_values.pop()
+        missing = sorted(set(range(n)) - set(shards_seen))
+        if missing:
+            problems.append(f"missing shard(s) {missing} of {n}")
+    if len(totals) > 1:
+        problems.append(f"shards listed different folder sizes {sorted(totals)}; did the folder change?")
+    elif totals and not problems and len(owner) != next(iter(totals)):
+        problems.append(f"{len(owner)} images processed, but the folder had {next(iter(totals))}")
+
+    merged: List[Dict] = []
+    # Same order as a single-machine run (sorted paths)
+    for img in sorted(per_image):
+        merged.extend(per_image[img])
+    return merged, problems
@@ -0,0 +1,159 @@
+# verify_inserts.py - batched read-back verification of inserted patients
+#
+# fill_patient_form() clicks "Add" without checking the result.  Instead of
+# verifying each record (one capture + OCR per insert), BatchVerifier collects
+# N submitted records and then reads the legacy patient list once
+# (read_patient_list.py) and reconciles the whole batch against it.
+import re
+import sys
+import json
+import argparse
+from typing import Callable, Dict, List, Optional
+
+
+def _norm(s) -> str:
+    return re.sub(r"\s+", " ", str(s or "").strip().lower())
+
+
+def _digits(s) -> str:
+    return re.sub(r"[^\d]", "", str(s or ""))
+
+
+def _observed_fields(row: Dict) -> Dict[str, str]:
+    """Maps a parsed list row (read_patient_list format) onto comparable fields."""
+    # The list parser splits "name address" at the first space, so compare
+    # name and address as one string rather than trusting that boundary.
+    age_sex = str(row.get("Age/Sex", ""))
+    age = _digits(age_sex.split()[0]) if age_sex.split() else ""
+    sex_letters = re.sub(r"[^A-Za-z]", "", age_sex)
+    return {
+        "id": _digits(row.get("Patient_ID")),
+        "name_address": _norm(f"{row.get('Patient_Name', '')} {row.get('Address', '')}"),
+        "name": _norm(row.get("Patient_Name")),
+        "date_of_birth": _norm(row.get("Date_Of_Birth")),
+        "age": age,
+        "sex": sex_letters[:1].upper(),
+    }
+
+
+def _expected_fields(rec: Dict) -> Dict[str, str]:
+    return {
+        "id": _digits(rec.get("id")),
+        "name_address": _norm(f"{rec.get('name', '')} {rec.get('address', '')}"),
+        "name": _norm(str(rec.get("name", "")).split(" ")[0]),
+        "date_of_birth": _norm(rec.get("date_of_birth")),
+        "age": _digits(rec.get("age")),
+        "sex": str(rec.get("sex", "")).strip().upper()[:1],
+    }
+
+
+def reconcile(expected: List[Dict], observed: List[Dict]) -> Dict[str, List]:
+    """Reconciles submitted records against rows read back from the legacy list.
+
+    Records are matched by ID when both sides have one, otherwise by first
+    name.  Returns {"ok": [...], "missing": [...], "mismatched": [(rec, row, [fields])]}.
+    """
+    obs = [(_observed_fields(r), r) for r in observed]
+    by_id: Dict[str, List] = {}
+    by_name: Dict[str, List] = {}
+    for f, r in obs:
+        if f["id"]:
+            by_id.setdefault(f["id"], []).append((f, r))
+        by_name.setdefault(f["name"], []).append((f, r))
+
+    report: Dict[str, List] = {"ok": [], "missing": [], "mismatched": []}
+    used = set()
+
+    def pick(cands: List, ef: Dict):
+        # Each observed row confirms one record; prefer the one whose full text matches
+        cands = [c for c in cands if id(c[1]) not in used]
+        cands.sort(key=lambda c: c[0]["name_address"] != ef["name_address"])
+        return cands[0] if cands else None
+
+    for rec in expected:
+        ef = _expected_fields(rec)
+        hit = pick(by_id.get(ef["id"], []), ef) if ef["id"] else None
+        if hit is None:
+            # Fall back to name
+            hit = pick(by_name.get(ef["name"], []), ef)
+        if hit is None:
+            report["missing"].append(rec)
+            continue
+        of, row = hit
+        used.add(id(row))
+        bad = [k for k in ("name_address", "date_of_birth", "age", "sex") if ef[k] and ef[k] != of[k]]
+        if bad:
+            report["mismatched"].append((rec, row, bad))
+        else:
+            report["ok"].append(rec)
+    return report
+
+
+class BatchVerifier:
+    """Collects submitted records and verifies them every `batch_size` inserts.
+
+    `reader` returns the rows currently visible in the legacy list; by default
+    it is read_patient_list.read_patient_list (one capture + one OCR pass).
+    """
+
+    def __init__(self, batch_size: int = 10, reader: Optional[Callable[[], List[Dict]]] = None):
+        self.batch_size = max(1, int(batch_size))
+        self._reader = reader
+        self.pending: List[Dict] = []
+        self.to_reinsert: List[Dict] = []
+
+    def _read(self) -> List[Dict]:
+        if self._reader is None:
+            from read_patient_list import read_patient_list
+            self._reader = read_patient_list
+        return self._reader()
+
+    def add(self, record: Dict) -> Optional[Dict[str, List]]:
+        """Records a submitted patient; returns a report when a batch was verified."""
+        self.pending.append(dict(record))
+        if len(self.pending) >= self.batch_size:
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[Dict[str, List]]:
+        """Verifies whatever is pending now (e.g. at the end of a session)."""
+        if not self.pending:
+            return None
+        observed = self._read()
+        batch, self.pending = self.pending, []
+        report = reconcile(batch, observed)
+        self.to_reinsert.extend(report["missing"])
+        self.to_reinsert.extend(rec for rec, _, _ in report["mismatched"])
+        return report
+
+
+def format_report(report: Dict[str, List]) -> str:
+    lines = [f"Verified {len(report['ok'])} ok, {len(report['missing'])} missing, "
+             f"{len(report['mismatched'])} mismatched."]
+    for rec in report["missing"]:
+        lines.append(f"  MISSING    id={rec.get('id', '')} name={rec.get('name', '')}")
+    for rec, _, fields in report["mismatched"]:
+        lines.append(f"  MISMATCHED id={rec.get('id', '')} name={rec.get('name', '')} fields={','.join(fields)}")
+    return "\n".join(lines)
+
+
+# ------------------------------------ CLI -------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Verify a batch of inserted patients against the legacy list.")
+    ap.add_argument("expected", type=str, help="JSON file with the submitted records (list of dicts).")
+    args = ap.parse_args()
+
+    with open(args.expected, "r", encoding="utf-8") as f:
+        expected = json.load(f)
+
+    verifier = BatchVerifier(batch_size=len(expected) + 1)
+    verifier.pending = list(expected)
+    report = verifier.flush() or {"ok": [], "missing": [], "mismatched": []}
+    print(format_report(report))
+    if verifier.to_reinsert:
+        print(json.dumps(verifier.to_reinsert, indent=2))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()